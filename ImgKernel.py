@@ -0,0 +1,262 @@
+import functools
+import numpy as np
+
+# Numba是可选的依赖, 安装后逐像素的循环编译为本地代码, 没有安装时使用NumPy的实现, 两种实现的结果相同
+# Numba导入较慢, 第一次调用内核时才导入
+numba = None
+numba_loaded = False  # 是否已经尝试过导入Numba
+
+BACKENDS = ("numba", "numpy")
+backend = None  # 当前使用的实现, 为None时在第一次调用内核时选择
+
+'''
+@brief 导入Numba, 只在第一次调用时尝试导入
+@return numba: Numba模块, 没有安装或导入失败(例如与NumPy的版本不兼容)时为None
+'''
+def load_numba ():
+    global numba, numba_loaded
+
+    if not numba_loaded:
+        numba_loaded = True
+        try:
+            import numba as module
+            numba = module
+        except ImportError:
+            numba = None
+    return numba
+
+'''
+@brief 选择内核的实现
+@param name: "numba"或"numpy"
+'''
+def set_backend (name):
+    global backend
+
+    if name not in BACKENDS:
+        raise ValueError("unknown backend: %s" % name)
+    if name == "numba" and load_numba() is None:
+        raise ImportError("numba is not installed or failed to import")
+    backend = name
+
+'''
+@brief 获取当前使用的实现, 还没有选择时, 能导入Numba则使用"numba", 否则使用"numpy"
+@return backend: "numba"或"numpy"
+'''
+def get_backend ():
+    global backend
+
+    if backend is None:
+        backend = "numba" if load_numba() is not None else "numpy"
+    return backend
+
+'''
+@brief 把逐元素循环的函数编译为本地代码, 第一次调用时才编译, 只在能导入Numba时调用
+'''
+def jit (func):
+    compiled = []
+
+    @functools.wraps(func)
+    def wrapper (*args):
+        if len(compiled) == 0:
+            compiled.append(load_numba().njit(cache = True, nogil = True)(func))
+        return compiled[0](*args)
+    return wrapper
+
+'''
+@brief 路径压缩的并查集合并(向量化), 每个集合的根为集合中最小的编号
+@param parent: 初始的父节点数组
+@param edge_a: 边的一端
+@param edge_b: 边的另一端
+@return parent: 每个节点的根节点
+'''
+def union_find_numpy (parent, edge_a, edge_b):
+    while True:
+        # 路径压缩, 直到每个节点直接指向根节点
+        while True:
+            grand_parent = parent[parent]
+            if np.array_equal(grand_parent, parent):
+                break
+            parent = grand_parent
+
+        # 对每条边, 把较大的根挂到较小的根上
+        root_a = parent[edge_a]
+        root_b = parent[edge_b]
+        diff = root_a != root_b
+        if not np.any(diff):
+            return parent
+        root_min = np.minimum(root_a[diff], root_b[diff])
+        root_max = np.maximum(root_a[diff], root_b[diff])
+        np.minimum.at(parent, root_max, root_min)
+
+'''
+@brief 并查集合并(逐条边处理), 与union_find_numpy的结果相同
+'''
+def union_find_loop (parent, edge_a, edge_b):
+    parent = parent.copy()
+    for k in range(edge_a.shape[0]):
+        # 查找根节点, 同时进行路径减半
+        root_a = edge_a[k]
+        while parent[root_a] != root_a:
+            parent[root_a] = parent[parent[root_a]]
+            root_a = parent[root_a]
+        root_b = edge_b[k]
+        while parent[root_b] != root_b:
+            parent[root_b] = parent[parent[root_b]]
+            root_b = parent[root_b]
+
+        # 把较大的根挂到较小的根上
+        if root_a < root_b:
+            parent[root_b] = root_a
+        elif root_b < root_a:
+            parent[root_a] = root_b
+
+    # 父节点的编号总是不大于自身, 按编号从小到大处理即可使每个节点直接指向根节点
+    for i in range(parent.shape[0]):
+        parent[i] = parent[parent[i]]
+    return parent
+
+'''
+@brief 对多条扫描线进行游程编码, 统计数值变化的次数和第一次变化到第二次变化的距离(全部扫描线一次完成)
+@param lines: 扫描线, 形状为(m, 长度), 较短的扫描线用最后一个像素填充
+@param lengths: 每条扫描线的实际长度
+@return count: 每条扫描线数值变化的次数
+@return first_to_second: 第一次变化到第二次变化的距离, 只变化一次时为第一次变化到末尾的距离, 没有变化时为0
+'''
+def count_transitions_numpy (lines, lengths):
+    rows, change = np.nonzero(np.diff(lines, axis = 1) != 0)  # 按行优先的顺序给出每个变化的位置
+    count = np.bincount(rows, minlength = lines.shape[0])
+    start = np.cumsum(count) - count  # 每条扫描线的第一个变化在rows中的序号
+
+    first_to_second = np.zeros(lines.shape[0], dtype = np.int64)
+    has_one = count >= 1
+    has_two = count >= 2
+    first = change[start[has_one]] + 1
+    second = np.where(has_two[has_one], change[np.minimum(start[has_one] + 1, change.shape[0] - 1)] + 1, lengths[has_one])
+    first_to_second[has_one] = second - first
+    return count, first_to_second
+
+'''
+@brief 统计扫描线中数值变化的次数(逐像素遍历), 与count_transitions_numpy的结果相同
+'''
+def count_transitions_loop (lines, lengths):
+    count = np.zeros(lines.shape[0], dtype = np.int64)
+    first_to_second = np.zeros(lines.shape[0], dtype = np.int64)
+    for k in range(lines.shape[0]):
+        first = 0
+        for i in range(1, lines.shape[1]):
+            if lines[k, i] != lines[k, i - 1]:  # 数值变化, 次数加1
+                count[k] += 1
+                if count[k] == 1:
+                    first = i
+                elif count[k] == 2:
+                    first_to_second[k] = i - first
+        if count[k] == 1:
+            first_to_second[k] = lengths[k] - first
+    return count, first_to_second
+
+'''
+@brief 通过颜色查找表对rgb像素进行颜色分类
+@param rgb_array: rgb像素, 形状为(像素数, 3)
+@param lut: 颜色查找表, 每个字节依次存放4个颜色的分类(低位在前)
+@return color_class: 与像素一一对应, 1: 红色, 2: 绿色, 3: 紫色, 0: 其他
+'''
+def classify_rgb_numpy (rgb_array, lut):
+    rgb_array = rgb_array.astype(np.uint32)
+    code = (rgb_array[..., 0] << 16) | (rgb_array[..., 1] << 8) | rgb_array[..., 2]
+    packed = lut[code >> 2]
+    return (packed >> ((code & 3) << 1).astype(np.uint8)) & 3
+
+'''
+@brief 通过颜色查找表对rgb像素进行颜色分类(逐像素处理), 与classify_rgb_numpy的结果相同
+'''
+def classify_rgb_loop (rgb_array, lut):
+    color_class = np.empty(rgb_array.shape[0], dtype = np.uint8)
+    for i in range(rgb_array.shape[0]):
+        code = (np.uint32(rgb_array[i, 0]) << 16) | (np.uint32(rgb_array[i, 1]) << 8) | np.uint32(rgb_array[i, 2])
+        color_class[i] = (lut[code >> 2] >> ((code & 3) << 1)) & 3
+    return color_class
+
+# 编译后的内核, 第一次调用时导入Numba并编译, 编译结果缓存在磁盘上
+union_find_jit = jit(union_find_loop)
+count_transitions_jit = jit(count_transitions_loop)
+classify_rgb_jit = jit(classify_rgb_loop)
+
+'''
+@brief 并查集合并, 按当前的实现分派
+'''
+def union_find (parent, edge_a, edge_b):
+    if get_backend() == "numba":
+        return union_find_jit(parent, edge_a, edge_b)
+    return union_find_numpy(parent, edge_a, edge_b)
+
+'''
+@brief 统计扫描线中数值变化的次数, 按当前的实现分派
+@param lines: 扫描线, 形状为(m, 长度)
+@param lengths: 每条扫描线的实际长度
+@return count: 每条扫描线数值变化的次数
+@return first_to_second: 第一次变化到第二次变化的距离
+'''
+def count_transitions (lines, lengths):
+    if get_backend() == "numba":
+        return count_transitions_jit(np.ascontiguousarray(lines), np.asarray(lengths, dtype = np.int64))
+    return count_transitions_numpy(lines, lengths)
+
+'''
+@brief 通过颜色查找表对rgb像素进行颜色分类, 按当前的实现分派
+@param rgb_array: rgb图像数组, 最后一维为[r, g, b]
+@param lut: 颜色查找表
+@return color_class: 与像素一一对应
+'''
+def classify_rgb (rgb_array, lut):
+    if get_backend() == "numba":
+        pixels = np.ascontiguousarray(rgb_array).reshape(-1, 3)
+        return classify_rgb_jit(pixels, np.asarray(lut)).reshape(rgb_array.shape[:-1])  # 内存映射的查找表转换为普通数组(不复制)
+    return classify_rgb_numpy(rgb_array, lut)
+
+'''
+@brief 检查两种实现的结果是否相同, 使用随机生成的输入
+       没有安装Numba时, 对比的是NumPy的实现和未编译的逐元素循环(与Numba编译的是同一份代码)
+@param seed: 随机数种子
+@param size: 输入的规模
+@return mismatches: 结果不同的内核名称列表, 为空表示全部一致
+'''
+def check_parity (seed = 0, size = 2000):
+    rng = np.random.default_rng(seed)
+    has_numba = load_numba() is not None
+    union_find_other = union_find_jit if has_numba else union_find_loop
+    count_transitions_other = count_transitions_jit if has_numba else count_transitions_loop
+    classify_rgb_other = classify_rgb_jit if has_numba else classify_rgb_loop
+
+    mismatches = []
+
+    # 随机的边
+    nodes = size
+    edge_a = rng.integers(0, nodes, size // 2)
+    edge_b = rng.integers(0, nodes, size // 2)
+    if not np.array_equal(union_find_numpy(np.arange(nodes), edge_a, edge_b), union_find_other(np.arange(nodes), edge_a, edge_b)):
+        mismatches.append("union_find")
+
+    # 随机的二值扫描线, 较短的扫描线用最后一个像素填充, 包括长度为0, 1和没有变化的扫描线
+    length = 200
+    lengths = rng.integers(0, length + 1, size // 10)
+    lengths[:3] = [0, 1, length]
+    lines = (rng.random((lengths.shape[0], length)) < rng.random((lengths.shape[0], 1))).astype(np.uint8) * 255
+    lines[2] = 255
+    lines = lines[np.arange(lengths.shape[0])[:, None], np.minimum(np.arange(length), np.maximum(lengths - 1, 0)[:, None])]
+    count_numpy, first_numpy = count_transitions_numpy(lines, lengths)
+    count_other, first_other = count_transitions_other(lines, lengths)
+    if not (np.array_equal(count_numpy, count_other) and np.array_equal(first_numpy, first_other)):
+        mismatches.append("count_transitions")
+
+    # 随机的颜色查找表和像素
+    lut = rng.integers(0, 256, 1 << 22).astype(np.uint8)
+    pixels = rng.integers(0, 256, (size * 10, 3)).astype(np.uint8)
+    if not np.array_equal(classify_rgb_numpy(pixels, lut), classify_rgb_other(pixels, lut)):
+        mismatches.append("classify_rgb")
+
+    return mismatches
+
+if __name__ == '__main__':
+    print("backend: %s" % get_backend())
+    mismatches = check_parity()
+    print("parity: %s" % ("ok" if len(mismatches) == 0 else "mismatch in " + ", ".join(mismatches)))
@@ -1,188 +1,272 @@
-import numpy as np
-from numpy.lib.stride_tricks import sliding_window_view
-from PIL import Image
-
-'''
-@brief RGB空间转换到HSV空间
-'''
-def rgb_to_hsv (image_array):
-    image = Image.fromarray(image_array, mode = 'RGB')
-    image = image.convert("HSV")
-    hsv_image_array = np.array(image)
-    return hsv_image_array
-
-'''
-@brief HSV空间转换到RGB空间
-'''
-def hsv_to_rgb (image_array):
-    image = Image.fromarray(image_array, mode = 'HSV')
-    image = image.convert("RGB")
-    rgb_image_array = np.array(image)
-    return rgb_image_array
-
-'''
-@brief RGB空间转换到灰度空间
-'''
-def rgb_to_gray (image_array):
-    image = Image.fromarray(image_array, mode = 'RGB')
-    image = image.convert("L")
-    gray_image_array = np.array(image)
-    return gray_image_array
-
-'''
-@brief 图像二值化
-'''
-def image_binarization (image_array, threshold):
-    image_array[image_array > threshold] = 255
-    image_array[image_array <= threshold] = 0
-    return image_array
-
-'''
-@brief 形态学处理
-'''
-def morphology_process (image_array, method, dilation_se_size = 3, erosion_se_size = 3):
-    # 获取图像行数和列数
-    rows = image_array.shape[0]
-    columns = image_array.shape[1]
-
-    # 膨胀或者腐蚀
-    if method == "dilation" or method == "erosion":
-        # 获取结构元大小
-        if method == "dilation":
-            se_size = dilation_se_size
-        elif method == "erosion":
-            se_size = erosion_se_size
-
-        # 边缘填充，采用零填充
-        new_rows = rows + se_size - 1
-        new_columns = columns + se_size - 1
-        expand_array = np.zeros((new_rows, new_columns))
-        offset = int((se_size - 1) / 2)
-        expand_array[offset : rows + offset, offset : columns + offset] = np.copy(image_array)
-
-        # 形态学处理
-        se = np.ones((se_size, se_size))
-        windows = sliding_window_view(expand_array, (se_size, se_size))
-        if method == "dilation":
-            result = np.max(np.multiply(windows[:, :], se), axis = (-2, -1))
-        elif method == "erosion":
-            result = np.min(np.multiply(windows[:, :], se), axis = (-2, -1))
-    # 开运算或者闭运算
-    elif method == "opening" or method == "closing":
-        # 获取两个结构元大小
-        if method == "opening":
-            se_size_1 = erosion_se_size
-            se_size_2 = dilation_se_size
-        elif method == "closing":
-            se_size_1 = dilation_se_size
-            se_size_2 = erosion_se_size
-
-        # 第一次边缘填充，采用零填充
-        new_rows = rows + se_size_1 - 1
-        new_columns = columns + se_size_1 - 1
-        expand_array_1 = np.zeros((new_rows, new_columns))
-        offset = int((se_size_1 - 1) / 2)
-        expand_array_1[offset : rows + offset, offset : columns + offset] = np.copy(image_array)
-
-        # 第一次形态学处理
-        se_1 = np.ones((se_size_1, se_size_1))
-        windows_1 = sliding_window_view(expand_array_1, (se_size_1, se_size_1))
-        if method == "opening":  # 先进行腐蚀
-            result = np.min(np.multiply(windows_1[:, :], se_1), axis = (-2, -1))
-        elif method == "closing":  # 先进行膨胀
-            result = np.max(np.multiply(windows_1[:, :], se_1), axis = (-2, -1))
-
-        # 第二次边缘填充，采用零填充
-        new_rows = rows + se_size_2 - 1
-        new_columns = columns + se_size_2 - 1
-        expand_array_2 = np.zeros((new_rows, new_columns))
-        offset = int((se_size_2 - 1) / 2)
-        expand_array_2[offset : rows + offset, offset : columns + offset] = np.copy(result)
-
-        # 第二次形态学处理
-        se_2 = np.ones((se_size_2, se_size_2))
-        windows_2 = sliding_window_view(expand_array_2, (se_size_2, se_size_2))
-        if method == "opening":  # 后进行膨胀
-            result = np.max(np.multiply(windows_2[:, :], se_2), axis = (-2, -1))
-        elif method == "closing":  # 后进行腐蚀
-            result = np.min(np.multiply(windows_2[:, :], se_2), axis = (-2, -1))
-
-    return result
-
-'''
-@brief 连通域检测
-'''
-def connected_analysis (image_array):
-    image_array = morphology_process(image_array, "opening", dilation_se_size = 5, erosion_se_size = 5)
-
-    label_value = 0
-    values = np.zeros(4, dtype = np.int32)
-    labels = np.zeros(4, dtype = np.int32)
-    equ_label = np.arange(image_array.shape[0] * image_array.shape[1])
-
-    expand_array = np.pad(image_array, pad_width = 1, mode = 'constant', constant_values = 0)
-
-    rows = expand_array.shape[0]
-    columns = expand_array.shape[1]
-    array_with_label = np.zeros((rows, columns, 2), dtype = np.int32)
-    array_with_label[:, :, 0] = expand_array
-    array_with_label[:, :, 1] = -1  # 表示未打标签
-
-    for i in range(1, rows - 1):
-        for j in range(1, columns - 1):
-            if array_with_label[i, j, 0] == 255:
-                values[0] = array_with_label[i, j - 1, 0]  # 左
-                values[1] = array_with_label[i - 1, j - 1, 0]  # 左上
-                values[2] = array_with_label[i - 1, j, 0]  # 上
-                values[3] = array_with_label[i - 1, j + 1, 0]  # 右上
-                labels[0] = array_with_label[i, j - 1, 1]
-                labels[1] = array_with_label[i - 1, j - 1, 1]
-                labels[2] = array_with_label[i - 1, j, 1]
-                labels[3] = array_with_label[i - 1, j + 1, 1]
-
-                if np.count_nonzero(values == 255) == 0:  # 周围没有前景点
-                    array_with_label[i, j, 1] = label_value
-                    label_value += 1
-                else:  # 周围有前景点
-                    if np.count_nonzero(labels != -1) == 0:  # 前景点都没有标签
-                        array_with_label[i, j, 1] = label_value
-                        array_with_label[i, j - 1, 1] = label_value if values[0] == 255 else (-1)
-                        array_with_label[i - 1, j - 1, 1] = label_value if values[1] == 255 else (-1)
-                        array_with_label[i - 1, j, 1] = label_value if values[2] == 255 else (-1)
-                        array_with_label[i - 1, j + 1, 1] = label_value if values[3] == 255 else (-1)
-                        label_value += 1
-                    else:  # 有的前景点有标签
-                        labels_1 = labels[labels != -1]
-                        for k in range(labels_1.shape[0]):
-                            # 寻找最小等价标签
-                            while equ_label[labels_1[k]] != labels_1[k]:
-                                labels_1[k] = equ_label[labels_1[k]]
-
-                        min_label = np.min(labels_1)
-                        
-                        # 打标签
-                        array_with_label[i, j, 1] = min_label
-                        array_with_label[i, j - 1, 1] = min_label if (labels[0] == -1 and values[0] == 255) else labels[0]
-                        array_with_label[i - 1, j - 1, 1] = min_label if (labels[1] == -1 and values[1] == 255) else labels[1]
-                        array_with_label[i - 1, j, 1] = min_label if (labels[2] == -1 and values[2] == 255) else labels[2]
-                        array_with_label[i - 1, j + 1, 1] = min_label if (labels[3] == -1 and values[3] == 255) else labels[3]
-
-                        # 修改等价标签
-                        equ_label[labels_1] = min_label
-    
-    # 第二次遍历
-    for i in range(1, rows - 1):
-        for j in range(1, columns - 1):
-            if array_with_label[i, j, 0] == 255:
-                # 寻找最小等价标签
-                while equ_label[array_with_label[i, j, 1]] != array_with_label[i, j, 1]:
-                    array_with_label[i, j, 1] = equ_label[array_with_label[i, j, 1]]
-
-    # 彩色标注
-    temp_array = np.zeros((rows, columns, 3), dtype = np.int32)
-    rgb_array = np.random.randint(0, 256, (np.max(array_with_label[:, :, 1]) + 1, 3))
-    for i in range(np.max(array_with_label[:, :, 1]) + 1):
-        temp_array[array_with_label[:, :, 1] == i] = rgb_array[i]
-
-    result = temp_array[1 : rows - 1, 1 : columns - 1]
-    return result
\ No newline at end of file
+import numpy as np
+import ImgKernel
+import LazyImport
+import SetProfile
+
+Image = LazyImport.lazy_import("PIL.Image")  # 只有rgb_to_hsv使用, 第一次使用时才导入
+
+'''
+@brief RGB空间转换到HSV空间
+'''
+def rgb_to_hsv (image_array):
+    image = Image.fromarray(image_array, mode = 'RGB')
+    image = image.convert("HSV")
+    hsv_image_array = np.array(image)
+    return hsv_image_array
+
+'''
+@brief HSV空间转换到RGB空间
+'''
+def hsv_to_rgb (image_array):
+    image = Image.fromarray(image_array, mode = 'HSV')
+    image = image.convert("RGB")
+    rgb_image_array = np.array(image)
+    return rgb_image_array
+
+'''
+@brief RGB空间转换到灰度空间
+'''
+def rgb_to_gray (image_array):
+    image = Image.fromarray(image_array, mode = 'RGB')
+    image = image.convert("L")
+    gray_image_array = np.array(image)
+    return gray_image_array
+
+'''
+@brief 缓冲区池: 按名称, 形状和类型保存临时数组, 连续处理相同分辨率的图像时重复使用, 不再分配内存
+       同一时刻使用的缓冲区名称不能相同, 不能在多个线程中同时使用
+'''
+class BufferPool:
+    def __init__ (self):
+        self.buffers = {}
+        self.requests = 0  # 获取缓冲区的次数
+        self.allocations = 0  # 实际分配内存的次数
+
+    '''
+    @brief 获取缓冲区, 内容未初始化
+    @param name: 缓冲区名称
+    @param shape: 形状
+    @param dtype: 类型
+    @return buffer: 数组
+    '''
+    def get (self, name, shape, dtype):
+        key = (name, tuple(shape), np.dtype(dtype))
+        self.requests += 1
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = self.buffers[key] = np.empty(shape, dtype = dtype)
+            self.allocations += 1
+        return buffer
+
+    '''
+    @brief 释放全部缓冲区, 例如图像分辨率改变时
+    '''
+    def clear (self):
+        self.buffers = {}
+
+    '''
+    @brief 全部缓冲区占用的字节数
+    '''
+    def nbytes (self):
+        return sum(buffer.nbytes for buffer in self.buffers.values())
+
+'''
+@brief 从缓冲区池中获取数组, 没有缓冲区池时分配新的数组
+'''
+def get_buffer (pool, name, shape, dtype):
+    if pool is None:
+        return np.empty(shape, dtype = dtype)
+    return pool.get(name, shape, dtype)
+
+'''
+@brief 图像二值化
+@param image_array: 图像数组
+@param threshold: 阈值, 大于阈值的像素为255, 其他为0
+@param out: 输出数组, 为None时在image_array上原地处理
+@return out: 二值图像
+'''
+def image_binarization (image_array, threshold, out = None):
+    if out is None:
+        out = image_array
+    np.greater(image_array, threshold, out = out)
+    np.multiply(out, 255, out = out)
+    return out
+
+'''
+@brief 一维滑动最大值/最小值(van Herk/Gil-Werman算法), 每个像素的代价与结构元大小无关
+@param image_array: 图像数组
+@param se_size: 结构元在该方向上的长度
+@param axis: 处理的方向, 0: 竖直方向, 1: 水平方向
+@param method: "dilation"取最大值, "erosion"取最小值
+@param out: 输出数组, 为None时分配新的数组, 不能与image_array相同
+@param pool: 缓冲区池, 用于临时数组, 为None时分配新的数组
+@return result: 与输入同类型的数组, 边缘采用零填充
+'''
+def line_extremum (image_array, se_size, axis, method, out = None, pool = None):
+    if out is None:
+        out = np.empty_like(image_array)
+    if se_size <= 1:
+        np.copyto(out, image_array)
+        return out
+
+    func = np.maximum if method == "dilation" else np.minimum
+    array = np.moveaxis(image_array, axis, -1)
+    length = array.shape[-1]
+    offset = int((se_size - 1) / 2)
+
+    # 零填充, 并把长度补齐为结构元长度的整数倍, 以便按块处理
+    blocks_num = -(-(length + se_size - 1) // se_size)
+    expand_shape = array.shape[:-1] + (blocks_num * se_size,)
+    expand_array = get_buffer(pool, "line_expand", expand_shape, image_array.dtype)
+    expand_array[..., :offset] = 0
+    expand_array[..., offset : offset + length] = array
+    expand_array[..., offset + length:] = 0
+    blocks = expand_array.reshape(array.shape[:-1] + (blocks_num, se_size))
+
+    # 块内前缀和后缀的最大值/最小值
+    prefix = get_buffer(pool, "line_prefix", expand_shape, image_array.dtype)
+    suffix = get_buffer(pool, "line_suffix", expand_shape, image_array.dtype)
+    func.accumulate(blocks, axis = -1, out = prefix.reshape(blocks.shape))
+    func.accumulate(blocks[..., ::-1], axis = -1, out = suffix.reshape(blocks.shape)[..., ::-1])
+
+    # 窗口[i, i + se_size - 1]最多跨越两个块, 由后缀和前缀合并得到
+    func(suffix[..., :length], prefix[..., se_size - 1 : se_size - 1 + length], out = np.moveaxis(out, axis, -1))
+    return out
+
+'''
+@brief 矩形结构元的膨胀或腐蚀, 拆分为行和列两次一维处理
+@param image_array: 图像数组
+@param se_size: 结构元大小(se_size * se_size的全1结构元)
+@param method: "dilation"或"erosion"
+@param out: 输出数组, 为None时分配新的数组
+@param pool: 缓冲区池, 为None时分配新的数组
+@return result: 与输入同类型的数组
+'''
+def rect_extremum (image_array, se_size, method, out = None, pool = None):
+    temp = get_buffer(pool, "rect_temp", image_array.shape, image_array.dtype)
+    line_extremum(image_array, se_size, axis = 1, method = method, out = temp, pool = pool)
+    return line_extremum(temp, se_size, axis = 0, method = method, out = out, pool = pool)
+
+'''
+@brief 形态学处理
+@param image_array: 图像数组
+@param method: "dilation", "erosion", "opening"或"closing"
+@param dilation_se_size: 膨胀结构元大小
+@param erosion_se_size: 腐蚀结构元大小
+@param out: 输出数组, 为None时分配新的数组, 不能与image_array相同
+@param pool: 缓冲区池, 用于临时数组, 为None时分配新的数组
+@return result: 与输入同类型的数组, 边缘采用零填充
+'''
+@SetProfile.profiled()
+def morphology_process (image_array, method, dilation_se_size = 3, erosion_se_size = 3, out = None, pool = None):
+    # 膨胀或者腐蚀
+    if method == "dilation":
+        result = rect_extremum(image_array, dilation_se_size, "dilation", out, pool)
+    elif method == "erosion":
+        result = rect_extremum(image_array, erosion_se_size, "erosion", out, pool)
+    # 开运算: 先进行腐蚀, 后进行膨胀
+    elif method == "opening":
+        temp = get_buffer(pool, "morphology_temp", image_array.shape, image_array.dtype)
+        rect_extremum(image_array, erosion_se_size, "erosion", temp, pool)
+        result = rect_extremum(temp, dilation_se_size, "dilation", out, pool)
+    # 闭运算: 先进行膨胀, 后进行腐蚀
+    elif method == "closing":
+        temp = get_buffer(pool, "morphology_temp", image_array.shape, image_array.dtype)
+        rect_extremum(image_array, dilation_se_size, "dilation", temp, pool)
+        result = rect_extremum(temp, erosion_se_size, "erosion", out, pool)
+
+    return result
+
+'''
+@brief 基于游程编码和并查集的连通域标记
+@param image_array: 图像数组, 非零像素为前景
+@param connectivity: 连通方式, 4或8
+@param pool: 缓冲区池, 用于临时数组和标签图像, 为None时分配新的数组
+@return label_image: int32标签图像, 0为背景, 连通域按扫描顺序从1开始编号, 使用缓冲区池时为池中数组的视图
+@return stats: 连通域统计信息, 元素的形式为[最小行, 最小列, 最大行, 最大列, 面积]
+@return centroids: 连通域质心, 元素的形式为[行, 列]
+'''
+@SetProfile.profiled()
+def connected_components (image_array, connectivity = 8, pool = None):
+    rows = image_array.shape[0]
+    columns = image_array.shape[1]
+    stride = columns + 2
+
+    # 每一行左右各填充一个背景像素, 使游程不会跨行
+    expand_array = get_buffer(pool, "components_expand", (rows, stride), np.int8)
+    expand_array[:, 0] = 0
+    expand_array[:, columns + 1] = 0
+    np.not_equal(image_array, 0, out = expand_array[:, 1 : columns + 1])
+    expand_flat = expand_array.reshape(-1)
+    diff = get_buffer(pool, "components_diff", (rows * stride - 1,), np.int8)
+    np.subtract(expand_flat[1:], expand_flat[:-1], out = diff)
+    is_edge = get_buffer(pool, "components_edge", diff.shape, bool)
+    run_start = np.flatnonzero(np.equal(diff, 1, out = is_edge)) + 1  # 游程起点(填充后的一维坐标)
+    run_end = np.flatnonzero(np.equal(diff, -1, out = is_edge))  # 游程终点(包含)
+    run_row = run_start // stride
+    run_length = run_end - run_start + 1
+    runs_num = run_start.shape[0]
+
+    # 寻找相邻两行之间相互接触的游程, 8连通允许对角接触
+    reach = 1 if connectivity == 8 else 0
+    low = np.searchsorted(run_end, run_start + stride - reach, side = 'left')
+    high = np.searchsorted(run_start, run_end + stride + reach, side = 'right')
+    count = np.maximum(high - low, 0)
+    edge_a = np.repeat(np.arange(runs_num), count)
+    edge_b = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count) + np.repeat(low, count)
+    keep = run_row[edge_b] == run_row[edge_a] + 1
+    edge_a = edge_a[keep]
+    edge_b = edge_b[keep]
+
+    # 并查集合并, 然后按扫描顺序压缩成连续的标签
+    root = ImgKernel.union_find(np.arange(runs_num), edge_a, edge_b)
+    _, run_label = np.unique(root, return_inverse = True)
+    run_label = run_label.astype(np.int32) + 1
+    labels_num = int(run_label.max()) if runs_num > 0 else 0
+
+    # 按游程填充标签图像
+    label_diff = get_buffer(pool, "components_label_diff", (rows * stride + 1,), np.int32)
+    label_diff[...] = 0
+    label_diff[run_start] = run_label
+    label_diff[run_end + 1] -= run_label
+    label_full = get_buffer(pool, "components_label", (rows * stride,), np.int32)
+    np.cumsum(label_diff[:-1], dtype = np.int32, out = label_full)
+    label_image = label_full.reshape(rows, stride)[:, 1 : columns + 1]
+
+    # 统计面积, 外接矩形和质心
+    run_column_start = run_start - run_row * stride - 1
+    run_column_end = run_end - run_row * stride - 1
+    index = run_label - 1
+    stats = np.zeros((labels_num, 5), dtype = np.int64)
+    stats[:, 0:2] = np.iinfo(np.int64).max
+    np.minimum.at(stats[:, 0], index, run_row)
+    np.minimum.at(stats[:, 1], index, run_column_start)
+    np.maximum.at(stats[:, 2], index, run_row)
+    np.maximum.at(stats[:, 3], index, run_column_end)
+    stats[:, 4] = np.bincount(index, weights = run_length, minlength = labels_num)
+    centroids = np.zeros((labels_num, 2))
+    if labels_num > 0:
+        centroids[:, 0] = np.bincount(index, weights = run_row * run_length, minlength = labels_num) / stats[:, 4]
+        centroids[:, 1] = np.bincount(index, weights = (run_column_start + run_column_end) * run_length / 2, minlength = labels_num) / stats[:, 4]
+
+    return label_image, stats, centroids
+
+'''
+@brief 连通域检测
+@param image_array: 二值图像数组, 255为前景
+@param out: 输出的uint8彩色图像, 形状为(行数, 列数, 3), 为None时分配新的数组
+@param pool: 缓冲区池, 用于临时数组, 为None时分配新的数组
+@return result: 彩色标注的图像, 不同的连通域使用不同的随机颜色
+'''
+def connected_analysis (image_array, out = None, pool = None):
+    opening = get_buffer(pool, "analysis_opening", image_array.shape, image_array.dtype)
+    morphology_process(image_array, "opening", dilation_se_size = 5, erosion_se_size = 5, out = opening, pool = pool)
+    label_image, stats, _ = connected_components(opening, pool = pool)  # 二值图像中只有0和255, 非零即为前景
+
+    # 彩色标注, 背景保持黑色
+    rgb_array = np.zeros((stats.shape[0] + 1, 3), dtype = np.uint8)
+    rgb_array[1:] = np.random.randint(0, 256, (stats.shape[0], 3))
+    if out is None:
+        out = np.empty(image_array.shape[:2] + (3,), dtype = np.uint8)
+    np.take(rgb_array, label_image, axis = 0, out = out, mode = "clip")
+    return out
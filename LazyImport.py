@@ -0,0 +1,24 @@
+import importlib.util
+import sys
+
+'''
+@brief 延迟导入模块: 返回的模块对象在第一次访问其属性时才真正执行导入
+       用于导入较慢且不一定用到的依赖(OpenCV, PIL, Numba等), 使只用到一部分功能的脚本启动更快
+@param name: 模块名称, 例如"cv2", "PIL.Image"
+@return module: 模块对象, 已经导入时直接返回, 模块没有安装时为None
+'''
+def lazy_import (name):
+    if name in sys.modules:
+        return sys.modules[name]
+    try:
+        spec = importlib.util.find_spec(name)
+    except ModuleNotFoundError:  # 父包不存在
+        return None
+    if spec is None:
+        return None
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,231 @@
+import argparse
+import collections
+import concurrent.futures
+import functools
+import json
+import os
+import sys
+import time
+import SetCache
+import SetCore
+import SetProfile
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+'''
+@brief 遍历文件夹, 按文件名顺序逐个给出图像文件路径
+@param dir_path: 文件夹路径
+@return file_path: 图像文件路径(生成器)
+'''
+def iter_image_files (dir_path):
+    for r, d, fs in os.walk(dir_path):
+        d.sort()
+        for f in sorted(fs):
+            if os.path.splitext(f)[-1].lower() in IMAGE_EXTENSIONS:
+                yield os.path.join(r, f)
+
+'''
+@brief 读取并压缩图像
+@param file_path: 图像文件路径
+@return img_rgb: 压缩后的rgb图像数组
+@return img_gray: 压缩后的灰度图像数组
+'''
+@SetProfile.profiled("load")
+def load_file (file_path):
+    image = SetCore.open_image(file_path)
+    image_resize, image_resize_gray = SetCore.resize_image(image)
+    _, _, img_rgb = SetCore.get_image_data(image_resize)
+    _, _, img_gray = SetCore.get_image_data(image_resize_gray)
+    return img_rgb, img_gray
+
+'''
+@brief 对已读取的图像运行识别流程, 结果写入record
+@param record: 识别结果字典, 其中的"timings"记录每个阶段的耗时(秒)
+@param img_rgb: 压缩后的rgb图像数组
+@param img_gray: 压缩后的灰度图像数组
+@param cache: 识别结果缓存(SetCache.ResultCache), 为None时不使用缓存
+@param card_workers: 大于0时按纸牌并行识别特征, 为每张图像使用的线程数量
+'''
+def process_image (record, img_rgb, img_gray, cache = None, card_workers = 0):
+    try:
+        if cache is None:
+            layout, all_set = SetCore.recognize(img_rgb, img_gray, record["timings"], card_workers)
+        else:
+            key = SetCache.image_key([img_rgb, img_gray], SetCore.get_cache_params("frame"))
+            layout, all_set, record["cached"] = cache.get_or_compute(key, SetCore.recognize, img_rgb, img_gray, record["timings"], card_workers)
+        record["size"] = [img_rgb.shape[0], img_rgb.shape[1]]
+        record["grid_shape"] = list(layout.shape)
+        record["cards_info"] = layout.cards_info.tolist()
+        record["grid_pos"] = layout.positions.tolist()
+        record["cards_table"] = layout.cards["table"].tolist()
+        record["cards_feature"] = layout.features.tolist()
+        record["all_set"] = all_set.tolist()
+    except Exception as e:
+        record["error"] = "%s: %s" % (type(e).__name__, e)
+
+'''
+@brief 对一张图像运行完整的识别流程
+@param file_path: 图像文件路径
+@param cache: 识别结果缓存, 为None时不使用缓存
+@param card_workers: 大于0时按纸牌并行识别特征, 为使用的线程数量
+@return record: 识别结果, 包括纸牌信息, 纸牌在网格中的位置, 纸牌所在的桌面, 纸牌特征, set的纸牌编号和每个阶段的耗时(秒)
+'''
+def process_file (file_path, cache = None, card_workers = 0):
+    record = {"file": file_path, "timings": {}}
+    start = time.perf_counter()
+    try:
+        img_rgb, img_gray = load_file(file_path)
+        record["timings"]["load"] = time.perf_counter() - start
+    except Exception as e:
+        record["error"] = "%s: %s" % (type(e).__name__, e)
+    else:
+        process_image(record, img_rgb, img_gray, cache, card_workers)
+
+    record["timings"]["total"] = time.perf_counter() - start
+    return record
+
+'''
+@brief 工作进程: 读取并识别一组图像, 解码和压缩在工作进程中进行, 主进程只分发文件路径, 图像数据不在进程之间传递
+@param file_paths: 图像文件路径列表
+@param cache_path: 识别结果缓存的文件路径, 为None时不使用缓存
+@param cache_bytes: 缓存的大小上限(字节)
+@param card_workers: 大于0时按纸牌并行识别特征, 为每个工作进程中使用的线程数量
+@return records: 识别结果列表
+'''
+def process_chunk (file_paths, cache_path = None, cache_bytes = SetCache.DEFAULT_MAX_BYTES, card_workers = 0):
+    cache = SetCache.ResultCache(cache_path, cache_bytes) if cache_path is not None else None
+    try:
+        return [process_file(file_path, cache, card_workers) for file_path in file_paths]
+    finally:
+        if cache is not None:
+            cache.close()
+
+'''
+@brief 把文件路径按chunk_size分组
+'''
+def iter_chunks (file_paths, chunk_size):
+    chunk = []
+    for file_path in file_paths:
+        chunk.append(file_path)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+'''
+@brief 多进程批量识别, 每个工作进程读取并识别一组图像
+@param file_paths: 图像文件路径(可迭代对象)
+@param workers: 工作进程数量
+@param chunk_size: 每个任务包含的图像数量
+@param ordered: True: 按输入顺序输出结果, False: 按完成顺序输出结果
+@param cache_path: 识别结果缓存的文件路径, 各个工作进程共用, 为None时不使用缓存
+@param cache_bytes: 缓存的大小上限(字节)
+@param card_workers: 大于0时按纸牌并行识别特征, 为每个工作进程中使用的线程数量
+@return record: 识别结果(生成器)
+'''
+def iter_parallel (file_paths, workers, chunk_size = 4, ordered = True, cache_path = None, cache_bytes = SetCache.DEFAULT_MAX_BYTES, card_workers = 0):
+    max_pending = workers * 2  # 同时存在的任务数量上限, 文件很多时不一次提交全部任务
+    pending = collections.OrderedDict()  # 按提交顺序排列的future
+
+    def finish (future):
+        del pending[future]
+        return future.result()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+        try:
+            for chunk in iter_chunks(file_paths, chunk_size):
+                # 任务过多时先取出已有的结果
+                while len(pending) >= max_pending:
+                    if ordered:
+                        future = next(iter(pending))
+                    else:
+                        done, _ = concurrent.futures.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED)
+                        future = next(iter(done))
+                    yield from finish(future)
+
+                pending[executor.submit(process_chunk, chunk, cache_path, cache_bytes, card_workers)] = None
+
+            # 取出剩余的结果
+            while len(pending) > 0:
+                if ordered:
+                    future = next(iter(pending))
+                else:
+                    future = next(concurrent.futures.as_completed(pending))
+                yield from finish(future)
+        finally:
+            # 中途退出时取消还没有开始的任务
+            for future in pending:
+                future.cancel()
+
+'''
+@brief 批量处理文件夹中的全部图像, 每张图像输出一行JSON
+@param dir_path: 文件夹路径
+@param output: 输出的文件对象
+@param workers: 工作进程数量, 为1时在当前进程中串行处理
+@param chunk_size: 每个任务包含的图像数量
+@param ordered: 是否按文件顺序输出结果
+@param cache_path: 识别结果缓存的文件路径, 为None时不使用缓存
+@param cache_bytes: 缓存的大小上限(字节)
+@param card_workers: 大于0时按纸牌并行识别特征, 为每张图像使用的线程数量
+@return count: 处理的图像数量
+@return error_count: 识别失败的图像数量
+'''
+def run_batch (dir_path, output, workers = 1, chunk_size = 4, ordered = True, cache_path = None, cache_bytes = SetCache.DEFAULT_MAX_BYTES, card_workers = 0):
+    file_paths = iter_image_files(dir_path)
+    cache = None
+    if workers == 1:
+        if cache_path is not None:
+            cache = SetCache.ResultCache(cache_path, cache_bytes)
+        records = map(functools.partial(process_file, cache = cache, card_workers = card_workers), file_paths)
+    else:
+        records = iter_parallel(file_paths, workers, chunk_size, ordered, cache_path, cache_bytes, card_workers)
+
+    count = 0
+    error_count = 0
+    for record in records:
+        output.write(json.dumps(record, ensure_ascii = False) + "\n")
+        output.flush()
+        count += 1
+        if "error" in record:
+            error_count += 1
+    if cache is not None:
+        cache.close()
+    return count, error_count
+
+def main (argv = None):
+    parser = argparse.ArgumentParser(description = "Set Game 无界面批量识别")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+    batch_parser = subparsers.add_parser("batch", help = "识别文件夹中的全部图像, 输出JSONL")
+    batch_parser.add_argument("dir", help = "图像文件夹")
+    batch_parser.add_argument("-o", "--output", default = "-", help = "输出的JSONL文件, 默认输出到标准输出")
+    batch_parser.add_argument("-j", "--workers", type = int, default = 1, help = "工作进程数量, 0表示使用全部CPU核心, 默认为1(串行)")
+    batch_parser.add_argument("--chunk-size", type = int, default = 4, help = "每个任务包含的图像数量, 默认为4")
+    batch_parser.add_argument("--unordered", action = "store_true", help = "按完成顺序输出结果, 而不是按文件顺序")
+    batch_parser.add_argument("--cache", nargs = "?", const = SetCache.DEFAULT_PATH,
+                              help = "使用识别结果缓存(SQLite文件), 不指定路径时为%s" % SetCache.DEFAULT_PATH)
+    batch_parser.add_argument("--cache-size", type = int, default = SetCache.DEFAULT_MAX_BYTES // (1024 * 1024), help = "缓存的大小上限(MB), 默认为64")
+    batch_parser.add_argument("--card-workers", type = int, default = 0, help = "每张图像按纸牌并行识别特征的线程数量, 默认为0(逐阶段识别)")
+    batch_parser.add_argument("--profile", help = "输出每个阶段耗时和峰值内存的汇总(JSON), 只在串行处理时有效")
+    batch_parser.add_argument("--trace", help = "输出Chrome trace格式的阶段记录, 只在串行处理时有效")
+    args = parser.parse_args(argv)
+
+    if args.command == "batch":
+        workers = args.workers if args.workers > 0 else os.cpu_count()
+        if args.profile or args.trace:
+            SetProfile.profiler.enable(trace_memory = True)
+        cache_bytes = args.cache_size * 1024 * 1024
+        if args.output == "-":
+            count, error_count = run_batch(args.dir, sys.stdout, workers, args.chunk_size, not args.unordered, args.cache, cache_bytes, args.card_workers)
+        else:
+            with open(args.output, "w", encoding = "utf-8") as output:
+                count, error_count = run_batch(args.dir, output, workers, args.chunk_size, not args.unordered, args.cache, cache_bytes, args.card_workers)
+        print("processed %d images, %d failed" % (count, error_count), file = sys.stderr)
+        if args.profile:
+            SetProfile.profiler.export_json(args.profile)
+        if args.trace:
+            SetProfile.profiler.export_chrome_trace(args.trace)
+        return 1 if error_count > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
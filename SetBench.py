@@ -0,0 +1,410 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from PIL import Image
+import numpy as np
+import ImgProc
+import SetCore
+import SetSolver
+import SetSynth
+
+# 导入时间检查的模块, 以及这些模块在导入时不应加载的较慢的依赖(应在第一次使用时才导入)
+IMPORT_MODULES = ("SetCore", "SetCache", "SetBatch")
+HEAVY_MODULES = ("cv2", "tkinter", "PIL.Image", "PIL.ImageTk", "matplotlib", "pylab", "scipy", "numba")
+
+TABLES = (1, 2, 3, 4)  # 多桌面测试中每幅图像的桌面数量, 每张桌面12张纸牌
+
+# 测试场景: 纸牌数量, 输出图像长边, 旋转, 模糊, 噪声, 拍摄距离
+# 纸牌较多或拍摄距离较远的场景中纸牌小于阈值调整时的大小, 覆盖逐张缩放后识别的路径(SetCore.FRAME_SCALE_RANGE)
+SCENARIOS = [
+    {"name": "clean-12", "cards_num": 12, "long_side": 1600},
+    {"name": "noise-12", "cards_num": 12, "long_side": 1600, "noise": 8.0},
+    {"name": "blur-12", "cards_num": 12, "long_side": 1600, "blur": 1.5},
+    {"name": "rotate-12", "cards_num": 12, "long_side": 1600, "rotation": 4.0},
+    {"name": "phone-12", "cards_num": 12, "long_side": 4032, "noise": 4.0, "blur": 1.0},
+    {"name": "small-12", "cards_num": 12, "long_side": 800},
+    {"name": "clean-15", "cards_num": 15, "long_side": 1600},
+    {"name": "clean-18", "cards_num": 18, "long_side": 1600},
+    {"name": "clean-21", "cards_num": 21, "long_side": 1600},
+    {"name": "far-12", "cards_num": 12, "long_side": 1600, "distance": 1.5},
+]
+
+'''
+@brief 多次调用函数并计时
+@param func: 被计时的函数(无参数)
+@param repeat: 调用次数
+@return result: 计时结果(毫秒), 包括中位数和最小值
+'''
+def time_call (func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1000
+    return {"median_ms": float(np.median(times)), "min_ms": float(times.min())}
+
+'''
+@brief 把渲染的图像转换为识别流程的输入(与界面中打开文件的处理相同)
+@param image: rgb图像数组
+@return img_rgb: 压缩后的rgb图像
+@return img_gray: 压缩后的灰度图像
+'''
+def prepare_input (image):
+    image_resize, image_resize_gray = SetCore.resize_image(Image.fromarray(image))
+    _, _, img_rgb = SetCore.get_image_data(image_resize)
+    _, _, img_gray = SetCore.get_image_data(image_resize_gray)
+    return img_rgb, img_gray
+
+'''
+@brief 对每个处理阶段单独计时, 使用同一个12张纸牌的布局
+@param seed: 随机数种子
+@param repeat: 每个阶段的调用次数
+@param card_workers: 大于0时增加按纸牌并行识别的端到端计时, 为使用的线程数量
+@return stages: 阶段名称 -> 计时结果
+'''
+def bench_stages (seed, repeat, card_workers = 0):
+    rng = np.random.default_rng(seed)
+    image, truth = SetSynth.random_layout(rng, 12)
+    img_rgb, img_gray = prepare_input(image)
+    context = SetCore.FrameContext(img_rgb, img_gray)
+    img_bin = context.get_binary()
+    img_open = context.get_opening()
+    layout = context.get_layout()
+    number, _ = SetCore.get_number(img_bin, layout, img_open)
+
+    stages = {}
+    stages["morphology_process"] = time_call(lambda: ImgProc.morphology_process(img_bin, "opening", dilation_se_size = 7, erosion_se_size = 9), repeat)
+    stages["connected_components"] = time_call(lambda: ImgProc.connected_components(img_bin), repeat)
+    stages["connected_analysis"] = time_call(lambda: ImgProc.connected_analysis(img_bin), repeat)
+    stages["get_layout"] = time_call(lambda: SetCore.get_layout(img_bin), repeat)
+    stages["get_number"] = time_call(lambda: SetCore.get_number(img_bin, layout, img_open), repeat)
+    stages["get_texture"] = time_call(lambda: SetCore.get_texture(img_bin, layout, number), repeat)
+    stages["get_color"] = time_call(lambda: SetCore.get_color(img_rgb, layout), repeat)
+    stages["get_appearance"] = time_call(lambda: SetCore.get_appearance(img_bin, layout, img_open), repeat)
+    stages["get_appearance_hough"] = time_call(lambda: SetCore.get_appearance(img_bin, layout, img_open, "hough"), repeat)
+    stages["get_appearance_moments"] = time_call(lambda: SetCore.get_appearance(img_bin, layout, img_open, "moments"), repeat)
+    stages["search_set_pos"] = time_call(lambda: SetCore.search_set_pos(truth["features"]), repeat)
+    stages["search_set_pos_81"] = time_call(lambda: SetCore.search_set_pos(SetSynth.DECK.reshape(3, 27, 4)), repeat)
+    stages["solver_add_81"] = time_call(lambda: SetSolver.IncrementalSolver(SetSynth.DECK), repeat)
+    stages["solver_game"] = time_call(lambda: SetSolver.play_game(np.random.default_rng(seed)), repeat)
+    stages["end_to_end"] = time_call(lambda: SetCore.recognize(*prepare_input(image)), repeat)
+    if card_workers > 0:
+        stages["end_to_end_cards_%d" % card_workers] = time_call(lambda: SetCore.recognize(*prepare_input(image), card_workers = card_workers), repeat)
+    stages["end_to_end_roi"] = time_call(lambda: SetCore.recognize_roi(image), repeat)
+    return stages
+
+'''
+@brief 连续识别同一分辨率的多帧图像, 统计稳定状态下每帧的峰值内存分配(tracemalloc)
+@param seed: 随机数种子
+@param frames: 帧数, 第一帧用于预热(分配缓冲区池), 不计入统计
+@return memory: "pool"和"no_pool" -> 除第一帧外每帧峰值内存分配的中位数(KB)
+'''
+def bench_memory (seed, frames):
+    rng = np.random.default_rng(seed)
+    image, _ = SetSynth.random_layout(rng, 12)
+    img_rgb, img_gray = prepare_input(image)
+
+    memory = {}
+    for name, pool in (("pool", ImgProc.BufferPool()), ("no_pool", None)):
+        context = SetCore.FrameContext(img_rgb, img_gray, pool)
+        peaks = []
+        tracemalloc.start()
+        try:
+            for _ in range(max(frames, 2)):
+                context.set_image(img_rgb, img_gray)
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                SetCore.recognize_frame(context)
+                peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        finally:
+            tracemalloc.stop()
+        memory[name] = float(np.median(peaks[1:])) / 1024
+    return memory
+
+'''
+@brief 对一个场景运行完整的识别流程, 统计吞吐量和准确率
+@param scenario: 场景参数
+@param layouts: 布局数量
+@param seed: 随机数种子
+@param roi: 是否使用由粗到精的识别(在渲染的原图上裁剪纸牌)
+@param card_workers: 大于0时按纸牌并行识别特征, 为使用的线程数量
+@return result: 统计结果
+'''
+def bench_scenario (scenario, layouts, seed, roi = False, card_workers = 0):
+    rng = np.random.default_rng(seed)
+    params = {key: value for key, value in scenario.items() if key not in ("name", "cards_num")}
+
+    failed = 0
+    attribute_correct = np.zeros(4)
+    card_correct = 0
+    set_correct = 0
+    cards_total = 0
+    elapsed = 0.0
+    for _ in range(layouts):
+        image, truth = SetSynth.random_layout(rng, scenario["cards_num"], **params)
+        true_set_pos = SetCore.search_set_pos(truth["features"])
+        cards_total += truth["features"].shape[0] * truth["features"].shape[1]
+
+        start = time.perf_counter()
+        try:
+            if roi:
+                layout, all_set = SetCore.recognize_roi(image)
+            else:
+                layout, all_set = SetCore.recognize(*prepare_input(image), card_workers = card_workers)
+        except Exception:
+            failed += 1
+            elapsed += time.perf_counter() - start
+            continue
+        elapsed += time.perf_counter() - start
+
+        # 纸牌数量或推断出的网格与真值不同时认为识别失败
+        if len(layout) != scenario["cards_num"] or layout.shape != truth["features"].shape[:-1]:
+            failed += 1
+            continue
+        cards_feature = layout.to_grid(layout.features)
+        all_set_pos = layout.get_pos(all_set)
+        is_equal = cards_feature == truth["features"]
+        attribute_correct += is_equal.reshape(-1, 4).sum(axis = 0)
+        card_correct += int(np.all(is_equal, axis = -1).sum())
+        set_correct += int(np.array_equal(all_set_pos, true_set_pos))
+
+    attributes = ["number", "texture", "color", "appearance"]
+    return {
+        "layouts": layouts,
+        "failed": failed,
+        "images_per_second": layouts / elapsed if elapsed > 0 else 0.0,
+        "mean_ms": elapsed / layouts * 1000,
+        "card_accuracy": card_correct / cards_total,
+        "attribute_accuracy": {name: float(attribute_correct[i] / cards_total) for i, name in enumerate(attributes)},
+        "set_accuracy": set_correct / layouts,
+    }
+
+'''
+@brief 多张桌面并排的图像: 使用由粗到精的识别, 统计桌面划分, 纸牌和set的准确率, 以及每张纸牌的平均耗时
+@param tables_num: 每幅图像的桌面数量
+@param layouts: 图像数量
+@param seed: 随机数种子
+@return result: 统计结果
+'''
+def bench_tables (tables_num, layouts, seed):
+    rng = np.random.default_rng(seed)
+    tables_correct = 0
+    card_correct = 0
+    set_correct = 0
+    cards_total = 0
+    elapsed = 0.0
+    for _ in range(layouts):
+        image, truths = SetSynth.random_tables(rng, tables_num)
+        cards_total += sum(truth["features"].shape[0] * truth["features"].shape[1] for truth in truths)
+        start = time.perf_counter()
+        layout, all_set = SetCore.recognize_roi(image)
+        elapsed += time.perf_counter() - start
+        if layout.tables_num != tables_num:
+            continue
+        tables_correct += 1
+
+        # 逐个桌面对比, 桌面中的网格位置从0开始
+        set_table = layout.cards["table"][all_set[:, 0]] if all_set.shape[0] > 0 else np.zeros(0, dtype = int)
+        for table, (start_id, stop_id) in enumerate(layout.table_ranges()):
+            positions = layout.positions[start_id : stop_id]
+            origin = positions.min(axis = 0)
+            if tuple(positions.max(axis = 0) - origin + 1) != truths[table]["features"].shape[:-1]:
+                continue
+            true_feature = truths[table]["features"][positions[:, 0] - origin[0], positions[:, 1] - origin[1]]
+            card_correct += int(np.all(layout.features[start_id : stop_id] == true_feature, axis = -1).sum())
+            set_pos = layout.get_pos(all_set[set_table == table]) - origin
+            set_correct += int(np.array_equal(set_pos, SetCore.search_set_pos(truths[table]["features"])))
+
+    return {
+        "layouts": layouts,
+        "table_accuracy": tables_correct / layouts,
+        "card_accuracy": card_correct / cards_total,
+        "set_accuracy": set_correct / (layouts * tables_num),
+        "ms_per_card": elapsed / cards_total * 1000,
+    }
+
+'''
+@brief 在同一组布局上对比两种形状识别方式的耗时和准确率, 只统计布局识别正确的图像
+       输入与识别流程相同: 纸牌的大小与阈值调整时相差较大时, 在缩放到统一高度的纸牌图像上识别形状
+@param scenario: 场景参数
+@param layouts: 布局数量
+@param seed: 随机数种子
+@return result: "hough"和"moments" -> 平均每张图像的耗时(毫秒)和形状的准确率
+'''
+def bench_appearance (scenario, layouts, seed):
+    rng = np.random.default_rng(seed)
+    params = {key: value for key, value in scenario.items() if key not in ("name", "cards_num")}
+
+    methods = ("hough", "moments")
+    elapsed = dict.fromkeys(methods, 0.0)
+    correct = dict.fromkeys(methods, 0)
+    cards_total = 0
+    images = 0
+    for _ in range(layouts):
+        image, truth = SetSynth.random_layout(rng, scenario["cards_num"], **params)
+        context = SetCore.FrameContext(*prepare_input(image))
+        try:
+            layout = context.get_layout()
+        except Exception:
+            continue
+        if layout.shape != truth["features"].shape[:-1]:
+            continue
+        if SetCore.is_reference_scale(layout):
+            img_open = context.get_opening()
+            inputs = [(img_open, layout.get_card_info(card_id)) for card_id in range(len(layout))]
+        else:
+            inputs = []
+            for card_id in range(len(layout)):
+                patch_rgb, patch_card_info = SetCore.get_card_patch(context.img_rgb, layout.get_card_info(card_id))
+                _, patch_open, patch_card_info = SetCore.preprocess_patch(patch_rgb, patch_card_info)
+                inputs.append((patch_open, patch_card_info))
+        true_appearances = truth["features"][layout.cards["grid_row"], layout.cards["grid_column"], 3]
+        for method in methods:
+            start = time.perf_counter()
+            appearances = np.array([SetCore.get_card_appearance(img_open, card_info, method) for img_open, card_info in inputs])
+            elapsed[method] += time.perf_counter() - start
+            correct[method] += int((appearances == true_appearances).sum())
+        cards_total += len(layout)
+        images += 1
+
+    return {method: {"mean_ms": elapsed[method] / max(images, 1) * 1000, "accuracy": correct[method] / max(cards_total, 1)}
+            for method in methods}
+
+'''
+@brief 在新的解释器中用python -X importtime导入模块, 统计导入耗时
+@param module: 模块名称
+@param repeat: 测量次数, 取最小值(第一次可能包括编译字节码的时间)
+@return total_ms: 导入模块的总耗时(毫秒, 包括全部依赖)
+@return heavy: 导入时加载的较慢的依赖
+'''
+def measure_import_time (module, repeat = 3):
+    totals = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import %s" % module], capture_output = True, text = True,
+                                cwd = os.path.dirname(os.path.abspath(__file__)), check = True)
+        imported = {}
+        for line in result.stderr.splitlines():
+            # 每一行的形式为"import time: 自身耗时(微秒) | 累计耗时(微秒) | 模块名称", 模块名称前的缩进表示嵌套
+            fields = line.split("|")
+            if len(fields) != 3 or not fields[1].strip().isdigit():
+                continue
+            imported[fields[2].strip()] = int(fields[1]) / 1000
+        totals.append(imported[module])
+    heavy = [name for name in HEAVY_MODULES if name in imported]
+    return min(totals), heavy
+
+'''
+@brief 检查无界面模块的导入时间是否在预算之内, 且没有在导入时加载较慢的依赖
+@param budget_ms: 每个模块的导入时间预算(毫秒)
+@return failures: 不满足要求的模块的说明, 为空表示全部满足
+'''
+def check_import_budget (budget_ms):
+    failures = []
+    print("%-22s %12s  %s" % ("module", "import ms", "heavy dependencies"))
+    for module in IMPORT_MODULES:
+        total_ms, heavy = measure_import_time(module)
+        print("%-22s %12.1f  %s" % (module, total_ms, ", ".join(heavy) if len(heavy) > 0 else "-"))
+        if total_ms > budget_ms:
+            failures.append("%s: %.1f ms > %.1f ms" % (module, total_ms, budget_ms))
+        if len(heavy) > 0:
+            failures.append("%s: imports %s" % (module, ", ".join(heavy)))
+    return failures
+
+'''
+@brief 打印结果, 有对比数据时同时给出变化
+@param results: 本次结果
+@param baseline: 对比的结果, 可以为None
+'''
+def print_report (results, baseline = None):
+    def ratio (section, name, key):
+        if baseline is None or name not in baseline.get(section, {}):
+            return ""
+        old = baseline[section][name][key]
+        new = results[section][name][key]
+        return "  (%+.0f%%)" % ((new - old) / old * 100) if old > 0 else ""
+
+    print("%-22s %12s %12s" % ("stage", "median ms", "min ms"))
+    for name, result in results["stages"].items():
+        print("%-22s %12.2f %12.2f%s" % (name, result["median_ms"], result["min_ms"], ratio("stages", name, "median_ms")))
+
+    if "memory" in results:
+        print()
+        print("%-22s %12s" % ("memory per frame", "peak KB"))
+        for name, peak in results["memory"].items():
+            print("%-22s %12.0f" % (name, peak))
+
+    print()
+    print("%-12s %8s %8s %8s %8s %8s %8s %8s %8s %8s" % ("scenario", "img/s", "failed", "card", "set", "number", "texture", "color", "shape", ""))
+    for name, result in results["scenarios"].items():
+        accuracy = result["attribute_accuracy"]
+        print("%-12s %8.2f %8d %8.3f %8.3f %8.3f %8.3f %8.3f %8.3f%s" %
+              (name, result["images_per_second"], result["failed"], result["card_accuracy"], result["set_accuracy"],
+               accuracy["number"], accuracy["texture"], accuracy["color"], accuracy["appearance"],
+               ratio("scenarios", name, "card_accuracy")))
+
+    if "tables" in results:
+        print()
+        print("%-12s %8s %8s %8s %12s" % ("tables", "table", "card", "set", "ms per card"))
+        for name, result in results["tables"].items():
+            print("%-12s %8.3f %8.3f %8.3f %12.2f" % (name, result["table_accuracy"], result["card_accuracy"], result["set_accuracy"], result["ms_per_card"]))
+
+    if "appearance" in results:
+        print()
+        print("%-12s %10s %10s %10s %10s %8s" % ("shape", "hough ms", "hough acc", "moment ms", "moment acc", "speedup"))
+        for name, result in results["appearance"].items():
+            hough, moments = result["hough"], result["moments"]
+            speedup = hough["mean_ms"] / moments["mean_ms"] if moments["mean_ms"] > 0 else 0.0
+            print("%-12s %10.2f %10.3f %10.2f %10.3f %7.1fx" %
+                  (name, hough["mean_ms"], hough["accuracy"], moments["mean_ms"], moments["accuracy"], speedup))
+
+def main (argv = None):
+    parser = argparse.ArgumentParser(description = "Set Game 性能和准确率测试(合成图像)")
+    parser.add_argument("--layouts", type = int, default = 10, help = "每个场景的布局数量, 默认为10")
+    parser.add_argument("--repeat", type = int, default = 10, help = "每个阶段计时的调用次数, 默认为10")
+    parser.add_argument("--seed", type = int, default = 0, help = "随机数种子, 默认为0")
+    parser.add_argument("--scenario", action = "append", help = "只运行指定的场景, 可以多次指定")
+    parser.add_argument("--frames", type = int, default = 5, help = "测量每帧峰值内存的帧数, 0表示不测量, 默认为5")
+    parser.add_argument("--no-tables", action = "store_true", help = "不运行多桌面测试")
+    parser.add_argument("--no-appearance", action = "store_true", help = "不对比两种形状识别方式")
+    parser.add_argument("--roi", action = "store_true", help = "场景测试使用由粗到精的识别")
+    parser.add_argument("--card-workers", type = int, default = 0, help = "场景测试按纸牌并行识别特征的线程数量, 默认为0(逐阶段识别)")
+    parser.add_argument("--import-budget", type = float, help = "只检查无界面模块的导入时间(毫秒预算), 超出预算或导入了较慢的依赖时返回1")
+    parser.add_argument("--json", help = "把结果保存为JSON文件")
+    parser.add_argument("--compare", help = "与之前保存的JSON结果对比")
+    args = parser.parse_args(argv)
+
+    if args.import_budget is not None:
+        failures = check_import_budget(args.import_budget)
+        for failure in failures:
+            print("FAIL %s" % failure)
+        return 1 if len(failures) > 0 else 0
+
+    scenarios = [scenario for scenario in SCENARIOS if args.scenario is None or scenario["name"] in args.scenario]
+    results = {"seed": args.seed, "roi": args.roi, "card_workers": args.card_workers, "stages": bench_stages(args.seed, args.repeat, args.card_workers), "scenarios": {}}
+    if args.frames > 0:
+        results["memory"] = bench_memory(args.seed, args.frames)
+    for scenario in scenarios:
+        results["scenarios"][scenario["name"]] = bench_scenario(scenario, args.layouts, args.seed, args.roi, args.card_workers)
+    if not args.no_tables:
+        results["tables"] = {"%d x 12" % tables_num: bench_tables(tables_num, args.layouts, args.seed) for tables_num in TABLES}
+    if not args.no_appearance:
+        results["appearance"] = {scenario["name"]: bench_appearance(scenario, args.layouts, args.seed) for scenario in scenarios}
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding = "utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.json:
+        with open(args.json, "w", encoding = "utf-8") as f:
+            json.dump(results, f, indent = 2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+import SetLayout
+
+PIPELINE_VERSION = 6  # 识别流程的版本, 流程或阈值改变后加1, 旧的缓存结果自动失效
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "setgame", "results.sqlite")
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+'''
+@brief 计算缓存的键: 图像像素和识别参数的blake2b哈希
+@param images: 图像数组的列表, 例如[压缩后的rgb图像, 压缩后的灰度图像]
+@param params: 识别参数字典, 会影响识别结果的参数都应包括在内
+@return key: 十六进制字符串
+'''
+def image_key (images, params = None):
+    h = hashlib.blake2b(digest_size = 20)
+    h.update(json.dumps({"version": PIPELINE_VERSION, "params": params or {}}, sort_keys = True).encode())
+    for image in images:
+        image = np.ascontiguousarray(image)
+        h.update(("%s%s" % (image.dtype.str, image.shape)).encode())  # 像素相同但形状不同的图像不能共用结果
+        h.update(image.data)
+    return h.hexdigest()
+
+'''
+@brief 把识别结果编码为JSON, 包括纸牌信息, 纸牌特征, 置信度, set的纸牌编号和set在网格中的位置
+@param layout: 纸牌布局
+@param all_set: 所有set的纸牌编号, 形状为(m, 3)
+@return value: JSON字符串
+'''
+def encode_result (layout, all_set):
+    all_set = np.asarray(all_set, dtype = int).reshape(-1, 3)
+    return json.dumps({"cards_info": layout.cards_info.tolist(), "cards_feature": layout.features.tolist(),
+                       "confidence": layout.cards["confidence"].tolist(), "all_set": all_set.tolist(),
+                       "all_set_pos": layout.get_pos(all_set).tolist()})
+
+'''
+@brief 从JSON中恢复识别结果
+@param value: encode_result得到的JSON字符串
+@return layout: 纸牌布局
+@return all_set: 所有set的纸牌编号
+'''
+def decode_result (value):
+    result = json.loads(value)
+    layout = SetLayout.Layout(result["cards_info"])  # cards_info已按纸牌编号排列, 重新推断的网格和编号不变
+    layout.set_features(np.array(result["cards_feature"], dtype = int).reshape(-1, 4), np.array(result["confidence"], dtype = np.float32))
+    return layout, np.array(result["all_set"], dtype = int).reshape(-1, 3)
+
+'''
+@brief 识别结果的持久化缓存, 保存在SQLite文件中, 总大小超过上限时淘汰最久没有使用的结果(LRU)
+       可以在多个线程和多个进程中同时使用同一个文件
+'''
+class ResultCache:
+    '''
+    @param path: SQLite文件路径, 文件夹不存在时自动创建, ":memory:"表示只保存在内存中
+    @param max_bytes: 缓存结果的总大小上限(字节)
+    '''
+    def __init__ (self, path = DEFAULT_PATH, max_bytes = DEFAULT_MAX_BYTES):
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path, timeout = 30, check_same_thread = False)
+        with self.lock, self.connection:
+            if path != ":memory:":
+                self.connection.execute("PRAGMA journal_mode = WAL")  # 读写可以同时进行
+                self.connection.execute("PRAGMA synchronous = NORMAL")  # WAL模式下提交时不等待写入磁盘, 断电最多丢失最近的结果
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                                    "size INTEGER NOT NULL, last_used REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+
+    '''
+    @brief 查找缓存的结果, 命中时更新最后使用的时间
+    @param key: image_key得到的键
+    @return result: (layout, all_set), 没有命中时为None
+    '''
+    def get (self, key):
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return decode_result(row[0])
+
+    '''
+    @brief 保存识别结果, 之后淘汰超出大小上限的结果
+    @param key: image_key得到的键
+    @param layout: 纸牌布局
+    @param all_set: 所有set的纸牌编号
+    '''
+    def put (self, key, layout, all_set):
+        value = encode_result(layout, all_set)
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO results (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                                    (key, value, len(value), time.time()))
+            self.evict()
+
+    '''
+    @brief 按最后使用的时间从旧到新删除结果, 直到总大小不超过上限(调用时已持有锁)
+    '''
+    def evict (self):
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        expired = []
+        for key, size in self.connection.execute("SELECT key, size FROM results ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            expired.append((key,))
+            total -= size
+        self.connection.executemany("DELETE FROM results WHERE key = ?", expired)
+
+    '''
+    @brief 查找缓存, 没有命中时调用识别函数并保存结果
+    @param key: image_key得到的键
+    @param func: 识别函数, 返回(layout, all_set)
+    @return layout: 纸牌布局
+    @return all_set: 所有set的纸牌编号
+    @return hit: 是否命中缓存
+    '''
+    def get_or_compute (self, key, func, *args, **kwargs):
+        result = self.get(key)
+        if result is not None:
+            return result + (True,)
+        layout, all_set = func(*args, **kwargs)
+        self.put(key, layout, all_set)
+        return layout, all_set, False
+
+    '''
+    @brief 缓存的统计信息
+    @return stats: 结果数量, 总大小(字节), 本次打开以来的命中和未命中次数
+    '''
+    def get_stats (self):
+        with self.lock:
+            count, total = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {"entries": count, "bytes": total, "hits": self.hits, "misses": self.misses}
+
+    '''
+    @brief 删除全部缓存的结果
+    '''
+    def clear (self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM results")
+
+    def close (self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,1098 @@
+import concurrent.futures
+import math
+import os
+import threading
+import time
+import numpy as np
+import ImgKernel
+import ImgProc
+import LazyImport
+import SetLayout
+import SetProfile
+
+# 识别流程的核心部分, 不依赖界面; OpenCV和PIL导入较慢, 在第一次使用时才导入
+cv = LazyImport.lazy_import("cv2")
+Image = LazyImport.lazy_import("PIL.Image")
+
+'''
+@brief 获取图像数组
+@param image: PIL的Image类对象
+@return height: 图像的高（行数）
+@return width: 图像的宽（列数）
+@return image_array: 图像对应的数组
+'''
+def get_image_data (image):
+    (width, height) = image.size  # 获取图像的宽和高
+    image_array = np.array(image)  # 获取图像的像素数据并转化为数组
+    return height, width, image_array
+
+# 纸牌候选区域的筛选条件, 与图像的分辨率和拍摄距离无关
+CARD_MIN_FRACTION = 0.03  # 纸牌的宽占图像长边的比例下限, 用于筛除噪声
+CARD_ASPECT_RANGE = (1.1, 2.0)  # 纸牌的高与宽之比的范围, 相互接触的纸牌连成的区域不符合
+CARD_MIN_AREA_RATIO = 0.25  # 纸牌面积与全部候选面积的中位数之比的下限, 不同桌面的拍摄距离不同, 纸牌的边长可以相差一倍
+
+'''
+@brief 筛选纸牌候选区域: 宽不小于下限, 高与宽之比接近纸牌, 面积不远小于其他候选
+@param candidates: 候选区域, 形状为(n, 4), 元素的形式为[行数, 列数, 宽, 高], 其中 宽 <= 高
+@param min_size: 宽的下限(像素)
+@return cards_info: 筛选后的候选区域
+'''
+def filter_cards (candidates, min_size):
+    width = candidates[:, 2]
+    height = candidates[:, 3]
+    is_card = (width > min_size) & (height >= width * CARD_ASPECT_RANGE[0]) & (height <= width * CARD_ASPECT_RANGE[1])
+    candidates = candidates[is_card]
+    if candidates.shape[0] == 0:
+        return candidates
+    areas = candidates[:, 2] * candidates[:, 3]
+    return candidates[areas >= np.median(areas) * CARD_MIN_AREA_RATIO]
+
+'''
+@brief 获取纸牌位置和大小, 纸牌数量不限, 可以包括多张桌面, 根据纸牌的位置自动划分桌面并推断行数和列数
+@param img_bin: 二值化后的含有纸牌的图像
+@param method: 纸牌定位方式, "contour": 轮廓检测加最小外接矩形, "label": 连通域标记加外接矩形(适用于摆正的纸牌)
+@param min_size: 纸牌宽的下限(像素), 用于筛除噪声, 为None时取图像长边的CARD_MIN_FRACTION倍
+@return layout: 纸牌布局(SetLayout.Layout), 每张纸牌的信息的形式为[行数, 列数, 宽, 高]
+'''
+def get_layout (img_bin, method = "contour", min_size = None):
+    if min_size is None:
+        min_size = max(img_bin.shape) * CARD_MIN_FRACTION
+
+    candidates = np.zeros((0, 4))
+    if method == "contour":
+        # 轮廓检测, 每个轮廓的最小外接矩形整理成(row, column, w, h)的形式, 其中 w <= h
+        contours, _ = cv.findContours(img_bin, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)  # 检测出连通域的边缘
+        if len(contours) > 0:
+            rects = np.array([(rect[0][1], rect[0][0], rect[1][0], rect[1][1]) for rect in map(cv.minAreaRect, contours)])
+            candidates = np.concatenate([rects[:, :2], np.sort(rects[:, 2:], axis = 1)], axis = 1)
+    elif method == "label":
+        # 连通域标记, 每个连通域的外接矩形即为纸牌的位置和大小
+        _, stats, _ = ImgProc.connected_components(img_bin)
+        if len(stats) > 0:
+            stats = np.asarray(stats)
+            center = (stats[:, 0:2] + stats[:, 2:4]) / 2
+            candidates = np.concatenate([center, np.sort(stats[:, 2:4] - stats[:, 0:2] + 1, axis = 1)], axis = 1)
+
+    # 按纸牌的位置划分桌面并推断网格, 纸牌先按桌面, 再按从上到下, 从左到右的顺序编号
+    cards_info = filter_cards(candidates, min_size).astype(int)
+    return SetLayout.Layout(cards_info)
+
+'''
+@brief 按hsv阈值对像素进行颜色分类
+@param hsv_array: hsv图像数组, 最后一维为[h, s, v]
+@return color_class: 与像素一一对应, 1: 红色, 2: 绿色, 3: 紫色, 0: 其他
+'''
+def classify_hsv (hsv_array):
+    h = hsv_array[..., 0]
+    s = hsv_array[..., 1]
+    v = hsv_array[..., 2]
+
+    # 判断颜色
+    is_red = ((h <= 10) | (h >= 245)) & (s >= 50) & (v >= 50)
+    is_green = (h >= 64) & (h <= 106) & (s >= 50) & (v >= 50)
+    is_purple = (h >= 180) & (h <= 230) & (s >= 10) & (v >= 10) & (v <= 200)
+
+    # 三个条件互斥, 按红, 绿, 紫的顺序赋值
+    color_class = np.zeros(h.shape, dtype = np.uint8)
+    color_class[is_purple] = 3
+    color_class[is_green] = 2
+    color_class[is_red] = 1
+    return color_class
+
+# 颜色查找表: 256 * 256 * 256的rgb立方体, 每个颜色的分类占2位, 修改classify_hsv的阈值后需要增加版本号
+COLOR_LUT_VERSION = 1
+COLOR_LUT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "color_lut_v%d.npy" % COLOR_LUT_VERSION)
+COLOR_LUT_WAIT = 30  # 其他进程正在生成查找表时等待的最长时间(秒)
+color_lut = None
+color_lut_lock = threading.Lock()  # 同一进程中的多个线程只生成一次
+
+'''
+@brief 根据classify_hsv的阈值生成颜色查找表, 每次处理红色分量相同的65536个颜色, 内存占用不超过几MB
+@return lut: uint8数组, 长度为2^22, 每个字节依次存放4个颜色的分类(低位在前)
+'''
+def build_color_lut ():
+    green, blue = np.meshgrid(np.arange(256, dtype = np.uint8), np.arange(256, dtype = np.uint8), indexing = "ij")
+    rgb_array = np.stack([np.zeros_like(green), green, blue], axis = -1)
+    lut = np.empty((256, 1 << 14), dtype = np.uint8)
+    for red in range(256):
+        rgb_array[..., 0] = red
+        color_class = classify_hsv(ImgProc.rgb_to_hsv(rgb_array)).reshape(-1, 4)
+        lut[red] = color_class[:, 0] | (color_class[:, 1] << 2) | (color_class[:, 2] << 4) | (color_class[:, 3] << 6)
+    return lut.reshape(-1)
+
+'''
+@brief 从磁盘以内存映射的方式加载颜色查找表
+@return lut: 颜色查找表, 文件不存在或损坏时为None
+'''
+def load_color_lut ():
+    try:
+        return np.load(COLOR_LUT_PATH, mmap_mode = 'r')
+    except (OSError, ValueError):
+        return None
+
+'''
+@brief 生成颜色查找表并保存, 多个进程同时需要时只由一个进程生成
+       通过独占创建锁文件选出生成的进程, 其他进程等待文件写入后加载, 等待超时(例如生成的进程异常退出)时自行生成
+@return lut: 颜色查找表
+'''
+def create_color_lut ():
+    lock_path = COLOR_LUT_PATH + ".lock"
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        deadline = time.monotonic() + COLOR_LUT_WAIT
+        while os.path.exists(lock_path) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        lut = load_color_lut()
+        if lut is not None:
+            return lut
+        fd = None  # 等待超时, 锁文件由异常退出的进程留下
+    except OSError:  # 目录不可写时只在内存中使用
+        return build_color_lut()
+
+    lut = build_color_lut()
+    try:
+        temp_path = "%s.%d.tmp" % (COLOR_LUT_PATH, os.getpid())
+        with open(temp_path, "wb") as f:
+            np.save(f, lut)
+        os.replace(temp_path, COLOR_LUT_PATH)
+    except OSError:
+        pass
+    finally:
+        if fd is not None:
+            os.close(fd)
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+    return lut
+
+'''
+@brief 获取颜色查找表, 第一次使用时从磁盘以内存映射的方式加载, 文件不存在时生成并保存
+@return lut: 颜色查找表
+'''
+def get_color_lut ():
+    global color_lut
+
+    if color_lut is None:
+        with color_lut_lock:
+            if color_lut is None:
+                lut = load_color_lut()
+                color_lut = lut if lut is not None else create_color_lut()
+    return color_lut
+
+'''
+@brief 通过颜色查找表对rgb像素进行颜色分类, 与先转换到hsv空间再调用classify_hsv的结果相同
+@param rgb_array: rgb图像数组, 最后一维为[r, g, b]
+@return color_class: 与像素一一对应, 1: 红色, 2: 绿色, 3: 紫色, 0: 其他
+'''
+def classify_rgb (rgb_array):
+    return ImgKernel.classify_rgb(rgb_array, get_color_lut())
+
+'''
+@brief 获取纸牌的检测区域: 纸牌中心所在的一列
+@param img_rgb: rgb图像, 含有纸牌
+@param card_info: 纸牌信息, 形式为[行数, 列数, 宽, 高]
+@return analysis_array: 检测区域的像素, 形状为(像素数, 3)
+'''
+def get_color_area (img_rgb, card_info):
+    # 确定检测的区域, 加减10是为了防止取到纸牌之外的区域
+    center = (card_info[0], card_info[1])
+    up = center[0] - int(card_info[3] / 2) + 10
+    down = center[0] + int(card_info[3] / 2) - 10
+    return img_rgb[up : down, center[1], :]
+
+'''
+@brief 多数投票, 得到每张纸牌的颜色
+@param color_class: 全部检测像素的颜色分类
+@param card_index: 每个像素所属的纸牌序号
+@param cards_num: 纸牌数量
+@return colors: 每张纸牌的颜色, 没有任何彩色像素时为0
+'''
+def vote_color (color_class, card_index, cards_num):
+    votes = np.bincount(card_index * 4 + color_class, minlength = cards_num * 4).reshape(cards_num, 4)
+    colors = np.argmax(votes[:, 1:], axis = 1) + 1
+    colors[votes[:, 1:].sum(axis = 1) == 0] = 0
+    return colors
+
+'''
+@brief 获取单张纸牌的颜色
+@param img_rgb: rgb图像, 含有纸牌
+@param card_info: 纸牌信息, 形式为[行数, 列数, 宽, 高]
+@return color: 1: 红色, 2: 绿色, 3: 紫色, 0: 未识别
+'''
+def get_card_color (img_rgb, card_info):
+    color_class = classify_rgb(get_color_area(img_rgb, card_info))
+    return int(vote_color(color_class, np.zeros(color_class.shape[0], dtype = int), 1)[0])
+
+'''
+@brief 获取纸牌的颜色, 全部纸牌的检测区域一次查表分类后多数投票
+@param img_rgb: rgb图像, 含有纸牌
+@param layout: 纸牌布局
+@return colors: 每张纸牌的颜色, 按纸牌编号排列, 1: 红色, 2: 绿色, 3: 紫色
+'''
+def get_color (img_rgb, layout):
+    if len(layout) == 0:
+        return np.zeros(0, dtype = int)
+
+    # 拼接全部纸牌的检测区域
+    areas = [get_color_area(img_rgb, layout.get_card_info(card_id)) for card_id in range(len(layout))]
+    card_index = np.repeat(np.arange(len(areas)), [area.shape[0] for area in areas])
+    analysis_array = np.concatenate(areas, axis = 0)
+
+    # 查表分类
+    color_class = classify_rgb(analysis_array)
+    colors = vote_color(color_class, card_index, len(areas))
+
+    # print("color:")
+    # print(colors)
+    return colors
+
+'''
+@brief 去除条纹的开运算, 个数识别和形状识别共用
+@param img_bin: 二值化后的含有纸牌的图像
+@param out: 输出数组, 为None时分配新的数组
+@param pool: 缓冲区池(ImgProc.BufferPool), 用于临时数组, 为None时分配新的数组
+@return img_open: 开运算后的图像, 条纹变为实心, 此时有实心和空心两种纹路
+'''
+def get_opening (img_bin, out = None, pool = None):
+    return ImgProc.morphology_process(img_bin, method = "opening", dilation_se_size = 7, erosion_se_size = 9, out = out, pool = pool)
+
+'''
+@brief 获取单张纸牌的感兴趣区域, 加减10是为了防止取到纸牌之外的区域
+@param image: 图像数组
+@param card_info: 纸牌信息, 形式为[行数, 列数, 宽, 高]
+@return roi: 感兴趣区域(视图, 不复制数据)
+'''
+def get_card_roi (image, card_info):
+    row_min = card_info[0] - int(card_info[3] / 2) + 10
+    row_max = card_info[0] + int(card_info[3] / 2) - 10
+    column_min = card_info[1] - int(card_info[2] / 2) + 10
+    column_max = card_info[1] + int(card_info[2] / 2) - 10
+    return image[row_min : row_max + 1, column_min : column_max + 1]
+
+# 形状识别方式, "hough": 直线检测加圆度, "moments": 轮廓矩特征加查找表(更快, 但阈值只在合成图像上调整过, 还没有在实拍照片上验证)
+APPEARANCE_METHOD = "hough"
+
+# 轮廓特征的阈值, 特征与阈值比较得到3个二值特征, 作为SHAPE_TABLE的下标
+SHAPE_MIN_SOLIDITY = 0.93  # 凸度(面积 / 凸包面积)低于此值为凹形
+SHAPE_MAX_DEFECT = 0.07  # 最深的凸缺陷深度(相对于面积的平方根)高于此值为凹形
+SHAPE_MIN_CIRCULARITY = 0.61  # 圆度高于此值为圆形(椭圆或波浪), 低于此值为菱形
+SHAPE_MIN_HU = 0.225  # 第一个Hu矩高于此值为不规则形状(波浪), 椭圆的较小
+
+'''
+@brief 生成形状的查找表
+@return table: 形状为(2, 2, 2), 下标依次为[是否凹形, 是否圆形, 是否不规则], 值为1: 菱形, 2: 椭圆, 3: 波浪
+'''
+def build_shape_table ():
+    table = np.zeros((2, 2, 2), dtype = int)
+    table[1] = 3  # 凹形: 波浪
+    table[0, 0] = 1  # 凸形且不圆: 菱形
+    table[0, 1, 0] = 2  # 凸形, 圆, 规则: 椭圆
+    table[0, 1, 1] = 3  # 凸形, 圆, 不规则: 边缘起伏较小的波浪
+    return table
+
+SHAPE_TABLE = build_shape_table()
+
+'''
+@brief 计算纸牌中每个图形的轮廓特征
+@param roi: 纸牌的感兴趣区域(二值图像), 图形为0
+@return features: 形状为(图形数量, 4), 每一行为[凸度, 最深的凸缺陷深度, 圆度, 第一个Hu矩], 按面积从大到小排列
+'''
+def get_shape_features (roi):
+    mask = np.equal(roi, 0).view(np.uint8)  # 图形为1, 不复制数据
+    contours, _ = cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+    areas = np.array([cv.contourArea(contour) for contour in contours])
+    if areas.shape[0] == 0:
+        return np.zeros((0, 4))
+
+    # 面积远小于最大的图形的轮廓是噪声
+    features = []
+    for index in np.argsort(areas)[::-1]:
+        area = areas[index]
+        if area < 50 or area < 0.3 * areas.max():
+            break
+        contour = contours[index]
+        hull_index = cv.convexHull(contour, returnPoints = False)
+        solidity = area / max(cv.contourArea(contour[hull_index.reshape(-1)]), 1)
+        try:
+            defects = cv.convexityDefects(contour, hull_index) if hull_index.shape[0] > 3 else None
+        except cv.error:  # 自相接触的轮廓的凸包下标不单调, 按没有凸缺陷处理, 其余特征仍可区分形状
+            defects = None
+        defect = 0.0 if defects is None else defects.reshape(-1, 4)[:, 3].max() / 256 / np.sqrt(area)  # 深度为定点数(8位小数)
+        circularity = 4 * np.pi * area / max(cv.arcLength(contour, True), 1) ** 2
+        hu = cv.HuMoments(cv.moments(contour))[0, 0]
+        features.append([solidity, defect, circularity, hu])
+    return np.array(features)
+
+'''
+@brief 根据轮廓特征识别单张纸牌中的图形形状, 每个图形查表后投票, 票数相同时取面积最大的图形的结果
+@param img_open: 去除条纹的开运算后的图像
+@param card_info: 纸牌信息, 形式为[行数, 列数, 宽, 高]
+@return appearance: 0: 未识别, 1: 菱形, 2: 椭圆, 3: 波浪
+'''
+def get_card_appearance_moments (img_open, card_info):
+    with SetProfile.profiler.stage("contour_moments"):
+        features = get_shape_features(get_card_roi(img_open, card_info))
+    if features.shape[0] == 0:
+        return 0
+    is_concave = (features[:, 0] < SHAPE_MIN_SOLIDITY) | (features[:, 1] > SHAPE_MAX_DEFECT)
+    is_round = features[:, 2] > SHAPE_MIN_CIRCULARITY
+    is_irregular = features[:, 3] > SHAPE_MIN_HU
+    appearances = SHAPE_TABLE[is_concave.astype(int), is_round.astype(int), is_irregular.astype(int)]
+    votes = np.bincount(appearances, minlength = 4).astype(float)
+    votes[appearances[0]] += 0.5  # 票数相同时面积最大的图形优先
+    return int(np.argmax(votes))
+
+'''
+@brief 获取单张纸牌中的图形形状
+@param img_open: 去除条纹的开运算后的图像
+@param card_info: 纸牌信息, 形式为[行数, 列数, 宽, 高]
+@param method: 形状识别方式, "moments"或"hough"
+@return appearance: 1: 菱形, 2: 椭圆, 3: 波浪
+'''
+def get_card_appearance (img_open, card_info, method = None):
+    if (method or APPEARANCE_METHOD) == "moments":
+        return get_card_appearance_moments(img_open, card_info)
+    return get_card_appearance_hough(img_open, card_info)
+
+'''
+@brief 通过直线检测和圆度识别单张纸牌中的图形形状
+@param img_open: 去除条纹的开运算后的图像
+@param card_info: 纸牌信息, 形式为[行数, 列数, 宽, 高]
+@return appearance: 1: 菱形, 2: 椭圆, 3: 波浪
+'''
+def get_card_appearance_hough (img_open, card_info):
+    roi = get_card_roi(img_open, card_info)
+
+    # 对感兴趣区域进行处理, 便于进行连通域检测
+    roi = roi.astype(np.uint8)  # 转换为适合取反的类型
+    roi = ~roi  # 取反, 方便进行连通域检测
+    roi = ImgProc.morphology_process(roi, method = "opening", dilation_se_size = 3, erosion_se_size = 3)  # 开运算, 消去一些噪点
+
+    # 直线检测, 通过检测到的直线数量, 进行第一次筛选
+    with SetProfile.profiler.stage("canny_hough"):
+        roi_edge = cv.Canny(roi, 180, 240)  # Canny边缘检测
+        lines = cv.HoughLinesP(roi_edge, rho = 1, theta = np.pi / 180, threshold = 30, minLineLength = 30, maxLineGap = 5)  # 霍夫变换检测直线
+    if lines is None:  # 获取直线数量
+        lines_num = 0
+    else:
+        lines_num = lines.shape[0]
+
+    if lines_num == 0:  # 如果检测到的直线的数量等于0, 说明图形形状为波浪
+        return 3  # 如果已经确定是波浪, 就不用进行第二次筛选
+
+    # 通过计算圆度来进行第二次筛选
+    with SetProfile.profiler.stage("contours"):
+        contours, _ = cv.findContours(roi, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)  # 连通域检测, 得到连通域边缘
+    c_list = []  # 圆度列表
+    for i in range(len(contours)):
+        if len(contours[i]) > 50:  # 选取一条足够长的轮廓, 防止取到一些噪声导致的轮廓
+            cnt = contours[i]
+            area = cv.contourArea(cnt)  # 连通域面积
+            length = cv.arcLength(cnt, True)  # 连通域轮廓周长
+            c = (4 * np.pi * area) / (length ** 2)  # 圆度
+            c_list.append(c)  # 添加至列表最后
+
+    c_array = np.array(c_list)
+    c_mean = c_array.mean()  # 计算圆度平均值
+    if c_mean > 0.65:  # 如果圆度平均值较大, 则认为是椭圆
+        return 2
+    else:  # 如果圆度平均值较小, 则认为是菱形
+        return 1
+
+'''
+@brief 获取纸牌中的图形形状
+@param img_bin: 二值化后的含有纸牌的图像
+@param layout: 纸牌布局
+@param img_open: 去除条纹的开运算后的图像, 为None时重新计算
+@param method: 形状识别方式, "moments"或"hough", 为None时使用APPEARANCE_METHOD
+@return appearances: 每张纸牌的形状, 按纸牌编号排列, 1: 菱形, 2: 椭圆, 3: 波浪
+'''
+def get_appearance (img_bin, layout, img_open = None, method = None):
+    # 开运算, 消除条纹, 使得后续边缘检测不受条纹影响
+    if img_open is None:
+        img_open = get_opening(img_bin)
+
+    # 形状识别
+    appearances = np.zeros(len(layout), dtype = int)
+    for card_id in range(len(layout)):
+        appearances[card_id] = get_card_appearance(img_open, layout.get_card_info(card_id), method)
+
+    # print("appearance:")
+    # print(appearances)
+    return appearances
+
+NUMBER_SCANLINES = 3  # 个数识别时每张纸牌使用的扫描线数量, 多于1条时投票
+NUMBER_SCANLINE_STEP = 0.06  # 相邻扫描线的间距, 为纸牌宽度的比例
+
+# 数值变化的次数到图形个数的映射, 次数为2时还要根据第一次变化到第二次变化的距离判断, 其他次数为0(未识别)
+# 次数为3（空心纹路）或6（实心纹路）: 3个; 次数为4（实心纹路）: 2个; 次数为1（空心纹路）: 1个
+NUMBER_BY_COUNT = np.array([0, 1, 0, 3, 2, 0, 3])
+
+'''
+@brief 取出全部纸牌的竖直扫描线, 每条扫描线从纸牌中心(或其左右两侧)竖直向下
+       图形与纸牌边界有一定距离, 减10可以使得在遍历时, 不会遍历到纸牌外的区域
+@param img_open: 去除条纹的开运算后的图像
+@param cards_info: 纸牌信息, 形状为(n, 4), 元素的形式为[行数, 列数, 宽, 高]
+@param scanlines: 每张纸牌的扫描线数量
+@return lines: 形状为(n * scanlines, 最长的扫描线长度), 较短的扫描线用最后一个像素填充(不增加数值变化)
+@return lengths: 每条扫描线的实际长度
+'''
+def get_number_scanlines (img_open, cards_info, scanlines = 1):
+    cards_info = np.asarray(cards_info, dtype = int).reshape(-1, 4)
+    offsets = np.round((np.arange(scanlines) - (scanlines - 1) / 2) * NUMBER_SCANLINE_STEP * cards_info[:, 2:3]).astype(int)
+    columns = np.clip(cards_info[:, 1:2] + offsets, 0, img_open.shape[1] - 1).reshape(-1)
+    top = np.repeat(cards_info[:, 0], scanlines)
+    lengths = np.repeat(np.maximum(cards_info[:, 3] // 2 - 10, 0), scanlines)
+
+    max_length = max(int(lengths.max()), 1) if lengths.shape[0] > 0 else 1
+    rows = top[:, None] + np.minimum(np.arange(max_length), np.maximum(lengths - 1, 0)[:, None])
+    lines = img_open[np.clip(rows, 0, img_open.shape[0] - 1), columns[:, None]]
+    return lines, lengths
+
+'''
+@brief 一次识别全部纸牌中的图形的数量, 多条扫描线时按多数投票
+@param img_open: 去除条纹的开运算后的图像
+@param cards_info: 纸牌信息, 形状为(n, 4), 元素的形式为[行数, 列数, 宽, 高]
+@param scanlines: 每张纸牌的扫描线数量
+@return numbers: 图形个数, 0: 未识别
+@return confidence: 与识别结果一致的扫描线的比例, 未识别时为0
+'''
+def classify_number (img_open, cards_info, scanlines = NUMBER_SCANLINES):
+    lines, lengths = get_number_scanlines(img_open, cards_info, scanlines)
+    count, first_to_second = ImgKernel.count_transitions(lines, lengths)  # 游程编码, 全部扫描线一次完成
+
+    # 判断每条扫描线的个数, 次数为2时, 距离较长为2个(实心纹路), 距离较短为1个(空心纹路)
+    line_numbers = NUMBER_BY_COUNT[np.minimum(count, NUMBER_BY_COUNT.shape[0] - 1)]
+    line_numbers[count >= NUMBER_BY_COUNT.shape[0]] = 0
+    line_numbers[count == 2] = np.where(first_to_second[count == 2] > 10, 2, 1)
+    line_numbers = line_numbers.reshape(-1, scanlines)
+
+    # 投票, 票数相同时中间的扫描线优先
+    votes = (line_numbers[..., None] == np.array([1, 2, 3])).sum(axis = 1).astype(float)
+    votes += 0.5 * (line_numbers[:, scanlines // 2, None] == np.array([1, 2, 3]))
+    numbers = np.where(votes.max(axis = 1) > 0, np.argmax(votes, axis = 1) + 1, 0)
+    confidence = np.floor(votes.max(axis = 1)) / scanlines
+    return numbers, confidence
+
+'''
+@brief 获取单张纸牌中的图形的数量
+@param img_open: 去除条纹的开运算后的图像
+@param card_info: 纸牌信息, 形式为[行数, 列数, 宽, 高]
+@return number: 图形个数, 0: 未识别
+@return confidence: 与识别结果一致的扫描线的比例
+'''
+def get_card_number (img_open, card_info):
+    numbers, confidence = classify_number(img_open, [card_info])
+    return int(numbers[0]), float(confidence[0])
+
+'''
+@brief 获取纸牌中的图形的数量
+@param img_bin: 二值化后的含有纸牌的图像
+@param layout: 纸牌布局
+@param img_open: 去除条纹的开运算后的图像, 为None时重新计算
+@param scanlines: 每张纸牌的扫描线数量
+@return numbers: 每张纸牌的图形个数, 按纸牌编号排列
+@return confidence: 每张纸牌的个数的置信度
+'''
+def get_number (img_bin, layout, img_open = None, scanlines = NUMBER_SCANLINES):
+    # 开运算, 消除条纹, 使条纹变为实心, 此时有实心和空心两种纹路
+    if img_open is None:
+        img_open = get_opening(img_bin)
+
+    # 获取图形个数
+    return classify_number(img_open, layout.cards_info, scanlines)
+
+'''
+@brief 获取单张纸牌图形中的纹路
+@param img_bin: 二值化后的含有纸牌的图像
+@param card_info: 纸牌信息, 形式为[行数, 列数, 宽, 高]
+@param number: 该纸牌的图形个数
+@return texture: 1: 空心, 2: 实心, 3: 条纹
+'''
+def get_card_texture (img_bin, card_info, number):
+    near_size = 10
+    center = (card_info[0], card_info[1])
+
+    if number == 2:
+        # 分别向上和向下取直线, 然后合并
+        near_area_1 = img_bin[center[0] + 20, center[1] - near_size : center[1] + near_size + 1]
+        near_area_2 = img_bin[center[0] - 20, center[1] - near_size : center[1] + near_size + 1]
+        near_area = np.concatenate((near_area_1, near_area_2))
+    else:
+        # 取以中心点为中心的一条直线
+        near_area = img_bin[center[0], center[1] - near_size : center[1] + near_size + 1]
+
+    var = np.var(near_area)  # 计算方差
+    if var > 0:  # 如果方差大于0, 图形内部像素有变化, 说明是条纹纹路
+        return 3
+    else:  # 如果方差等于0
+        mean = np.mean(near_area)  # 求均值
+        if mean < 127:  # 如果均值较小, 说明图形内部偏向于黑色, 说明是实心纹路
+            return 2
+        else:  # 如果均值较大, 说明图形内部偏向于白色, 说明是空心纹路
+            return 1
+
+'''
+@brief 获取图形中的纹路
+@param img_bin: 二值化后的含有纸牌的图像
+@param layout: 纸牌布局
+@param number: 每张纸牌的图形个数
+@return textures: 每张纸牌的纹路, 按纸牌编号排列, 1: 空心, 2: 实心, 3: 条纹
+'''
+def get_texture (img_bin, layout, number):
+    textures = np.zeros(len(layout), dtype = int)
+    for card_id in range(len(layout)):
+        textures[card_id] = get_card_texture(img_bin, layout.get_card_info(card_id), number[card_id])
+
+    # print("texture:")
+    # print(textures)
+    return textures
+
+'''
+@brief 计算纸牌的置信度: 识别出的特征的比例, 乘以个数的投票置信度
+@param cards_feature: 纸牌特征, 最后一维为[个数, 纹路, 颜色, 形状]
+@param number_confidence: 个数的投票置信度
+@return confidence: 每张纸牌的置信度
+'''
+def get_confidence (cards_feature, number_confidence):
+    cards_feature = np.asarray(cards_feature)
+    return np.mean((cards_feature >= 1) & (cards_feature <= 3), axis = -1) * number_confidence
+
+'''
+@brief 识别单张纸牌的全部特征
+@param img_rgb: rgb图像, 含有纸牌
+@param img_bin: 二值化后的含有纸牌的图像
+@param img_open: 去除条纹的开运算后的图像
+@param card_info: 纸牌信息, 形式为[行数, 列数, 宽, 高]
+@return card_feature: [个数, 纹路, 颜色, 形状]
+@return confidence: 置信度, 与逐阶段识别全部纸牌时的置信度相同
+'''
+def get_card_feature (img_rgb, img_bin, img_open, card_info):
+    number, number_confidence = get_card_number(img_open, card_info)
+    texture = get_card_texture(img_bin, card_info, number)
+    color = get_card_color(img_rgb, card_info)
+    appearance = get_card_appearance(img_open, card_info)
+    card_feature = [number, texture, color, appearance]
+    return card_feature, float(get_confidence(card_feature, number_confidence))
+
+'''
+@brief 将纸牌特征编码为三进制整数
+@param cards_feature: 纸牌特征, 最后一维为[个数, 纹路, 颜色, 形状], 取值为1, 2, 3
+@return cards_code: 纸牌编码, 取值为0~80, 存在未识别的特征(取值不为1, 2, 3)的纸牌编码为-1
+'''
+def get_cards_code (cards_feature):
+    digits = cards_feature.reshape(-1, 4).astype(int) - 1
+    cards_code = digits @ np.array([27, 9, 3, 1])
+    cards_code[np.any((digits < 0) | (digits > 2), axis = 1)] = -1
+    return cards_code
+
+'''
+@brief 寻找全部set对应的三张纸牌的编号
+@param cards_feature: 纸牌特征, 即[个数, 纹路, 颜色, 形状], 形状为(纸牌数量, 4)或(行数, 列数, 4), 纸牌数量不限
+@return all_set: 所有可以组成set的三张纸牌的编号(按行优先展开后的序号), 形状为(set数量, 3), 每一行从小到大排列
+'''
+def search_set_index (cards_feature):
+    cards_code = get_cards_code(cards_feature)
+    digits = cards_feature.reshape(-1, 4).astype(int) - 1
+
+    # 编码到纸牌位置的索引表, 不存在的编码为-1, 特征重复时取第一张
+    code_to_index = np.full(81, -1, dtype = int)
+    valid_index = np.flatnonzero(cards_code >= 0)[::-1]
+    code_to_index[cards_code[valid_index]] = valid_index
+
+    # 任意选出两张纸牌(i < j), 每个特征的第三个取值为(-a - b) mod 3, 查表得到第三张纸牌k
+    index1, index2 = np.triu_indices(cards_code.shape[0], k = 1)
+    is_valid = (cards_code[index1] >= 0) & (cards_code[index2] >= 0)
+    index1 = index1[is_valid]
+    index2 = index2[is_valid]
+    set_key = (-digits[index1] - digits[index2]) % 3
+    index3 = code_to_index[set_key @ np.array([27, 9, 3, 1])]
+
+    # 只保留 i < j < k 的组合, 使每一组set只出现一次
+    is_set = index3 > index2
+    all_set = np.stack([index1[is_set], index2[is_set], index3[is_set]], axis = 1)
+    # print("all set:")
+    # print(all_set)
+    return all_set
+
+'''
+@brief 在每张桌面上分别寻找set, 不同桌面的纸牌不会组成set
+@param cards_feature: 纸牌特征, 形状为(纸牌数量, 4), 按纸牌编号排列
+@param layout: 纸牌布局
+@return all_set: 所有可以组成set的三张纸牌的编号, 形状为(set数量, 3), 按桌面排列
+'''
+def search_layout_set (cards_feature, layout):
+    cards_feature = np.asarray(cards_feature).reshape(-1, 4)
+    all_set = [search_set_index(cards_feature[start : stop]) + start for start, stop in layout.table_ranges()]
+    return np.concatenate(all_set).reshape(-1, 3) if len(all_set) > 0 else np.zeros((0, 3), dtype = int)
+
+'''
+@brief 寻找全部set对应的三张纸牌在网格中的位置
+@param cards_feature: 纸牌特征, 形状为(行数, 列数, 4)
+@return all_set_pos: 所有可以组成set的对应的三张纸牌的索引, 元素的形式为[[row1, column1], [row2, column2], [row3, column3]]
+'''
+def search_set_pos (cards_feature):
+    set_index = search_set_index(cards_feature)
+    return np.stack(np.unravel_index(set_index, cards_feature.shape[:-1]), axis = -1)
+
+'''
+@brief 在图像上标记出所有set, 使用不同颜色的圆来标记
+@param img_rgb: rgb图像, 不会被修改
+@param all_set: 所有可以组成set的三张纸牌的编号
+@param layout: 纸牌布局
+@return img_copy: 标记后的图像
+'''
+def draw_all_set (img_rgb, all_set, layout):
+    img_copy = img_rgb.copy()  # 复制一份
+    rgb = np.random.randint(0, 256, (all_set.shape[0], 3))  # 随机生成颜色
+
+    circle_r = 5  # 圆的半径
+    delta_row = 0
+    delta_column = 0
+    for i in range(all_set.shape[0]):
+        # 获取纸牌中心位置和纸牌大小
+        card1 = layout.card(all_set[i, 0])
+        card2 = layout.card(all_set[i, 1])
+        card3 = layout.card(all_set[i, 2])
+        card_center1 = (int(card1["row"]), int(card1["column"]))
+        card_size1 = (int(card1["width"]), int(card1["height"]))
+        card_center2 = (int(card2["row"]), int(card2["column"]))
+        card_size2 = (int(card2["width"]), int(card2["height"]))
+        card_center3 = (int(card3["row"]), int(card3["column"]))
+        card_size3 = (int(card3["width"]), int(card3["height"]))
+
+        # 计算圆心
+        point1 = (card_center1[1] - int(card_size1[0] / 2) + 10 + delta_column, card_center1[0] - int(card_size1[1] / 2) + 10 + delta_row)
+        point2 = (card_center2[1] - int(card_size2[0] / 2) + 10 + delta_column, card_center2[0] - int(card_size2[1] / 2) + 10 + delta_row)
+        point3 = (card_center3[1] - int(card_size3[0] / 2) + 10 + delta_column, card_center3[0] - int(card_size3[1] / 2) + 10 + delta_row)
+
+        # 获取颜色
+        color = (int(rgb[i, 0]), int(rgb[i, 1]), int(rgb[i, 2]))
+
+        # 画圆标记
+        cv.circle(img_copy, point1, circle_r, color = color, thickness = 3)
+        cv.circle(img_copy, point2, circle_r, color = color, thickness = 3)
+        cv.circle(img_copy, point3, circle_r, color = color, thickness = 3)
+
+        # 标记位置改变
+        delta_column += 15
+        if card_center1[1] - int(card_size1[0] / 2) + 10 + delta_column > card_center1[1] + int(card_size1[0] / 2) - 10:
+            delta_column = 0
+            delta_row += 15
+
+    return img_copy
+
+'''
+@brief 单帧图像的预处理上下文, 派生图像在第一次使用时计算并缓存, 每帧最多计算一次
+       使用缓冲区池时, 派生图像保存在池中的数组里, 更换图像后会被覆盖, 需要保留时应复制
+'''
+class FrameContext:
+    '''
+    @param img_rgb: 压缩后的rgb图像
+    @param img_gray: 压缩后的灰度图像, 不会被修改
+    @param pool: 缓冲区池(ImgProc.BufferPool), 连续处理相同分辨率的帧时重复使用派生图像和临时数组的内存
+    '''
+    def __init__ (self, img_rgb, img_gray, pool = None):
+        self.pool = pool
+        self.img_gray = None
+        self.set_image(img_rgb, img_gray)
+
+    '''
+    @brief 更换图像, 同时清空缓存, 分辨率改变时释放缓冲区池
+    '''
+    def set_image (self, img_rgb, img_gray):
+        if self.pool is not None and self.img_gray is not None and self.img_gray.shape != img_gray.shape:
+            self.pool.clear()
+        self.img_rgb = img_rgb
+        self.img_gray = img_gray
+        self.invalidate()
+
+    '''
+    @brief 清空全部缓存
+    '''
+    def invalidate (self):
+        self.cache = {}
+
+    '''
+    @brief 取出缓存, 不存在时调用func计算并缓存
+    '''
+    def get_cached (self, name, func, *args):
+        if name not in self.cache:
+            self.cache[name] = func(*args)
+        return self.cache[name]
+
+    '''
+    @brief 二值化图像, 结果写入单独的数组, 灰度图像保持不变
+    '''
+    def get_binary (self):
+        return self.get_cached("binary", lambda: ImgProc.image_binarization(self.img_gray, threshold = 180,
+                                                                            out = ImgProc.get_buffer(self.pool, "binary", self.img_gray.shape, np.uint8)))
+
+    '''
+    @brief 去除条纹的开运算后的图像
+    '''
+    def get_opening (self):
+        return self.get_cached("opening", lambda: get_opening(self.get_binary(), ImgProc.get_buffer(self.pool, "opening", self.img_gray.shape, np.uint8), self.pool))
+
+    '''
+    @brief 纸牌布局(位置和大小)
+    '''
+    def get_layout (self):
+        return self.get_cached("layout", get_layout, self.get_binary())
+
+'''
+@brief 后台任务被取消时, 在下一个阶段开始前抛出的异常
+'''
+class Cancelled (Exception):
+    pass
+
+stage_listener = threading.local()  # 当前线程正在执行的后台任务(例如SetGame.Job), 每个阶段开始前通知任务
+
+'''
+@brief 运行一个处理阶段, 并记录耗时, 同时记录到全局的性能分析器(开启时)
+       在后台任务中运行时, 先向任务报告进度, 任务已取消时抛出Cancelled
+@param timings: 耗时字典, 为None时不记录
+@param name: 阶段名称
+@param func: 阶段对应的函数
+@return result: 函数的返回值
+'''
+def run_stage (timings, name, func, *args, **kwargs):
+    job = getattr(stage_listener, "job", None)
+    if job is not None:
+        job.enter_stage(name)
+    start = time.perf_counter()
+    with SetProfile.profiler.stage(name):
+        result = func(*args, **kwargs)
+    if timings is not None:
+        timings[name] = time.perf_counter() - start
+    return result
+
+'''
+@brief 在预处理上下文上识别纸牌并寻找全部set, 派生图像只计算一次
+@param context: 预处理上下文(FrameContext)
+@param timings: 耗时字典, 不为None时记录每个阶段的耗时(秒)
+@param card_workers: 大于0时按纸牌并行识别特征, 为使用的线程数量
+@return layout: 纸牌布局, 包括每张纸牌的位置, 大小和特征
+@return all_set: 所有可以组成set的三张纸牌的编号
+'''
+def recognize_frame (context, timings = None, card_workers = 0):
+    # 预处理
+    img_bin = run_stage(timings, "binarization", context.get_binary)  # 图像二值化
+    layout = run_stage(timings, "layout", context.get_layout).copy()  # 获取纸牌布局, 复制后写入特征, 缓存保持不变
+
+    # 纸牌的大小与调整阈值时的大小相差较大时(例如纸牌较多或拍摄距离较远), 把每张纸牌缩放到统一的高度后识别
+    if not is_reference_scale(layout):
+        cards_feature, confidence = run_stage(timings, "cards_feature", get_cards_feature, context, layout, None, card_workers)
+        layout.set_features(cards_feature, confidence)
+        all_set = run_stage(timings, "search_set", search_layout_set, cards_feature, layout)
+        return layout, all_set
+
+    img_open = run_stage(timings, "opening", context.get_opening)  # 开运算, 个数识别和形状识别共用
+
+    # 获取特征
+    img_rgb = context.img_rgb
+    if card_workers > 0:
+        # 按纸牌并行: 每张纸牌只裁剪一次, 四种特征作为线程池中的一个任务
+        cards_feature, confidence = run_stage(timings, "cards_feature", get_cards_feature, context, layout, None, card_workers)
+    else:
+        number, number_confidence = run_stage(timings, "number", get_number, img_bin, layout, img_open)  # 获取图形个数
+        texture = run_stage(timings, "texture", get_texture, img_bin, layout, number)  # 获取纹路
+        color = run_stage(timings, "color", get_color, img_rgb, layout)  # 获取颜色
+        appearance = run_stage(timings, "appearance", get_appearance, img_bin, layout, img_open)  # 获取形状
+        cards_feature = np.stack([number, texture, color, appearance], axis = -1)  # 每一个元素的形式为[个数, 纹路, 颜色, 形状]
+
+        # 置信度: 识别出的特征的比例, 乘以个数的投票置信度
+        confidence = get_confidence(cards_feature, number_confidence)
+    layout.set_features(cards_feature, confidence)
+
+    # 获取所有set
+    all_set = run_stage(timings, "search_set", search_layout_set, cards_feature, layout)
+
+    return layout, all_set
+
+'''
+@brief 识别图像中的纸牌并寻找全部set, 不依赖界面
+@param img_rgb: 压缩后的rgb图像
+@param img_gray: 压缩后的灰度图像
+@param timings: 耗时字典, 不为None时记录每个阶段的耗时(秒)
+@param card_workers: 大于0时按纸牌并行识别特征, 为使用的线程数量
+@return layout: 纸牌布局, 包括每张纸牌的位置, 大小和特征
+@return all_set: 所有可以组成set的三张纸牌的编号
+'''
+def recognize (img_rgb, img_gray, timings = None, card_workers = 0):
+    return recognize_frame(FrameContext(img_rgb, img_gray), timings, card_workers)
+
+# 由粗到精的识别: 在缩小的图像上定位纸牌, 再从原图中裁剪出每张纸牌, 缩放到统一的高度后识别
+# 各个阈值(开运算结构元, 霍夫变换的线段长度等)是在800 * 600的图像上调整的, 统一的高度与其中纸牌的高度相近
+COARSE_SIZE = (400, 300)  # 定位纸牌时图像压缩到的大小
+ROI_CARD_HEIGHT = 170  # 纸牌图像统一缩放到的高度
+FRAME_SCALE_RANGE = (0.95, 1.1)  # 整幅图像识别时, 纸牌的高与ROI_CARD_HEIGHT之比在此范围内才直接使用整幅图像, 否则逐张缩放
+
+'''
+@brief 纸牌的大小是否与各个阈值调整时的大小相近
+@param layout: 纸牌布局
+@return is_reference: 纸牌高的中位数与ROI_CARD_HEIGHT之比是否在FRAME_SCALE_RANGE内, 没有纸牌时为True
+'''
+def is_reference_scale (layout):
+    if len(layout) == 0:
+        return True
+    ratio = np.median(layout.cards["height"]) / ROI_CARD_HEIGHT
+    return FRAME_SCALE_RANGE[0] <= ratio <= FRAME_SCALE_RANGE[1]
+
+'''
+@brief 缩小图像, 先按整数倍进行区域插值(OpenCV对整数倍有快速的实现), 再缩放到目标大小
+@param image: 图像数组
+@param size: 目标大小(宽, 高)
+@return image_resize: 缩小后的图像
+'''
+def shrink_image (image, size):
+    factor = int(min(image.shape[1] / size[0], image.shape[0] / size[1]))
+    if factor >= 2:
+        image = cv.resize(image, None, fx = 1 / factor, fy = 1 / factor, interpolation = cv.INTER_AREA)
+    if (image.shape[1], image.shape[0]) == tuple(size):
+        return image
+    interpolation = cv.INTER_AREA if image.shape[1] > size[0] else cv.INTER_LINEAR
+    return cv.resize(image, size, interpolation = interpolation)
+
+'''
+@brief 在缩小的图像上定位纸牌
+@param image_rgb: 原始分辨率的rgb图像
+@return layout: 纸牌布局, 为原图中的坐标
+'''
+def locate_cards (image_rgb):
+    height, width = image_rgb.shape[:2]
+    ratio = min(COARSE_SIZE[0] / width, COARSE_SIZE[1] / height)
+    coarse_size = (max(int(width * ratio), 1), max(int(height * ratio), 1))
+    coarse_rgb = shrink_image(image_rgb, coarse_size)
+    coarse_bin = ImgProc.image_binarization(ImgProc.rgb_to_gray(coarse_rgb), threshold = 180)
+    layout = get_layout(coarse_bin)  # 尺寸阈值与图像大小成比例, 不需要按压缩的比例调整
+
+    # 换算到原图中的坐标, 中心取像素的中心
+    for name in ["row", "column"]:
+        layout.cards[name] = np.round((layout.cards[name] + 0.5) / ratio)
+    for name in ["width", "height"]:
+        layout.cards[name] = np.round(layout.cards[name] / ratio)
+    return layout
+
+'''
+@brief 单张纸牌所在的区域, 四周保留高的1/10作为背景
+@param shape: 图像的形状
+@param card_info: 纸牌信息, 形式为[行数, 列数, 宽, 高]
+@return bounds: [最小行, 最大行, 最小列, 最大列], 不超出图像
+'''
+def get_card_bounds (shape, card_info):
+    margin = int(card_info[3] / 10)
+    row_min = max(card_info[0] - int(card_info[3] / 2) - margin, 0)
+    row_max = min(card_info[0] + int(card_info[3] / 2) + margin, shape[0] - 1)
+    column_min = max(card_info[1] - int(card_info[2] / 2) - margin, 0)
+    column_max = min(card_info[1] + int(card_info[2] / 2) + margin, shape[1] - 1)
+    return row_min, row_max, column_min, column_max
+
+'''
+@brief 从大小相同的多幅图像中裁剪出单张纸牌所在的区域, 不缩放
+@param images: 图像列表, 例如[rgb图像, 二值化后的图像, 开运算后的图像]
+@param card_info: 纸牌在图像中的信息, 形式为[行数, 列数, 宽, 高]
+@return crops: 裁剪出的区域(视图, 不复制数据), 与images一一对应
+@return crop_card_info: 纸牌在裁剪出的区域中的信息
+'''
+def crop_card (images, card_info):
+    row_min, row_max, column_min, column_max = get_card_bounds(images[0].shape, card_info)
+    crops = [image[row_min : row_max + 1, column_min : column_max + 1] for image in images]
+    return crops, np.array([card_info[0] - row_min, card_info[1] - column_min, card_info[2], card_info[3]])
+
+'''
+@brief 从原图中裁剪出单张纸牌, 并缩放到统一的高度
+@param image_rgb: 原始分辨率的rgb图像
+@param card_info: 纸牌在原图中的信息, 形式为[行数, 列数, 宽, 高]
+@param card_height: 纸牌缩放后的高
+@return patch_rgb: 纸牌图像, 四周保留少量背景, 使开运算不受裁剪边界的影响
+@return patch_card_info: 纸牌在纸牌图像中的信息
+'''
+def get_card_patch (image_rgb, card_info, card_height = ROI_CARD_HEIGHT):
+    row_min, row_max, column_min, column_max = get_card_bounds(image_rgb.shape, card_info)
+    crop = image_rgb[row_min : row_max + 1, column_min : column_max + 1]
+
+    # 直接从原图缩小, 条纹不会因为整幅图像的多次重采样而变模糊
+    ratio = card_height / card_info[3]
+    patch_size = (max(int(round(crop.shape[1] * ratio)), 1), max(int(round(crop.shape[0] * ratio)), 1))
+    patch_rgb = shrink_image(crop, patch_size)
+
+    row_ratio = patch_size[1] / crop.shape[0]
+    column_ratio = patch_size[0] / crop.shape[1]
+    patch_card_info = np.round([(card_info[0] - row_min) * row_ratio, (card_info[1] - column_min) * column_ratio,
+                                card_info[2] * column_ratio, card_info[3] * row_ratio]).astype(int)
+    return patch_rgb, patch_card_info
+
+'''
+@brief 在纸牌图像中重新定位纸牌, 修正在缩小的图像上定位的误差(图像很大, 例如包括多张桌面时, 缩小后的纸牌只有十几个像素)
+@param patch_bin: 二值化后的纸牌图像
+@param card_info: 纸牌在纸牌图像中的信息(由缩小的图像换算得到)
+@return card_info: 面积最大的轮廓的最小外接矩形, 位置或大小与原来相差较大时保持原来的信息
+'''
+def refine_card_info (patch_bin, card_info):
+    contours, _ = cv.findContours(patch_bin, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+    if len(contours) == 0:
+        return card_info
+    rect = cv.minAreaRect(max(contours, key = cv.contourArea))
+    refined = np.round([rect[0][1], rect[0][0], min(rect[1]), max(rect[1])]).astype(int)
+    is_near = np.all(np.abs(refined[:2] - card_info[:2]) < card_info[2:] / 4)
+    is_similar = np.all(np.abs(refined[2:] - card_info[2:]) < card_info[2:] / 4)
+    return refined if is_near and is_similar else card_info
+
+'''
+@brief 纸牌图像的预处理: 二值化和开运算只在纸牌图像上进行, 并在纸牌图像中重新定位纸牌
+@param patch_rgb: 纸牌图像
+@param card_info: 纸牌在纸牌图像中的信息
+@return patch_bin: 二值化后的纸牌图像
+@return patch_open: 开运算后的纸牌图像
+@return card_info: 修正后的纸牌信息
+'''
+def preprocess_patch (patch_rgb, card_info):
+    patch_bin = ImgProc.image_binarization(ImgProc.rgb_to_gray(patch_rgb), threshold = 180)
+    patch_open = get_opening(patch_bin)
+    return patch_bin, patch_open, refine_card_info(patch_bin, card_info)
+
+'''
+@brief 识别单张纸牌图像的全部特征
+@param patch_rgb: 纸牌图像
+@param card_info: 纸牌在纸牌图像中的信息
+@return card_feature: [个数, 纹路, 颜色, 形状]
+@return confidence: 置信度
+'''
+def get_patch_feature (patch_rgb, card_info):
+    return get_card_feature(patch_rgb, *preprocess_patch(patch_rgb, card_info))
+
+'''
+@brief 逐张识别指定的纸牌, 整幅图像识别和纸牌跟踪共用
+       纸牌的大小与阈值调整时相近时直接在整幅图像上识别, 否则从图像中裁剪纸牌, 缩放到统一的高度后识别,
+       各个以像素为单位的阈值(感兴趣区域的边距, 纹路的采样范围等)不受纸牌大小的影响
+@param context: 预处理上下文(FrameContext)
+@param layout: 纸牌布局, 按其中全部纸牌的高判断是否需要缩放
+@param card_ids: 需要识别的纸牌编号, 为None时识别全部纸牌
+@param workers: 大于0时每张纸牌作为线程池中的一个任务, 为使用的线程数量
+@param card_height: 纸牌缩放后的高
+@return cards_feature: 纸牌特征, 形状为(len(card_ids), 4), 与card_ids一一对应
+@return confidence: 每张纸牌的置信度
+'''
+def get_cards_feature (context, layout, card_ids = None, workers = 0, card_height = ROI_CARD_HEIGHT):
+    if card_ids is None:
+        card_ids = range(len(layout))
+    if is_reference_scale(layout):
+        images = [context.img_rgb, context.get_binary(), context.get_opening()]  # 在调用线程中计算, 上下文的缓存不会被多个线程同时写入
+
+        def classify_card (card_id):
+            crops, crop_card_info = crop_card(images, layout.get_card_info(card_id))
+            return get_card_feature(*crops, crop_card_info)
+    else:
+        def classify_card (card_id):
+            return get_patch_feature(*get_card_patch(context.img_rgb, layout.get_card_info(card_id), card_height))
+
+    if workers > 0:
+        with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+            results = list(executor.map(classify_card, card_ids))
+    else:
+        results = [classify_card(card_id) for card_id in card_ids]
+    cards_feature = np.array([feature for feature, _ in results], dtype = int).reshape(-1, 4)
+    confidence = np.array([confidence for _, confidence in results], dtype = float)
+    return cards_feature, confidence
+
+'''
+@brief 由粗到精地识别图像中的纸牌并寻找全部set, 不处理纸牌以外的区域
+@param image_rgb: 原始分辨率(或者只经过少量压缩)的rgb图像
+@param timings: 耗时字典, 不为None时记录每个阶段的耗时(秒)
+@param card_height: 纸牌缩放后的高
+@return layout: 纸牌布局, 为image_rgb中的坐标
+@return all_set: 所有可以组成set的三张纸牌的编号
+'''
+def recognize_roi (image_rgb, timings = None, card_height = ROI_CARD_HEIGHT):
+    layout = run_stage(timings, "locate", locate_cards, image_rgb)  # 在缩小的图像上定位纸牌
+    patches = run_stage(timings, "crop", lambda: [get_card_patch(image_rgb, layout.get_card_info(card_id), card_height) for card_id in range(len(layout))])  # 裁剪纸牌
+
+    # 获取特征
+    results = run_stage(timings, "cards_feature", lambda: [get_patch_feature(patch_rgb, patch_card_info) for patch_rgb, patch_card_info in patches])
+    cards_feature = np.array([feature for feature, _ in results], dtype = int).reshape(-1, 4)
+    layout.set_features(cards_feature, np.array([confidence for _, confidence in results], dtype = float))
+
+    # 获取所有set
+    all_set = run_stage(timings, "search_set", search_layout_set, cards_feature, layout)
+
+    return layout, all_set
+
+# 各个流程依次经过的阶段(run_stage的阶段名称), 在后台任务中运行时用于显示进度
+LOAD_STAGES = ("open", "resize")
+FRAME_STAGES = ("binarization", "layout", "opening", "cards_feature", "number", "texture", "color", "appearance", "search_set")
+ROI_STAGES = ("open", "locate", "crop", "cards_feature", "search_set")
+
+'''
+@brief 识别结果缓存的参数: 识别方式和运行时可以修改的, 会改变识别结果的设置
+       设置改变后(包括共用一个缓存文件的进程使用不同的设置时)不会取到按旧的设置得到的结果
+@param mode: "frame": 整幅图像识别, "roi": 由粗到精的识别
+@return params: 传给SetCache.image_key的参数字典
+'''
+def get_cache_params (mode):
+    return {"mode": mode, "appearance": APPEARANCE_METHOD, "scanlines": NUMBER_SCANLINES, "scanline_step": NUMBER_SCANLINE_STEP,
+            "backend": ImgKernel.get_backend(), "frame_scale_range": list(FRAME_SCALE_RANGE), "card_height": ROI_CARD_HEIGHT,
+            "coarse_size": list(COARSE_SIZE)}
+
+'''
+@brief 打开图像文件, JPEG图像在解码时直接按1/2, 1/4或1/8缩小(DCT缩放), 不解码出完整的原图
+@param file_path: 图像文件路径
+@param size: 图像之后会压缩到的大小(宽, 高), 解码得到的图像不小于压缩后的图像
+@return image: PIL的Image类对象, rgb图像
+'''
+def open_image (file_path, size = (800, 600)):
+    image = Image.open(file_path)
+    width, height = image.size
+    ratio = min(size[0] / width, size[1] / height)
+    if ratio < 1:
+        image.draft("RGB", (math.ceil(width * ratio), math.ceil(height * ratio)))  # 只对JPEG有效, 其他格式不变
+    return image.convert("RGB")
+
+'''
+@brief 为由粗到精的识别重新打开图像文件, 解码的大小由纸牌缩放后的高确定: 最小的纸牌解码后不低于card_height, JPEG图像仍按1/2, 1/4或1/8缩小
+@param file_path: 图像文件路径
+@param context: 压缩后的图像的预处理上下文, 由其中的纸牌布局估计纸牌在原图中的高
+@param card_height: 纸牌缩放后的高
+@return image_rgb: rgb图像数组, 没有找到纸牌时为完整的原图
+'''
+def load_roi_image (file_path, context, card_height = ROI_CARD_HEIGHT):
+    with Image.open(file_path) as image:  # 只读取文件头
+        width, height = image.size
+    layout = context.get_layout()
+    ratio = 1
+    if len(layout) > 0:
+        card_height_full = np.min(layout.cards["height"]) * width / context.img_rgb.shape[1]  # 纸牌在原图中的高
+        ratio = min(card_height / card_height_full, 1)
+    image = open_image(file_path, (math.ceil(width * ratio), math.ceil(height * ratio)))
+    _, _, image_rgb = get_image_data(image)
+    return image_rgb
+
+'''
+@brief 图像压缩, 压缩到800 * 600以内
+@param image: PIL的Image类对象
+@return image_resize: 压缩后的图像
+@return image_resize_gray: 压缩后的灰度图像, 由压缩后的图像转换得到
+'''
+def resize_image (image):
+    width, height = image.size
+    ratio = min(800 / width, 600 / height)
+    new_size = (int(width * ratio), int(height * ratio))
+    image_resize = image.resize(new_size, Image.Resampling.LANCZOS, reducing_gap = 3.0)  # 缩小倍数较大时先按整数倍快速缩小
+    image_resize_gray = image_resize.convert('L')
+    return image_resize, image_resize_gray
+
+'''
+@brief 读取并压缩图像(在工作线程中执行), 由粗到精的识别需要的原图在识别时由load_roi_image另行解码
+@param file_path: 图像文件路径
+@return image_resize: 压缩后的图像
+@return image_resize_gray: 压缩后的灰度图像
+'''
+def load_image (file_path):
+    # 打开图像, JPEG图像在解码时直接缩小到压缩后图像的1~2倍
+    image = run_stage(None, "open", open_image, file_path)
+
+    # 图像压缩
+    image_resize, image_resize_gray = run_stage(None, "resize", resize_image, image)
+    return image_resize, image_resize_gray
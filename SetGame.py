@@ -4,22 +4,11 @@ from tkinter import filedialog as fd
 from PIL import Image
 from PIL import ImageTk
 import numpy as np
-import math
-import os
-import cv2 as cv
-import ImgProc
-
-'''
-@brief 获取图像数组
-@param image: PIL的Image类对象
-@return height: 图像的高（行数）
-@return width: 图像的宽（列数）
-@return image_array: 图像对应的数组
-'''
-def get_image_data (image):
-    (width, height) = image.size  # 获取图像的宽和高
-    image_array = np.array(image)  # 获取图像的像素数据并转化为数组
-    return height, width, image_array
+import queue
+import threading
+import SetCache
+import SetCore
+import SetProfile
 
 '''
 @brief 显示转换后的图像
@@ -36,384 +25,282 @@ def show_trans_image (image_array):
     trans_image_label.config(image = trans_image_tk)
 
 '''
-@brief 获取纸牌位置和大小
-@param img_bin: 二值化后的含有纸牌的图像
-@return cards_info: 纸牌信息, 与图像中的纸牌一一对应, 元素的形式为[行数, 列数, 宽, 高]
+@brief 后台任务, 在工作线程中执行, 通过事件队列向界面报告进度和结果
 '''
-def get_cards_info (img_bin):
-    # 获取纸牌信息
-    contours, _ = cv.findContours(img_bin, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)  # 检测出连通域的边缘
-    cards_info_list = []  # 纸牌中心位置列表
-    for contour in contours:
-        rect = cv.minAreaRect(contour)
-
-        # 根据宽和高进行二次筛选
-        if rect[1][0] > 100 and rect[1][1] > 100:
-            # 整理成(row, column, w, h)的形式, 其中 w < h
-            if rect[1][0] < rect[1][1]:  # (w, h)的形式, 较短的数值被认为是w
-                card_info = (rect[0][1], rect[0][0], rect[1][0], rect[1][1])
-            else:
-                card_info = (rect[0][1], rect[0][0], rect[1][1], rect[1][0])
-            cards_info_list.append(card_info)
-            
-    # 得到纸牌位置数组, 并进行形状重塑和元素位置调整, 调整成能与图像中纸牌一一对应的形式
-    cards_info = np.array(cards_info_list)  # 转换为numpy数组
-    cards_info = cards_info.astype(int)
-    cards_info = cards_info.reshape(3, 4, 4)
-    cards_info = cards_info[::-1, :, :]
-    sort_index = np.argsort(cards_info[:, :, 1])  # 对每个坐标的列坐标进行排序, 得到排序后的元素在排序前数组中的索引
-    row_index = np.arange(cards_info.shape[0])[:, None]
-    cards_info = cards_info[row_index, sort_index, :]
-
-    return cards_info
+class Job:
+    '''
+    @param name: 任务名称, 同名的任务在执行或等待执行时, 重复提交会被合并
+    @param func: 任务函数
+    @param args: 任务函数的参数
+    @param stages: 预计依次经过的阶段名称, 用于计算进度
+    @param events: 事件队列
+    '''
+    def __init__ (self, name, func, args, stages, events):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.stages = stages
+        self.events = events
+        self.cancel_event = threading.Event()
+
+    '''
+    @brief 一个阶段开始, 报告进度(已完成的阶段的比例, 不在stages中的阶段为None), 任务已取消时抛出Cancelled
+    @param name: 阶段名称
+    '''
+    def enter_stage (self, name):
+        if self.cancel_event.is_set():
+            raise SetCore.Cancelled()
+        progress = self.stages.index(name) / len(self.stages) if name in self.stages else None
+        self.events.put(("stage", self, (name, progress)))
+
+    def cancel (self):
+        self.cancel_event.set()
+
+    def is_cancelled (self):
+        return self.cancel_event.is_set()
 
 '''
-@brief 获取纸牌的颜色
-@param img_rgb: rgb图像, 含有纸牌
-@param cards_info: 纸牌信息(位置和大小)
-@return color_matrix: 颜色矩阵, 与图像中的纸牌一一对应, 1: 红色, 2: 绿色, 3: 紫色
+@brief 后台工作线程: 依次执行提交的任务, 最多只有一个任务在等待, 界面通过轮询events获取进度和结果
+       事件的形式为(类型, 任务, 数据), 类型为"stage", "done", "cancelled"或"error"
 '''
-def get_color (img_rgb, cards_info):
-    color_matrix = np.zeros((3, 4), dtype = int)
-    cards_info_ = cards_info.reshape(-1, 4)
-
-    for card_info in cards_info_:
-        # 确定检测的区域, 加减10是为了防止取到纸牌之外的区域
-        center = (card_info[0], card_info[1])
-        up = center[0] - int(card_info[3] / 2) + 10
-        down = center[0] + int(card_info[3] / 2) - 10
-        analysis_array = img_rgb[up : down, center[1], :]
-
-        # 转换为hsv空间
-        analysis_array = np.expand_dims(analysis_array, axis = 1)
-        hsv_array = ImgProc.rgb_to_hsv(analysis_array)
-
-        # 颜色检测
-        index = np.where(np.all(cards_info == card_info, axis = -1))
-        for i in range(hsv_array.shape[0]):
-            # 获取hsv三个值
-            h = hsv_array[i, 0, 0]
-            s = hsv_array[i, 0, 1]
-            v = hsv_array[i, 0, 2]
-
-            # 判断颜色
-            is_red = ((h >= 0 and h <= 10) or (h >= 245 and h <= 255)) and s >= 50 and v >= 50
-            is_green = (h >= 64 and h <= 106) and s >= 50 and v >= 50
-            is_purple = (h >= 180 and h <= 230) and s >= 10 and (v >= 10 and v <= 200)
-
-            # 对颜色矩阵赋值
-            if is_red:
-                color_matrix[index] = 1
-                break
-            elif is_green:
-                color_matrix[index] = 2
-                break
-            elif is_purple:
-                color_matrix[index] = 3
-                break
-
-    # print("color:")
-    # print(color_matrix)
-    return color_matrix
+class BackgroundWorker:
+    def __init__ (self):
+        self.events = queue.Queue()  # 工作线程 -> 界面
+        self.condition = threading.Condition()
+        self.pending = None  # 等待执行的任务
+        self.running = None  # 正在执行的任务
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    '''
+    @brief 提交任务
+    @param name: 任务名称
+    @param func: 任务函数
+    @param stages: 预计依次经过的阶段名称
+    @param replace: True: 取消正在执行和等待执行的任务, False: 同名的任务正在执行或等待执行时忽略本次提交
+    @return job: 提交的任务, 被合并时为None
+    '''
+    def submit (self, name, func, *args, stages = (), replace = False):
+        with self.condition:
+            if replace:
+                self.cancel_locked()
+            else:
+                for job in (self.running, self.pending):
+                    if job is not None and job.name == name and not job.is_cancelled():
+                        return None
+            if self.pending is not None:  # 只保留最新提交的任务
+                self.pending.cancel()
+                self.events.put(("cancelled", self.pending, None))
+            self.pending = Job(name, func, args, stages, self.events)
+            self.condition.notify()
+            return self.pending
+
+    '''
+    @brief 取消正在执行和等待执行的任务, 正在执行的任务在下一个阶段开始前停止
+    '''
+    def cancel (self):
+        with self.condition:
+            self.cancel_locked()
+
+    def cancel_locked (self):
+        if self.running is not None:
+            self.running.cancel()
+        if self.pending is not None:
+            self.pending.cancel()
+            self.events.put(("cancelled", self.pending, None))
+            self.pending = None
+
+    def run (self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                job = self.pending
+                self.pending = None
+                self.running = job
+
+            SetCore.stage_listener.job = job
+            try:
+                result = job.func(*job.args)
+                event = ("cancelled", job, None) if job.is_cancelled() else ("done", job, result)
+            except SetCore.Cancelled:
+                event = ("cancelled", job, None)
+            except Exception as e:
+                event = ("error", job, e)
+            finally:
+                SetCore.stage_listener.job = None
+
+            with self.condition:
+                self.running = None
+            self.events.put(event)
+
+frame_context = None  # 当前打开的图像的预处理上下文
+result_cache = None  # 识别结果缓存, 第一次使用时打开
+worker = None  # 后台工作线程
+load_job = None  # 正在读取图像的任务, 界面处理完读取结果后为None
+search_after_load = False  # 图像还在读取时点击了“查找Set”, 读取完成后自动识别
 
 '''
-@brief 获取纸牌中的图形形状
-@param img_bin: 二值化后的含有纸牌的图像
-@param cards_info: 纸牌信息(位置和大小)
-@return appearance_matrix: 形状矩阵, 与图像中的纸牌一一对应, 1: 菱形, 2: 椭圆, 3: 波浪
+@brief 识别一幅图像, 开启缓存时先查找之前的识别结果(在工作线程中执行)
+@param file_path: 图像文件路径(由粗到精的识别重新解码原图)
+@param context: 压缩后的图像的预处理上下文
+@param roi: 是否使用由粗到精的识别
+@param cached: 是否使用识别结果缓存
+@return layout: 纸牌布局, 为压缩后的图像中的坐标
+@return all_set: 所有set的纸牌编号
+@return img_show: 标记出所有set的图像
 '''
-def get_appearance (img_bin, cards_info):
-    # 开运算, 消除条纹, 使得后续边缘检测不受条纹影响
-    img_bin = ImgProc.morphology_process(img_bin, method = "opening", dilation_se_size = 7, erosion_se_size = 9)
-
-    # 形状识别
-    cards_info_ = cards_info.reshape(-1, 4)
-    appearance_matrix = np.zeros((3, 4), dtype = int)
-    pos = 0
-    for card_info in cards_info_:
-        pos += 1
-        index = np.where(np.all(cards_info == card_info, axis = -1))
-
-        # 获取感兴趣区域, 加减10是为了防止取到纸牌之外的区域
-        row_min = card_info[0] - int(card_info[3] / 2) + 10
-        row_max = card_info[0] + int(card_info[3] / 2) - 10
-        column_min = card_info[1] - int(card_info[2] / 2) + 10
-        column_max = card_info[1] + int(card_info[2] / 2) - 10
-        roi = img_bin[row_min : row_max + 1, column_min : column_max + 1]
-        
-        # 对感兴趣区域进行处理, 便于进行连通域检测
-        roi = roi.astype(np.uint8)  # 转换为适合取反的类型
-        roi = ~roi  # 取反, 方便进行连通域检测
-        roi = ImgProc.morphology_process(roi, method = "opening", dilation_se_size = 3, erosion_se_size = 3)  # 开运算, 消去一些噪点
-        roi = roi.astype(np.uint8)  # 转换为uint8类型
-
-        # 直线检测, 通过检测到的直线数量, 进行第一次筛选
-        roi_edge = cv.Canny(roi, 180, 240)  # Canny边缘检测
-        lines = cv.HoughLinesP(roi_edge, rho = 1, theta = np.pi / 180, threshold = 30, minLineLength = 30, maxLineGap = 5)  # 霍夫变换检测直线
-        if lines is None:  # 获取直线数量
-            lines_num = 0
-        else:
-            lines_num = lines.shape[0]
-
-        if lines_num == 0:  # 如果检测到的直线的数量等于0, 说明图形形状为波浪
-            appearance_matrix[index] = 3
-            continue  # 如果已经确定是波浪, 就不用进行第二次筛选
-        
-        # 通过计算圆度来进行第二次筛选
-        contours, _ = cv.findContours(roi, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)  # 连通域检测, 得到连通域边缘
-        c_list = []  # 圆度列表
-        for i in range(len(contours)):
-            # print(len(contours[i]))
-            if len(contours[i]) > 50:  # 选取一条足够长的轮廓, 防止取到一些噪声导致的轮廓
-                cnt = contours[i]
-                area = cv.contourArea(cnt)  # 连通域面积
-                length = cv.arcLength(cnt, True)  # 连通域轮廓周长
-                c = (4 * np.pi * area) / (length ** 2)  # 圆度
-                c_list.append(c)  # 添加至列表最后
-
-        c_array = np.array(c_list)
-        c_mean = c_array.mean()  # 计算圆度平均值
-        if c_mean > 0.65:  # 如果圆度平均值较大, 则认为是椭圆
-            appearance_matrix[index] = 2
-        else:  # 如果圆度平均值较小, 则认为是菱形
-            appearance_matrix[index] = 1
-
-    # print("appearance:")
-    # print(appearance_matrix)
-    return appearance_matrix
-    
+def recognize_current (file_path, context, roi, cached):
+    global result_cache
+
+    if roi:
+        # 由粗到精: 按纸牌缩放后的高解码原图, 在其上识别, 再把纸牌位置换算到压缩后的图像中
+        image_rgb = SetCore.run_stage(None, "open", SetCore.load_roi_image, file_path, context)
+        images, params, func, args = [image_rgb], SetCore.get_cache_params("roi"), SetCore.recognize_roi, (image_rgb,)
+    else:
+        images, params, func, args = [context.img_rgb, context.img_gray], SetCore.get_cache_params("frame"), SetCore.recognize_frame, (context,)
+
+    if cached:
+        if result_cache is None:
+            result_cache = SetCache.ResultCache()
+        key = SetCore.run_stage(None, "cache_key", SetCache.image_key, images, params)
+        layout, all_set, _ = result_cache.get_or_compute(key, func, *args)
+    else:
+        layout, all_set = func(*args)
+
+    if roi:
+        layout = layout.scale(context.img_rgb.shape[1] / image_rgb.shape[1])
+    return layout, all_set, SetCore.draw_all_set(context.img_rgb, all_set, layout)
+
+def search_set ():
+    global search_after_load
+
+    if load_job is not None:  # 图像还在读取, 读取完成后再识别
+        search_after_load = True
+        return
+    if frame_context is None:  # 还没有打开图像
+        return
+
+    # 获取特征和所有set的位置, 重复点击时复用已经计算过的预处理结果, 识别过程中的重复点击被合并
+    stages = SetCore.ROI_STAGES if roi_mode.get() else SetCore.FRAME_STAGES
+    job = worker.submit("search", recognize_current, img_path, frame_context, roi_mode.get(), use_cache.get(), stages = stages)
+    if job is not None:
+        SetProfile.profiler.reset()
+        set_progress("识别", 0)
 
 '''
-@brief 获取纸牌中的图形的数量
-@param img_bin: 二值化后的含有纸牌的图像
-@param cards_info: 纸牌信息(位置和大小)
-@return number_matrix: 个数矩阵, 与图像中的纸牌一一对应
+@brief 取消正在进行的读取或识别
 '''
-def get_number (img_bin, cards_info):
-    # 开运算, 消除条纹, 使条纹变为实心, 此时有实心和空心两种纹路
-    img_bin = ImgProc.morphology_process(img_bin, method = "opening", dilation_se_size = 7, erosion_se_size = 9)
-
-    # 获取图形个数
-    number_matrix = np.zeros((3, 4), dtype = int)
-    cards_info_ = cards_info.reshape(-1, 4)
-    for card_info in cards_info_:
-        count = 0  # 记录数值变化的次数
-        first_to_second = 0  # 记录第一次变化到第二次变化的距离
-        center = (card_info[0], card_info[1])
-
-        # 从中心竖直向下遍历, 图形与纸牌边界有一定距离, 减10可以使得在遍历时, 不会遍历到纸牌外的区域
-        for i in range(center[0], (center[0] + int(card_info[3] / 2) - 10)):
-            if i != center[0]:
-                if img_bin[i, center[1]] != img_bin[i - 1, center[1]]:  # 数值变化, 次数加1
-                    count += 1
-                    
-                if count == 1:
-                    first_to_second += 1
-
-        # 判断个数
-        index = np.where(np.all(cards_info == card_info, axis = -1))
-        if count == 3 or count == 6:  # 次数为3（空心纹路）或6（实心纹路）
-            number_matrix[index] = 3
-        elif count == 4:  # 次数为4（实心纹路）
-            number_matrix[index] = 2
-        elif count == 1:  # 次数为1（空心纹路）
-            number_matrix[index] = 1
-        elif count == 2:  # 次数为2
-            if first_to_second > 10:  # 距离较长（实心纹路）
-                number_matrix[index] = 2
-            else:  # 距离较短（空心纹路）
-                number_matrix[index] = 1
-
-    # print("number:")
-    # print(number_matrix)
-    return number_matrix
-    
+def cancel_job ():
+    global search_after_load
+
+    search_after_load = False
+    worker.cancel()
+
 '''
-@brief 获取图形中的纹路
-@param img_bin: 二值化后的含有纸牌的图像
-@param cards_info: 纸牌信息(位置和大小)
-@param number: 图形的个数矩阵
-@return teture_matrix: 纹路矩阵, 与图像中的纸牌一一对应, 1: 空心, 2: 实心, 3: 条纹
+@brief 更新进度条和状态文字
+@param text: 状态文字
+@param progress: 进度(0~1), 为None时进度条不变
 '''
-def get_texture (img_bin, cards_info, number):
-    cards_info_ = cards_info.reshape(-1, 4)
-    near_size = 10
-    texture_matrix = np.zeros((3, 4), dtype = int)
-    for card_info in cards_info_:
-        center = (card_info[0], card_info[1])
-
-        index = np.where(np.all(cards_info == card_info, axis = -1))
-        if number[index] == 1 or number[index] == 3:
-            # 取以中心点为中心的一条直线
-            near_area = img_bin[center[0], center[1] - near_size : center[1] + near_size + 1]
-        elif number[index] == 2:
-            # 分别向上和向下取直线, 然后合并
-            near_area_1 = img_bin[center[0] + 20, center[1] - near_size : center[1] + near_size + 1]
-            near_area_2 = img_bin[center[0] - 20, center[1] - near_size : center[1] + near_size + 1]
-            near_area = np.concatenate((near_area_1, near_area_2))
-
-        var = np.var(near_area)  # 计算方差
-        if var > 0:  # 如果方差大于0, 图形内部像素有变化, 说明是条纹纹路
-            texture_matrix[index] = 3
-        else:  # 如果方差等于0
-            mean = np.mean(near_area)  # 求均值
-            if mean < 127:  # 如果均值较小, 说明图形内部偏向于黑色, 说明是实心纹路
-                texture_matrix[index] = 2
-            else:  # 如果均值较大, 说明图形内部偏向于白色, 说明是空心纹路
-                texture_matrix[index] = 1
-
-    # print("texture:")
-    # print(texture_matrix)
-    return texture_matrix
+def set_progress (text, progress = None):
+    status_label.config(text = text)
+    if progress is not None:
+        progress_bar.config(value = progress * 100)
 
 '''
-@brief 寻找全部set对应的三张纸牌的索引
-@param cards_feature: 纸牌特征, 即[个数, 纹路, 颜色, 形状]
-@return all_set_pos: 所有可以组成set的对应的三张纸牌的索引, 元素的形式为[[row1, column1], [row2, column2], [row3, column3]]
+@brief 处理工作线程的一个事件(在界面线程中执行)
+@param kind: 事件类型
+@param job: 事件所属的任务
+@param value: 事件数据
 '''
-def search_set_pos (cards_feature):
-    cards_feature_ = cards_feature.reshape(-1, 4)
-    set_key = np.zeros(4, dtype = int)  # 已有两张纸牌, 求第三张能够与这两张纸牌组成set的纸牌, 将其称为set_key
-    possible_value = np.array([1, 2, 3], dtype = int)  # 每一个特征可能的取值
-    set_pos_list = []  # 所有可以组成set的对应的三张纸牌的在图像中的位置的列表
-
-    # 任意选出两张纸牌, 求解可以组成set的第三张纸牌, 并分析是否存在于图像展示的纸牌中
-    for i in range(cards_feature_.shape[0] - 1):
-        card1 = cards_feature_[i]
-        for j in range(i + 1, cards_feature_.shape[0]):
-            card2 = cards_feature_[j]
-
-            # 求解第三张纸牌
-            for k in range(4):
-                if card1[k] == card2[k]:
-                    set_key[k] = card1[k]
-                else:
-                    set_key[k] = possible_value[(possible_value != card1[k]) & (possible_value != card2[k])][0]
-            
-            is_key_exist = np.any((cards_feature_ == set_key).all(axis = 1))
-
-            if is_key_exist:  # 如果存在, 说明存在一组set
-                # 获取纸牌在数组中的索引
-                index1 = np.where(np.all(cards_feature == card1, axis = -1))
-                index2 = np.where(np.all(cards_feature == card2, axis = -1))
-                index3 = np.where(np.all(cards_feature == set_key, axis = -1))
-                pos1 = np.array([index1[0][0], index1[1][0]], dtype = int)
-                pos2 = np.array([index2[0][0], index2[1][0]], dtype = int)
-                pos3 = np.array([index3[0][0], index3[1][0]], dtype = int)
-
-                # 判断得到的这一组set是不是新的一组set
-                is_new_set = True
-                if len(set_pos_list) != 0:
-                    for pos in set_pos_list:
-                        if (np.array_equal(pos1, pos[0]) and np.array_equal(pos2, pos[1]) and np.array_equal(pos3, pos[2])) or \
-                           (np.array_equal(pos1, pos[0]) and np.array_equal(pos2, pos[2]) and np.array_equal(pos3, pos[1])) or \
-                           (np.array_equal(pos1, pos[1]) and np.array_equal(pos2, pos[0]) and np.array_equal(pos3, pos[2])) or \
-                           (np.array_equal(pos1, pos[1]) and np.array_equal(pos2, pos[2]) and np.array_equal(pos3, pos[0])) or \
-                           (np.array_equal(pos1, pos[2]) and np.array_equal(pos2, pos[0]) and np.array_equal(pos3, pos[1])) or \
-                           (np.array_equal(pos1, pos[2]) and np.array_equal(pos2, pos[1]) and np.array_equal(pos3, pos[0])):
-                            
-                            is_new_set = False
-
-                # 得到新的一组set
-                if is_new_set:
-                    # 三个位置合并为一个数组, 并添加到列表
-                    set_pos = np.stack([pos1, pos2, pos3], axis = 0)
-                    set_pos_list.append(set_pos)
-    
-    all_set_pos = np.array(set_pos_list)  # 转换为数组
-    # print("all set pos:")
-    # print(all_set_pos)
-    return all_set_pos
+def handle_event (kind, job, value):
+    global load_job, search_after_load
+
+    title = "读取" if job.name == "load" else "识别"
+    if kind == "stage":
+        stage, progress = value
+        set_progress("%s: %s" % (title, stage), progress)
+        return
+
+    # 被新的读取取代的旧任务不再影响界面状态
+    if job.name == "load":
+        if job is not load_job:
+            return
+        load_job = None
+        if kind != "done":
+            search_after_load = False
+    if kind == "cancelled":
+        set_progress("%s已取消" % title, 0)
+    elif kind == "error":
+        set_progress("%s失败: %s" % (title, value), 0)
+    elif job.name == "load":
+        show_image(job.args[0], *value)
+        set_progress("读取完成", 1)
+        if search_after_load:
+            search_after_load = False
+            search_set()
+    else:
+        _, _, img_show = value
+        show_trans_image(img_show)
+        set_progress("识别完成", 1)
+
+        # 显示每个阶段的耗时
+        if SetProfile.profiler.enabled:
+            timing_label.config(text = "\n".join(SetProfile.profiler.format_last()))
 
 '''
-@brief 标记出所有set, 使用不同颜色的圆来标记
-@param all_set_pos: 所有可以组成set的对应的三张纸牌的索引
-@param cards_info: 纸牌信息(位置和大小)
+@brief 定时取出工作线程的全部事件, 间隔约为一帧(16毫秒), 界面不会被识别过程阻塞
 '''
-def show_all_set (all_set_pos, cards_info):
-    global img_rgb_resize
-    img_copy = img_rgb_resize.copy()  # 复制一份
-    rgb = np.random.randint(0, 256, (all_set_pos.shape[0], 3))  # 随机生成颜色
-
-    circle_r = 5  # 圆的半径
-    delta_row = 0
-    delta_column = 0
-    for i in range(all_set_pos.shape[0]):
-        # 获取纸牌中心位置和纸牌大小
-        pos = all_set_pos[i]
-        card_center1 = (cards_info[pos[0, 0], pos[0, 1], 0], cards_info[pos[0, 0], pos[0, 1], 1])
-        card_size1 = (cards_info[pos[0, 0], pos[0, 1], 2], cards_info[pos[0, 0], pos[0, 1], 3])
-        card_center2 = (cards_info[pos[1, 0], pos[1, 1], 0], cards_info[pos[1, 0], pos[1, 1], 1])
-        card_size2 = (cards_info[pos[1, 0], pos[1, 1], 2], cards_info[pos[1, 0], pos[1, 1], 3])
-        card_center3 = (cards_info[pos[2, 0], pos[2, 1], 0], cards_info[pos[2, 0], pos[2, 1], 1])
-        card_size3 = (cards_info[pos[2, 0], pos[2, 1], 2], cards_info[pos[2, 0], pos[2, 1], 3])
-
-        # 计算圆心
-        point1 = (card_center1[1] - int(card_size1[0] / 2) + 10 + delta_column, card_center1[0] - int(card_size1[1] / 2) + 10 + delta_row)
-        point2 = (card_center2[1] - int(card_size2[0] / 2) + 10 + delta_column, card_center2[0] - int(card_size2[1] / 2) + 10 + delta_row)
-        point3 = (card_center3[1] - int(card_size3[0] / 2) + 10 + delta_column, card_center3[0] - int(card_size3[1] / 2) + 10 + delta_row)
-
-        # 获取颜色
-        color = (int(rgb[i, 0]), int(rgb[i, 1]), int(rgb[i, 2]))
-
-        # 画圆标记
-        cv.circle(img_copy, point1, circle_r, color = color, thickness = 3)
-        cv.circle(img_copy, point2, circle_r, color = color, thickness = 3)
-        cv.circle(img_copy, point3, circle_r, color = color, thickness = 3)
-
-        # 标记位置改变
-        delta_column += 15
-        if card_center1[1] - int(card_size1[0] / 2) + 10 + delta_column > card_center1[1] + int(card_size1[0] / 2) - 10:
-            delta_column = 0
-            delta_row += 15
-
-    show_trans_image(img_copy)
-
-def search_set ():
-    global img_rgb_resize, img_gray_resize
+def poll_events ():
+    while True:
+        try:
+            kind, job, value = worker.events.get_nowait()
+        except queue.Empty:
+            break
+        handle_event(kind, job, value)
+    root.after(16, poll_events)
 
-    # 获取特征
-    img_bin = ImgProc.image_binarization(img_gray_resize, threshold = 180)  # 图像二值化
-    cards_info = get_cards_info(img_bin)  # 获取纸牌信息
-    number = get_number(img_bin, cards_info)  # 获取图形个数
-    texture = get_texture(img_bin, cards_info, number)  # 获取纹路
-    color = get_color(img_rgb_resize, cards_info)  # 获取颜色
-    appearance = get_appearance(img_bin, cards_info)  # 获取形状
-    cards_feature = np.stack([number, texture, color, appearance], axis = 2)  # 每一个元素的形式为[个数, 纹路, 颜色, 形状]
-
-    # 获取所有set的位置
-    all_set_pos = search_set_pos(cards_feature)
-
-    # 在图像中标出set
-    show_all_set(all_set_pos, cards_info)
+'''
+@brief 开启或关闭耗时显示
+'''
+def toggle_timing ():
+    if show_timing.get():
+        SetProfile.profiler.enable(trace_memory = False)
+    else:
+        SetProfile.profiler.disable()
+        timing_label.config(text = "")
 
 '''
-@brief 文件操作函数
+@brief 文件操作函数, 在后台读取图像, 正在进行的读取或识别会被取消
 '''
 def file_operation ():
-    global img_rgb, img_gray, img_rgb_resize, img_gray_resize, rgb_tk, gray_tk
+    global load_job
 
     # 获取文件路径
     file_path = fd.askopenfilename()
+    if not file_path:  # 取消了选择
+        return
 
-    # 判断文件格式并得到Image对象和图像数组
-    image = Image.open(file_path)
-    image_gray = image.convert('L')
+    load_job = worker.submit("load", SetCore.load_image, file_path, stages = SetCore.LOAD_STAGES, replace = True)
+    set_progress("读取", 0)
 
-    # 得到原始图像数据
-    _, _, img_rgb = get_image_data(image)
-    _, _, img_gray = get_image_data(image_gray)
+'''
+@brief 显示读取完成的图像, 并更换预处理上下文(在界面线程中执行)
+@param file_path: 图像文件路径
+@param image_resize: 压缩后的图像
+@param image_resize_gray: 压缩后的灰度图像
+'''
+def show_image (file_path, image_resize, image_resize_gray):
+    global img_path, img_rgb_resize, img_gray_resize, rgb_tk, gray_tk, frame_context
 
-    # 图像压缩
-    width, height = image_gray.size
-    ratio = min(800 / width, 600 / height)
-    new_size = (int(width * ratio), int(height * ratio))
-    image_resize = image.resize(new_size, Image.Resampling.LANCZOS)
-    image_resize_gray = image_gray.resize(new_size, Image.Resampling.LANCZOS)
+    img_path = file_path
     rgb_tk = ImageTk.PhotoImage(image_resize)
     gray_tk = ImageTk.PhotoImage(image_resize_gray)
-    _, _, img_rgb_resize = get_image_data(image_resize)
-    _, _, img_gray_resize = get_image_data(image_resize_gray)
+    _, _, img_rgb_resize = SetCore.get_image_data(image_resize)
+    _, _, img_gray_resize = SetCore.get_image_data(image_resize_gray)
+
+    # 新的图像使用新的预处理上下文, 工作线程中可能还有使用旧上下文的任务
+    frame_context = SetCore.FrameContext(img_rgb_resize, img_gray_resize)
 
     # 显示图像
     rgb_image_label.config(image = rgb_tk)
@@ -442,6 +329,9 @@ if __name__ == '__main__':
     canvas.config(yscrollcommand = scrollbar_1.set)
     canvas.config(xscrollcommand = scrollbar_2.set)
 
+    # 创建后台工作线程, 读取和识别都在其中执行
+    worker = BackgroundWorker()
+
     # 创建Frame容器，用于存放各种子容器
     frame = ttk.Frame(canvas, padding = 10)
     frame.grid(row = 0, column = 0)
@@ -464,6 +354,31 @@ if __name__ == '__main__':
     quit_button = ttk.Button(button_frame, text = "退出", command = root.destroy)
     quit_button.grid(row = 0, column = 2)
 
+    # 创建“显示耗时”复选框
+    show_timing = tk.BooleanVar(value = False)
+    timing_button = ttk.Checkbutton(button_frame, text = "显示耗时", variable = show_timing, command = toggle_timing)
+    timing_button.grid(row = 0, column = 3)
+
+    # 创建“由粗到精”复选框
+    roi_mode = tk.BooleanVar(value = False)
+    roi_button = ttk.Checkbutton(button_frame, text = "由粗到精", variable = roi_mode)
+    roi_button.grid(row = 0, column = 4)
+
+    # 创建“使用缓存”复选框
+    use_cache = tk.BooleanVar(value = True)
+    cache_button = ttk.Checkbutton(button_frame, text = "使用缓存", variable = use_cache)
+    cache_button.grid(row = 0, column = 5)
+
+    # 创建“取消”按键
+    cancel_button = ttk.Button(button_frame, text = "取消", command = cancel_job)
+    cancel_button.grid(row = 0, column = 6)
+
+    # 创建进度条和状态文字
+    progress_bar = ttk.Progressbar(button_frame, length = 200, maximum = 100)
+    progress_bar.grid(row = 0, column = 7, padx = 10)
+    status_label = ttk.Label(button_frame, width = 24)
+    status_label.grid(row = 0, column = 8, sticky = "w")
+
     # 创建图像标签
     rgb_image_label = ttk.Label(frame)
     rgb_image_label.grid(row = 1, column = 0)
@@ -471,5 +386,8 @@ if __name__ == '__main__':
     gray_image_label.grid(row = 2, column = 0)
     trans_image_label = ttk.Label(frame)
     trans_image_label.grid(row = 1, column = 1)
+    timing_label = ttk.Label(frame, justify = "left", font = ("Courier", 10))
+    timing_label.grid(row = 2, column = 1, sticky = "nw")
 
+    root.after(16, poll_events)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,267 @@
+import numpy as np
+
+# 每张纸牌的记录: 中心位置[行, 列], 宽和高, 所在的桌面, 在网格中的行和列, 四个特征打包后的编码, 识别的置信度
+CARD_DTYPE = np.dtype([("row", np.int32), ("column", np.int32), ("width", np.int32), ("height", np.int32), ("table", np.int16),
+                       ("grid_row", np.int16), ("grid_column", np.int16), ("code", np.uint8), ("confidence", np.float32)])
+
+TABLE_GAP = 1.5  # 两组纸牌之间的空白大于纸牌尺寸(宽或高的中位数)的此倍数时, 认为是不同的桌面
+
+'''
+@brief 把纸牌特征打包为一个字节, 每个特征占2位, 依次为个数, 纹路, 颜色, 形状(低位在前)
+@param cards_feature: 纸牌特征, 最后一维为[个数, 纹路, 颜色, 形状], 取值为0~3, 0表示未识别
+@return codes: uint8编码, 形状为cards_feature.shape[:-1]
+'''
+def pack_features (cards_feature):
+    cards_feature = np.asarray(cards_feature).astype(np.uint8) & 3
+    return cards_feature[..., 0] | (cards_feature[..., 1] << 2) | (cards_feature[..., 2] << 4) | (cards_feature[..., 3] << 6)
+
+'''
+@brief 把编码解包为纸牌特征
+@param codes: uint8编码
+@return cards_feature: 纸牌特征, 最后一维为[个数, 纹路, 颜色, 形状]
+'''
+def unpack_features (codes):
+    codes = np.asarray(codes, dtype = np.uint8)
+    return ((codes[..., None] >> np.array([0, 2, 4, 6], dtype = np.uint8)) & 3).astype(int)
+
+'''
+@brief 一维聚类: 排序后, 相邻两个值的间隔大于gap时分为不同的类
+@param values: 一维数组
+@param gap: 间隔阈值
+@return labels: 每个值所属的类, 按数值从小到大从0开始编号, values不能为空
+'''
+def cluster_1d (values, gap):
+    order = np.argsort(values, kind = "stable")
+    labels = np.empty(values.shape[0], dtype = int)
+    labels[order] = np.concatenate([[0], np.cumsum(np.diff(values[order]) > gap)])
+    return labels
+
+'''
+@brief 一维区间的切分: 按起点排序后, 起点与之前全部区间的最远终点的间隔大于gap时切开
+@param low: 区间起点
+@param high: 区间终点
+@param gap: 间隔阈值
+@return labels: 每个区间所属的组, 按位置从小到大从0开始编号, low不能为空
+'''
+def cut_intervals (low, high, gap):
+    order = np.argsort(low, kind = "stable")
+    reach = np.maximum.accumulate(high[order])
+    labels = np.empty(low.shape[0], dtype = int)
+    labels[order] = np.concatenate([[0], np.cumsum(low[order][1:] - reach[:-1] > gap)])
+    return labels
+
+'''
+@brief 根据纸牌的位置推断网格: 按中心的行坐标和列坐标分别聚类, 间隔阈值为纸牌高和宽的一半
+@param cards_info: 纸牌信息, 形状为(n, 4), 元素的形式为[行数, 列数, 宽, 高]
+@return grid_row: 每张纸牌所在的行
+@return grid_column: 每张纸牌所在的列
+'''
+def infer_grid (cards_info):
+    if cards_info.shape[0] == 0:
+        return np.zeros(0, dtype = int), np.zeros(0, dtype = int)
+    grid_row = cluster_1d(cards_info[:, 0], np.median(cards_info[:, 3]) / 2)
+    grid_column = cluster_1d(cards_info[:, 1], np.median(cards_info[:, 2]) / 2)
+
+    # 两张纸牌落在同一个格子中时(例如纸牌倾斜较大), 退化为按列坐标排列的一行
+    slots = grid_row * cards_info.shape[0] + grid_column
+    if np.unique(slots).shape[0] != slots.shape[0]:
+        grid_row = np.zeros(cards_info.shape[0], dtype = int)
+        grid_column = np.argsort(np.argsort(cards_info[:, 1], kind = "stable"), kind = "stable")
+    return grid_row, grid_column
+
+'''
+@brief 把纸牌分到不同的桌面, 并推断每张桌面的网格
+       交替按行和按列切分(XY-cut): 纸牌在某个方向上的投影之间存在较大的空白时切开, 直到每一组都不能再切分, 每一组为一张桌面
+       每张桌面单独推断网格, 左右相邻的桌面在总的网格中并排, 上下相邻的桌面上下排列, 不同桌面的纸牌不会落在同一个格子中
+@param cards_info: 纸牌信息, 形状为(n, 4), 元素的形式为[行数, 列数, 宽, 高]
+@param gap: 桌面之间空白的阈值, 为纸牌尺寸的倍数
+@return table: 每张纸牌所在的桌面, 与纸牌相同, 按从上到下, 从左到右的顺序编号
+@return grid_row: 每张纸牌在总的网格中所在的行
+@return grid_column: 每张纸牌在总的网格中所在的列
+'''
+def infer_tables (cards_info, gap = TABLE_GAP):
+    table = np.zeros(cards_info.shape[0], dtype = int)
+    grid_row = np.zeros(cards_info.shape[0], dtype = int)
+    grid_column = np.zeros(cards_info.shape[0], dtype = int)
+
+    # 递归切分index中的纸牌, 返回桌面数量和占用的网格大小, axis为优先切分的方向(0: 按行, 1: 按列)
+    def arrange (index, table_start, axis):
+        info = cards_info[index]
+        for cut_axis in (axis, 1 - axis):
+            size = info[:, 3 - cut_axis]  # 按列切分时为宽, 按行切分时为高
+            labels = cut_intervals(info[:, cut_axis] - size / 2, info[:, cut_axis] + size / 2, np.median(size) * gap)
+            if labels.max() > 0:
+                break
+        else:
+            table[index] = table_start
+            grid_row[index], grid_column[index] = infer_grid(info)
+            return 1, int(grid_row[index].max()) + 1, int(grid_column[index].max()) + 1
+
+        # 每一组纸牌递归切分, 在切分的方向上依次排列
+        order = np.argsort(labels, kind = "stable")
+        parts = np.split(index[order], np.flatnonzero(np.diff(labels[order])) + 1)
+        tables_num = 0
+        offset = 0
+        extent = 0
+        for part in parts:
+            part_tables, rows, columns = arrange(part, table_start + tables_num, 1 - cut_axis)
+            tables_num += part_tables
+            if cut_axis == 1:
+                grid_column[part] += offset
+                offset += columns
+                extent = max(extent, rows)
+            else:
+                grid_row[part] += offset
+                offset += rows
+                extent = max(extent, columns)
+        return (tables_num, extent, offset) if cut_axis == 1 else (tables_num, offset, extent)
+
+    if cards_info.shape[0] > 0:
+        arrange(np.arange(cards_info.shape[0]), 0, 0)
+    return table, grid_row, grid_column
+
+'''
+@brief 纸牌布局: 全部纸牌的信息保存在一个结构化数组中, 纸牌先按桌面, 再按网格中从上到下, 从左到右的顺序编号
+'''
+class Layout:
+    '''
+    @param cards_info: 纸牌信息, 形状为(n, 4), 元素的形式为[行数, 列数, 宽, 高], 顺序不限
+    '''
+    def __init__ (self, cards_info):
+        cards_info = np.asarray(cards_info, dtype = int).reshape(-1, 4)
+        table, grid_row, grid_column = infer_tables(cards_info)
+        order = np.lexsort((grid_column, grid_row, table))
+
+        self.cards = np.zeros(cards_info.shape[0], dtype = CARD_DTYPE)
+        for i, name in enumerate(["row", "column", "width", "height"]):
+            self.cards[name] = cards_info[order, i]
+        self.cards["table"] = table[order]
+        self.cards["grid_row"] = grid_row[order]
+        self.cards["grid_column"] = grid_column[order]
+        self.update_grid()
+
+    '''
+    @brief 根据每张纸牌所在的行和列, 重新生成网格到纸牌编号的索引
+    '''
+    def update_grid (self):
+        if self.cards.shape[0] == 0:
+            self.shape = (0, 0)
+            self.tables_num = 0
+        else:
+            self.shape = (int(self.cards["grid_row"].max()) + 1, int(self.cards["grid_column"].max()) + 1)
+            self.tables_num = int(self.cards["table"].max()) + 1
+        self.grid = np.full(self.shape, -1, dtype = int)  # 网格中没有纸牌的位置为-1
+        self.grid[self.cards["grid_row"], self.cards["grid_column"]] = np.arange(self.cards.shape[0])
+
+    def __len__ (self):
+        return self.cards.shape[0]
+
+    '''
+    @brief 获取一张纸牌的记录
+    @param card_id: 纸牌编号
+    @return card: 结构化数组中的一个元素
+    '''
+    def card (self, card_id):
+        return self.cards[card_id]
+
+    '''
+    @brief 获取一张纸牌的位置和大小
+    @param card_id: 纸牌编号
+    @return card_info: [行数, 列数, 宽, 高]
+    '''
+    def get_card_info (self, card_id):
+        card = self.cards[card_id]
+        return np.array([card["row"], card["column"], card["width"], card["height"]], dtype = int)
+
+    '''
+    @brief 全部纸牌的位置和大小, 形状为(n, 4)
+    '''
+    @property
+    def cards_info (self):
+        return np.stack([self.cards[name] for name in ["row", "column", "width", "height"]], axis = -1).astype(int)
+
+    '''
+    @brief 全部纸牌在网格中的位置, 形状为(n, 2), 元素的形式为[行, 列]
+    '''
+    @property
+    def positions (self):
+        return np.stack([self.cards["grid_row"], self.cards["grid_column"]], axis = -1).astype(int)
+
+    '''
+    @brief 全部纸牌的特征, 形状为(n, 4), 元素的形式为[个数, 纹路, 颜色, 形状]
+    '''
+    @property
+    def features (self):
+        return unpack_features(self.cards["code"])
+
+    '''
+    @brief 设置全部纸牌的特征
+    @param cards_feature: 纸牌特征, 形状为(n, 4)
+    @param confidence: 每张纸牌的置信度, 为None时取识别出的特征的比例
+    '''
+    def set_features (self, cards_feature, confidence = None):
+        cards_feature = np.asarray(cards_feature).reshape(-1, 4)
+        self.cards["code"] = pack_features(cards_feature)
+        if confidence is None:
+            confidence = np.mean((cards_feature >= 1) & (cards_feature <= 3), axis = -1)
+        self.cards["confidence"] = confidence
+
+    '''
+    @brief 设置一张纸牌的特征
+    @param card_id: 纸牌编号
+    @param card_feature: [个数, 纹路, 颜色, 形状]
+    @param confidence: 置信度, 为None时取识别出的特征的比例
+    '''
+    def set_card_feature (self, card_id, card_feature, confidence = None):
+        card_feature = np.asarray(card_feature)
+        self.cards["code"][card_id] = pack_features(card_feature)
+        if confidence is None:
+            confidence = np.mean((card_feature >= 1) & (card_feature <= 3))
+        self.cards["confidence"][card_id] = confidence
+
+    '''
+    @brief 把每张纸牌的数据按网格排列
+    @param values: 与纸牌编号一一对应的数组, 形状为(n, ...)
+    @param fill: 网格中没有纸牌的位置的填充值
+    @return grid_values: 形状为(行数, 列数, ...)
+    '''
+    def to_grid (self, values, fill = 0):
+        values = np.asarray(values)
+        grid_values = np.full(self.shape + values.shape[1:], fill, dtype = values.dtype)
+        grid_values[self.cards["grid_row"], self.cards["grid_column"]] = values
+        return grid_values
+
+    '''
+    @brief 每张桌面的纸牌编号范围, 同一张桌面的纸牌编号是连续的
+    @return ranges: 列表, 元素的形式为(起始编号, 结束编号), 不包括结束编号
+    '''
+    def table_ranges (self):
+        bounds = np.searchsorted(self.cards["table"], np.arange(self.tables_num + 1))
+        return [(int(bounds[i]), int(bounds[i + 1])) for i in range(self.tables_num)]
+
+    '''
+    @brief 把纸牌编号转换为网格中的位置
+    @param card_ids: 纸牌编号数组, 例如全部set的编号, 形状为(m, 3)
+    @return pos: 形状为card_ids.shape + (2,), 元素的形式为[行, 列]
+    '''
+    def get_pos (self, card_ids):
+        return self.positions[np.asarray(card_ids, dtype = int)]
+
+    '''
+    @brief 缩放后的布局, 网格和特征保持不变
+    @param ratio: 缩放比例
+    @return layout: 新的布局
+    '''
+    def scale (self, ratio):
+        layout = Layout.__new__(Layout)
+        layout.cards = self.cards.copy()
+        for name in ["row", "column", "width", "height"]:
+            layout.cards[name] = np.round(self.cards[name] * ratio)
+        layout.update_grid()
+        return layout
+
+    '''
+    @brief 布局的副本
+    '''
+    def copy (self):
+        return self.scale(1)
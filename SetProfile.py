@@ -0,0 +1,182 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+import numpy as np
+
+'''
+@brief 处理阶段的性能分析: 记录每个阶段的耗时, CPU时间和峰值内存分配, 默认关闭, 关闭时几乎没有额外开销
+'''
+class Profiler:
+    def __init__ (self):
+        self.enabled = False
+        self.trace_memory = False
+        self.lock = threading.Lock()
+        self.local = threading.local()  # 每个线程的阶段栈, 用于处理嵌套的阶段
+        self.events = []
+        self.origin = time.perf_counter()
+
+    '''
+    @brief 开始记录
+    @param trace_memory: 是否使用tracemalloc记录峰值内存分配(会明显变慢)
+    '''
+    def enable (self, trace_memory = True):
+        self.enabled = True
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    '''
+    @brief 停止记录, 已记录的数据保留
+    '''
+    def disable (self):
+        self.enabled = False
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.trace_memory = False
+
+    '''
+    @brief 清空已记录的数据
+    '''
+    def reset (self):
+        with self.lock:
+            self.events = []
+            self.origin = time.perf_counter()
+
+    '''
+    @brief 记录一个阶段, 用法: with profiler.stage("name"): ...
+    @param name: 阶段名称
+    '''
+    @contextlib.contextmanager
+    def stage (self, name):
+        if not self.enabled:
+            yield
+            return
+
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+
+        # 嵌套阶段会重置tracemalloc的峰值, 先把外层阶段到目前为止的峰值保存下来
+        trace_memory = self.trace_memory and tracemalloc.is_tracing()
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if len(stack) > 0:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+        else:
+            current = 0
+        frame = {"peak": 0}
+        stack.append(frame)
+
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.thread_time() - cpu_start
+            stack.pop()
+            peak_bytes = 0
+            if trace_memory:
+                peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                peak_bytes = max(peak - current, 0)
+                if len(stack) > 0:
+                    stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+
+            event = {"name": name, "start": start - self.origin, "wall": wall, "cpu": cpu,
+                     "peak_bytes": peak_bytes, "tid": threading.get_ident(), "depth": len(stack)}
+            with self.lock:
+                self.events.append(event)
+
+    '''
+    @brief 按阶段汇总, 给出耗时的分位数
+    @return summary: 阶段名称 -> 统计信息(时间单位为毫秒)
+    '''
+    def get_summary (self):
+        with self.lock:
+            events = list(self.events)
+
+        groups = {}
+        for event in events:
+            groups.setdefault(event["name"], []).append(event)
+
+        summary = {}
+        for name, group in groups.items():
+            wall = np.array([event["wall"] for event in group]) * 1000
+            cpu = np.array([event["cpu"] for event in group]) * 1000
+            summary[name] = {
+                "count": len(group),
+                "wall_total_ms": float(wall.sum()),
+                "wall_mean_ms": float(wall.mean()),
+                "wall_p50_ms": float(np.percentile(wall, 50)),
+                "wall_p90_ms": float(np.percentile(wall, 90)),
+                "wall_p99_ms": float(np.percentile(wall, 99)),
+                "wall_max_ms": float(wall.max()),
+                "cpu_mean_ms": float(cpu.mean()),
+                "cpu_p50_ms": float(np.percentile(cpu, 50)),
+                "cpu_p90_ms": float(np.percentile(cpu, 90)),
+                "peak_bytes_max": int(max(event["peak_bytes"] for event in group)),
+            }
+        return summary
+
+    '''
+    @brief 导出汇总结果为JSON文件
+    @param file_path: 文件路径
+    '''
+    def export_json (self, file_path):
+        with open(file_path, "w", encoding = "utf-8") as f:
+            json.dump(self.get_summary(), f, indent = 2, ensure_ascii = False)
+
+    '''
+    @brief 导出Chrome trace格式的文件, 可以在chrome://tracing或Perfetto中查看
+    @param file_path: 文件路径
+    '''
+    def export_chrome_trace (self, file_path):
+        with self.lock:
+            events = list(self.events)
+
+        trace_events = []
+        for event in events:
+            trace_events.append({"name": event["name"], "ph": "X", "pid": os.getpid(), "tid": event["tid"],
+                                 "ts": event["start"] * 1e6, "dur": event["wall"] * 1e6,
+                                 "args": {"cpu_ms": event["cpu"] * 1000, "peak_bytes": event["peak_bytes"]}})
+        with open(file_path, "w", encoding = "utf-8") as f:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+
+    '''
+    @brief 每个阶段最近一次的耗时, 用于界面显示
+    @return lines: 文字列表, 元素的形式为"阶段: 耗时 ms"
+    '''
+    def format_last (self):
+        with self.lock:
+            events = list(self.events)
+
+        last = {}
+        for event in events:
+            last[event["name"]] = event
+        return ["%s%s: %.1f ms" % ("  " * event["depth"], name, event["wall"] * 1000)
+                for name, event in sorted(last.items(), key = lambda item: item[1]["start"])]
+
+# 全局的性能分析器, 所有处理阶段都记录到这里
+profiler = Profiler()
+
+'''
+@brief 装饰器, 把函数作为一个阶段记录到全局的性能分析器
+@param name: 阶段名称, 默认为函数名
+'''
+def profiled (name = None):
+    def decorator (func):
+        stage_name = name if name is not None else func.__name__
+
+        @functools.wraps(func)
+        def wrapper (*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            with profiler.stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
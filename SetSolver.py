@@ -0,0 +1,162 @@
+import itertools
+import numpy as np
+import SetCore
+
+# 全部81张纸牌的特征, 第i行是编码为i的纸牌(编码见SetCore.get_cards_code), 元素的形式为[个数, 纹路, 颜色, 形状]
+DECK_FEATURES = np.array(list(itertools.product([1, 2, 3], repeat = 4)), dtype = int)
+
+'''
+@brief 生成全部set的查找表
+@return third_code: 形状为(81, 81), 任意两张不同的纸牌与第三张纸牌组成set, 值为第三张纸牌的编码
+@return all_sets: 全部1080个set, 形状为(1080, 3), 元素为纸牌编码, 每一行从小到大排列
+@return card_sets: 形状为(81, 40), 每张纸牌所在的40个set在all_sets中的序号
+'''
+def build_set_tables ():
+    digits = DECK_FEATURES - 1
+    third_code = ((-digits[:, None] - digits[None, :]) % 3) @ np.array([27, 9, 3, 1])
+    code1, code2 = np.triu_indices(81, k = 1)
+    code3 = third_code[code1, code2]
+    is_set = code3 > code2
+    all_sets = np.stack([code1[is_set], code2[is_set], code3[is_set]], axis = 1)
+    card_sets = np.argsort(np.stack([np.any(all_sets == code, axis = 1) for code in range(81)]), axis = 1, kind = "stable")[:, -40:]
+    return third_code, all_sets, np.sort(card_sets, axis = 1)
+
+THIRD_CODE, ALL_SETS, CARD_SETS = build_set_tables()
+
+'''
+@brief 增量的set求解器: 维护桌面上的纸牌和其中全部的set, 适合一局游戏中每次发3张牌, 取走set的过程
+       每张纸牌只属于40个set, 增加或移除一张纸牌只需检查这40个set, 与桌面上的纸牌数量无关
+'''
+class IncrementalSolver:
+    '''
+    @param cards_feature: 初始的纸牌特征, 形状为(n, 4), 为None时桌面为空
+    '''
+    def __init__ (self, cards_feature = None):
+        self.present = np.zeros(81, dtype = bool)  # 每个编码的纸牌是否在桌面上
+        self.active = np.zeros(ALL_SETS.shape[0], dtype = bool)  # 每个set的三张纸牌是否都在桌面上
+        self.set_count = 0
+        if cards_feature is not None:
+            self.add(cards_feature)
+
+    '''
+    @brief 把纸牌特征转换为编码, 并检查纸牌是否有效
+    @param cards_feature: 纸牌特征, 形状为(k, 4)
+    @return codes: 纸牌编码, 形状为(k,)
+    '''
+    @staticmethod
+    def encode (cards_feature):
+        codes = SetCore.get_cards_code(np.asarray(cards_feature).reshape(-1, 4))
+        if np.any(codes < 0):
+            raise ValueError("cards with unrecognized features: %s" % np.asarray(cards_feature).reshape(-1, 4)[codes < 0].tolist())
+        if np.unique(codes).shape[0] != codes.shape[0]:
+            raise ValueError("duplicate cards")
+        return codes
+
+    '''
+    @brief 发牌: 增加纸牌, 同时加入新出现的set
+    @param cards_feature: 纸牌特征, 形状为(k, 4), 不能与桌面上的纸牌重复
+    '''
+    def add (self, cards_feature):
+        self.add_codes(self.encode(cards_feature))
+
+    '''
+    @brief 取走纸牌, 同时去除包含这些纸牌的set
+    @param cards_feature: 纸牌特征, 形状为(k, 4), 必须都在桌面上
+    '''
+    def remove (self, cards_feature):
+        self.remove_codes(self.encode(cards_feature))
+
+    '''
+    @brief 按编码增加纸牌
+    @param codes: 纸牌编码, 取值为0~80
+    '''
+    def add_codes (self, codes):
+        codes = np.asarray(codes, dtype = int).reshape(-1)
+        if np.any(self.present[codes]):
+            raise ValueError("cards already on the table: %s" % codes[self.present[codes]].tolist())
+        for code in codes:
+            # 包含这张纸牌的set中, 另外两张都已经在桌面上的成为新的set
+            set_index = CARD_SETS[code]
+            is_new = self.present[ALL_SETS[set_index]].sum(axis = 1) == 2
+            self.active[set_index[is_new]] = True
+            self.set_count += int(is_new.sum())
+            self.present[code] = True
+
+    '''
+    @brief 按编码取走纸牌
+    @param codes: 纸牌编码, 取值为0~80
+    '''
+    def remove_codes (self, codes):
+        codes = np.asarray(codes, dtype = int).reshape(-1)
+        if not np.all(self.present[codes]):
+            raise ValueError("cards not on the table: %s" % codes[~self.present[codes]].tolist())
+        for code in codes:
+            set_index = CARD_SETS[code]
+            self.set_count -= int(self.active[set_index].sum())
+            self.active[set_index] = False
+            self.present[code] = False
+
+    '''
+    @brief 桌面上是否存在set, O(1)
+    '''
+    def has_set (self):
+        return self.set_count > 0
+
+    def __len__ (self):
+        return int(self.present.sum())
+
+    '''
+    @brief 桌面上全部纸牌的编码, 从小到大排列
+    '''
+    def codes (self):
+        return np.flatnonzero(self.present)
+
+    '''
+    @brief 桌面上全部的set
+    @return all_sets: 形状为(set数量, 3), 元素为纸牌编码, 按编码排序
+    '''
+    def sets (self):
+        return ALL_SETS[self.active]
+
+    '''
+    @brief 桌面上全部的set, 以纸牌特征表示
+    @return sets_feature: 形状为(set数量, 3, 4)
+    '''
+    def sets_feature (self):
+        return DECK_FEATURES[self.sets()]
+
+    '''
+    @brief 桌面上的任意一个set, 用于模拟游戏时取走
+    @return codes: 三张纸牌的编码, 没有set时为None
+    '''
+    def first_set (self):
+        if self.set_count == 0:
+            return None
+        return ALL_SETS[np.argmax(self.active)]
+
+'''
+@brief 模拟一局游戏: 桌面上保持12张纸牌, 没有set时再发3张, 每次取走一个set, 直到牌堆发完且桌面上没有set
+@param rng: numpy随机数生成器
+@param solver: 求解器, 为None时新建一个
+@param table_size: 桌面上正常保持的纸牌数量
+@return stats: 取走的set数量, 发牌次数, 桌面上纸牌数量的最大值, 结束时剩余的纸牌数量
+'''
+def play_game (rng, solver = None, table_size = 12):
+    if solver is None:
+        solver = IncrementalSolver()
+    deck = list(rng.permutation(81))
+    claimed = 0
+    deals = 0
+    max_cards = 0
+    while True:
+        # 发牌: 不足table_size张或没有set时每次发3张
+        while len(deck) > 0 and (len(solver) < table_size or not solver.has_set()):
+            solver.add_codes(deck[:3])
+            deck = deck[3:]
+            deals += 1
+        max_cards = max(max_cards, len(solver))
+        if not solver.has_set():
+            break
+        solver.remove_codes(solver.first_set())
+        claimed += 1
+    return {"claimed": claimed, "deals": deals, "max_cards": max_cards, "remaining": len(solver)}
@@ -0,0 +1,404 @@
+import argparse
+import collections
+import queue
+import sys
+import threading
+import time
+import tracemalloc
+import numpy as np
+import cv2 as cv
+import ImgProc
+import SetCore
+
+'''
+@brief 把帧放入有界队列, 队列已满时丢弃最旧的帧, 保证处理的总是最新的帧
+@param frame_queue: 有界队列
+@param item: 放入的元素
+@return dropped: 是否丢弃了旧的帧
+'''
+def put_latest (frame_queue, item):
+    dropped = False
+    while True:
+        try:
+            frame_queue.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                frame_queue.get_nowait()
+                dropped = True
+            except queue.Empty:
+                pass
+
+'''
+@brief 把摄像头或视频中的一帧压缩到800 * 600以内, 并转换为rgb图像和灰度图像
+@param frame_bgr: OpenCV读取的bgr图像
+@param pool: 缓冲区池, 结果写入池中的数组, 为None时分配新的数组
+@return img_rgb: 压缩后的rgb图像
+@return img_gray: 压缩后的灰度图像
+'''
+def prepare_frame (frame_bgr, pool = None):
+    height, width = frame_bgr.shape[:2]
+    ratio = min(800 / width, 600 / height)
+    if ratio < 1:
+        size = (int(width * ratio), int(height * ratio))
+        frame_bgr = cv.resize(frame_bgr, size, dst = ImgProc.get_buffer(pool, "frame_bgr", (size[1], size[0], 3), np.uint8), interpolation = cv.INTER_AREA)
+    img_rgb = cv.cvtColor(frame_bgr, cv.COLOR_BGR2RGB, dst = ImgProc.get_buffer(pool, "frame_rgb", frame_bgr.shape, np.uint8))
+    img_gray = cv.cvtColor(frame_bgr, cv.COLOR_BGR2GRAY, dst = ImgProc.get_buffer(pool, "frame_gray", frame_bgr.shape[:2], np.uint8))
+    return img_rgb, img_gray
+
+'''
+@brief 计算两组纸牌区域之间的交并比
+@param cards_info_1: 纸牌信息, 形状为(n, 4)
+@param cards_info_2: 纸牌信息, 形状为(m, 4)
+@return iou: 形状为(n, m)的交并比矩阵
+'''
+def get_cards_iou (cards_info_1, cards_info_2):
+    def get_box (cards_info):
+        half = cards_info[:, [3, 2]] / 2  # 竖直方向为高, 水平方向为宽
+        return np.concatenate([cards_info[:, 0:2] - half, cards_info[:, 0:2] + half], axis = 1)
+
+    box_1 = get_box(cards_info_1.astype(float))[:, None, :]
+    box_2 = get_box(cards_info_2.astype(float))[None, :, :]
+    size = np.clip(np.minimum(box_1[..., 2:], box_2[..., 2:]) - np.maximum(box_1[..., :2], box_2[..., :2]), 0, None)
+    inter = size[..., 0] * size[..., 1]
+    area_1 = (box_1[..., 2] - box_1[..., 0]) * (box_1[..., 3] - box_1[..., 1])
+    area_2 = (box_2[..., 2] - box_2[..., 0]) * (box_2[..., 3] - box_2[..., 1])
+    return inter / np.maximum(area_1 + area_2 - inter, 1e-9)
+
+'''
+@brief 纸牌跟踪: 在连续的帧之间匹配纸牌, 只重新识别内容发生变化的纸牌
+'''
+class CardTracker:
+    '''
+    @param iou_threshold: 纸牌与上一帧中的纸牌的交并比大于该值时认为是同一张纸牌
+    @param pixel_threshold: 缩略图中像素的差值大于该值时认为该像素发生变化
+    @param change_threshold: 缩略图中发生变化的像素比例大于该值时重新识别
+    @param thumb_size: 纸牌区域缩略图的大小(宽, 高)
+    '''
+    def __init__ (self, iou_threshold = 0.8, pixel_threshold = 40, change_threshold = 0.01, thumb_size = (48, 64)):
+        self.iou_threshold = iou_threshold
+        self.pixel_threshold = pixel_threshold
+        self.change_threshold = change_threshold
+        self.thumb_size = thumb_size
+        self.full_passes = 0  # 完整识别的次数
+        self.reclassified = 0  # 重新识别的纸牌数量
+        self.reused = 0  # 复用识别结果的纸牌数量
+        self.reset()
+
+    '''
+    @brief 清空跟踪状态, 下一帧进行完整识别
+    '''
+    def reset (self):
+        self.layout = None
+        self.thumbs = None
+        self.all_set = None
+
+    '''
+    @brief 纸牌区域的彩色缩略图, 用于判断纸牌内容是否变化(颜色变化在灰度图像中可能不明显)
+    '''
+    def get_thumb (self, img_rgb, card_info):
+        roi = SetCore.get_card_roi(img_rgb, card_info)
+        return cv.resize(roi, self.thumb_size, interpolation = cv.INTER_AREA).astype(np.int16)
+
+    '''
+    @brief 判断纸牌内容是否变化: 统计差值较大的像素的比例, 对噪声不敏感
+    '''
+    def is_changed (self, thumb_1, thumb_2):
+        diff = np.max(np.abs(thumb_1 - thumb_2), axis = -1)
+        return np.mean(diff > self.pixel_threshold) > self.change_threshold
+
+    '''
+    @brief 识别一帧, 尽量复用上一帧的结果
+    @param context: 预处理上下文(SetCore.FrameContext)
+    @return layout: 纸牌布局, 包括每张纸牌的位置, 大小和特征
+    @return all_set: 所有可以组成set的三张纸牌的编号
+    '''
+    def update (self, context):
+        layout = context.get_layout().copy()  # 二值化和轮廓检测的代价很小, 每帧都进行
+        cards_info = layout.cards_info
+        thumbs = [self.get_thumb(context.img_rgb, card_info) for card_info in cards_info]
+
+        # 与上一帧的纸牌一一匹配, 匹配失败时进行完整识别
+        match = None
+        if self.layout is not None and len(self.layout) == len(layout) and len(layout) > 0:
+            iou = get_cards_iou(cards_info, self.layout.cards_info)
+            match = np.argmax(iou, axis = 1)
+            if np.any(iou[np.arange(match.shape[0]), match] < self.iou_threshold) or np.unique(match).shape[0] != match.shape[0]:
+                match = None
+
+        if match is None:
+            layout, all_set = SetCore.recognize_frame(context)
+            self.full_passes += 1
+        else:
+            # 只重新识别内容发生变化的纸牌, 与完整识别相同, 纸牌较小时缩放到统一的高度后识别
+            old_feature = self.layout.features
+            cards_feature = old_feature[match]
+            confidence = self.layout.cards["confidence"][match]
+            changed = np.array([self.is_changed(thumbs[card_id], self.thumbs[match[card_id]]) for card_id in range(len(layout))])
+            for card_id in np.flatnonzero(~changed):
+                thumbs[card_id] = self.thumbs[match[card_id]]  # 保留识别时的缩略图, 防止缓慢变化的累积
+            if np.any(changed):
+                cards_feature[changed], confidence[changed] = SetCore.get_cards_feature(context, layout, np.flatnonzero(changed))
+            self.reclassified += int(changed.sum())
+            self.reused += int((~changed).sum())
+            layout.set_features(cards_feature, confidence)
+
+            # 特征不变时不需要重新寻找set
+            if np.array_equal(cards_feature, old_feature):
+                all_set = self.all_set
+            else:
+                all_set = SetCore.search_layout_set(cards_feature, layout)
+
+        self.layout = layout
+        self.thumbs = thumbs
+        self.all_set = all_set
+        return layout, all_set
+
+'''
+@brief 实时识别: 采集线程和识别线程通过有界队列连接, 只处理最新的帧
+'''
+class StreamRecognizer:
+    '''
+    @param source: 摄像头编号或视频文件路径
+    @param realtime: 读取视频文件时是否按照视频帧率采集, 模拟摄像头
+    @param loop: 视频文件读完后是否从头开始
+    @param queue_size: 帧队列的长度
+    @param track: 是否在帧之间跟踪纸牌, 复用未变化的纸牌的识别结果
+    @param pool: 是否使用缓冲区池, 在帧之间重复使用中间图像的内存
+    @param trace_memory: 是否使用tracemalloc统计每一帧的峰值内存分配(会变慢)
+    '''
+    def __init__ (self, source, realtime = True, loop = False, queue_size = 1, track = True, pool = True, trace_memory = False):
+        self.source = source
+        self.tracker = CardTracker() if track else None
+        self.pool = ImgProc.BufferPool() if pool else None
+        self.trace_memory = trace_memory
+        self.realtime = realtime
+        self.loop = loop
+        self.frame_queue = queue.Queue(maxsize = queue_size)  # 采集线程 -> 识别线程
+        self.result_queue = queue.Queue(maxsize = 1)  # 识别线程 -> 界面, 只保留最新的结果
+        self.stop_event = threading.Event()
+        self.threads = []
+
+        # 统计信息
+        self.lock = threading.Lock()
+        self.captured = 0
+        self.dropped = 0
+        self.processed = 0
+        self.failed = 0
+        self.done_times = collections.deque(maxlen = 30)  # 最近完成识别的时刻, 用于计算帧率
+        self.latencies = collections.deque(maxlen = 30)  # 最近的端到端延迟(秒)
+        self.peaks = collections.deque(maxlen = 30)  # 最近每一帧识别过程中的峰值内存分配(字节)
+
+    '''
+    @brief 启动采集线程和识别线程
+    '''
+    def start (self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.capture = cv.VideoCapture(self.source)
+        if not self.capture.isOpened():
+            raise IOError("cannot open video source: %s" % (self.source,))
+        self.threads = [threading.Thread(target = self.capture_loop, daemon = True),
+                        threading.Thread(target = self.recognize_loop, daemon = True)]
+        for thread in self.threads:
+            thread.start()
+
+    '''
+    @brief 停止全部线程并释放摄像头
+    '''
+    def stop (self):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self.capture.release()
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    '''
+    @brief 是否仍在运行(视频文件读完后自动结束)
+    '''
+    def is_running (self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    '''
+    @brief 采集线程
+    '''
+    def capture_loop (self):
+        fps = self.capture.get(cv.CAP_PROP_FPS)
+        interval = 1 / fps if (self.realtime and isinstance(self.source, str) and fps > 0) else 0
+        next_time = time.perf_counter()
+        while not self.stop_event.is_set():
+            ok, frame_bgr = self.capture.read()
+            if not ok:
+                if self.loop and isinstance(self.source, str):
+                    self.capture.set(cv.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                break
+
+            # 读取视频文件时按帧率等待
+            if interval > 0:
+                next_time += interval
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            dropped = put_latest(self.frame_queue, (time.perf_counter(), frame_bgr))
+            with self.lock:
+                self.captured += 1
+                self.dropped += int(dropped)
+
+        put_latest(self.frame_queue, None)  # 通知识别线程结束
+
+    '''
+    @brief 识别线程
+    '''
+    def recognize_loop (self):
+        context = None
+        while not self.stop_event.is_set():
+            try:
+                item = self.frame_queue.get(timeout = 0.1)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            capture_time, frame_bgr = item
+            if self.trace_memory:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+
+            # 识别并标记set, 识别失败时显示原图
+            img_rgb, img_gray = prepare_frame(frame_bgr, self.pool)
+            if context is None:
+                context = SetCore.FrameContext(img_rgb, img_gray, self.pool)
+            else:
+                context.set_image(img_rgb, img_gray)
+            try:
+                if self.tracker is not None:
+                    layout, all_set = self.tracker.update(context)
+                else:
+                    layout, all_set = SetCore.recognize_frame(context)
+                img_show = SetCore.draw_all_set(img_rgb, all_set, layout)
+                ok = True
+            except Exception:
+                if self.tracker is not None:
+                    self.tracker.reset()
+                layout = None
+                all_set = None
+                img_show = img_rgb.copy()  # 缓冲区会被下一帧覆盖
+                ok = False
+
+            done_time = time.perf_counter()
+            with self.lock:
+                self.processed += 1
+                self.failed += int(not ok)
+                self.done_times.append(done_time)
+                self.latencies.append(done_time - capture_time)
+                if self.trace_memory:
+                    self.peaks.append(tracemalloc.get_traced_memory()[1] - base)
+            put_latest(self.result_queue, (img_show, layout, all_set))
+
+    '''
+    @brief 获取统计信息
+    @return stats: 包括帧率, 平均延迟(毫秒), 采集, 丢弃, 识别和识别失败的帧数,
+                   每帧峰值内存分配的平均值(KB, 开启trace_memory时), 缓冲区池的大小(KB)和分配次数
+    '''
+    def get_stats (self):
+        with self.lock:
+            if len(self.done_times) > 1:
+                fps = (len(self.done_times) - 1) / (self.done_times[-1] - self.done_times[0])
+            else:
+                fps = 0.0
+            latency = np.mean(self.latencies) * 1000 if len(self.latencies) > 0 else 0.0
+            peak = np.mean(self.peaks) / 1024 if len(self.peaks) > 0 else 0.0
+            return {"fps": fps, "latency_ms": latency, "captured": self.captured, "dropped": self.dropped,
+                    "processed": self.processed, "failed": self.failed, "peak_kb": peak,
+                    "pool_kb": self.pool.nbytes() / 1024 if self.pool is not None else 0.0,
+                    "pool_allocations": self.pool.allocations if self.pool is not None else 0}
+
+'''
+@brief 在Tk窗口中显示实时识别结果
+@param recognizer: StreamRecognizer对象
+'''
+def run_gui (recognizer):
+    import tkinter as tk
+    from tkinter import ttk
+    from PIL import Image
+    from PIL import ImageTk
+
+    root = tk.Tk()
+    root.title("Set Game - Live")
+    image_label = ttk.Label(root)
+    image_label.grid(row = 0, column = 0)
+    status_label = ttk.Label(root)
+    status_label.grid(row = 1, column = 0, sticky = "w")
+
+    def close ():
+        recognizer.stop()
+        root.destroy()
+
+    # 轮询识别结果, 不阻塞界面
+    def poll ():
+        try:
+            img_show, _, _ = recognizer.result_queue.get_nowait()
+        except queue.Empty:
+            pass
+        else:
+            image_label.image = ImageTk.PhotoImage(Image.fromarray(img_show))  # 保存引用, 防止被回收
+            image_label.config(image = image_label.image)
+
+        stats = recognizer.get_stats()
+        status_label.config(text = "FPS: %.1f    延迟: %.0f ms    丢弃: %d/%d    识别失败: %d" %
+                            (stats["fps"], stats["latency_ms"], stats["dropped"], stats["captured"], stats["failed"]))
+        root.after(10, poll)
+
+    root.protocol("WM_DELETE_WINDOW", close)
+    recognizer.start()
+    root.after(10, poll)
+    root.mainloop()
+
+'''
+@brief 无界面运行, 处理指定数量的帧后输出统计信息
+@param recognizer: StreamRecognizer对象
+@param frames: 处理的帧数, 为0时运行到视频结束
+@return stats: 统计信息
+'''
+def run_headless (recognizer, frames = 0):
+    recognizer.start()
+    try:
+        while recognizer.is_running():
+            if frames > 0 and recognizer.get_stats()["processed"] >= frames:
+                break
+            time.sleep(0.05)
+    finally:
+        recognizer.stop()
+    return recognizer.get_stats()
+
+def main (argv = None):
+    parser = argparse.ArgumentParser(description = "Set Game 实时识别")
+    parser.add_argument("source", nargs = "?", default = "0", help = "摄像头编号或视频文件路径, 默认为0号摄像头")
+    parser.add_argument("--headless", action = "store_true", help = "不显示窗口, 只输出帧率和延迟")
+    parser.add_argument("--frames", type = int, default = 0, help = "无界面运行时处理的帧数, 0表示运行到视频结束")
+    parser.add_argument("--no-realtime", action = "store_true", help = "读取视频文件时不按帧率等待, 尽快读取")
+    parser.add_argument("--loop", action = "store_true", help = "视频文件读完后从头开始")
+    parser.add_argument("--no-track", action = "store_true", help = "不跟踪纸牌, 每一帧都完整识别")
+    parser.add_argument("--no-pool", action = "store_true", help = "不使用缓冲区池, 每一帧重新分配中间图像")
+    parser.add_argument("--memory", action = "store_true", help = "统计每一帧的峰值内存分配(会变慢)")
+    args = parser.parse_args(argv)
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    recognizer = StreamRecognizer(source, realtime = not args.no_realtime, loop = args.loop, track = not args.no_track,
+                                  pool = not args.no_pool, trace_memory = args.memory)
+    if args.headless:
+        stats = run_headless(recognizer, args.frames)
+        print("fps: %.1f, latency: %.1f ms, captured: %d, dropped: %d, processed: %d, failed: %d" %
+              (stats["fps"], stats["latency_ms"], stats["captured"], stats["dropped"], stats["processed"], stats["failed"]))
+        if args.memory:
+            print("peak memory per frame: %.0f KB, buffer pool: %.0f KB in %d allocations" %
+                  (stats["peak_kb"], stats["pool_kb"], stats["pool_allocations"]))
+    else:
+        run_gui(recognizer)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+import itertools
+import numpy as np
+import cv2 as cv
+
+# 全部81张纸牌, 元素的形式为[个数, 纹路, 颜色, 形状]
+# 纹路 1: 空心, 2: 实心, 3: 条纹; 颜色 1: 红色, 2: 绿色, 3: 紫色; 形状 1: 菱形, 2: 椭圆, 3: 波浪
+DECK = np.array(list(itertools.product([1, 2, 3], repeat = 4)), dtype = int)
+
+CARD_COLORS = {1: (215, 30, 45), 2: (20, 150, 60), 3: (95, 35, 135)}  # rgb
+TABLE_COLOR = (35, 70, 45)  # 桌面颜色, 灰度值低于二值化阈值
+CARD_SIZE = (230, 330)  # 纸牌的宽和高(像素), 渲染后再整体缩放到目标分辨率
+
+'''
+@brief 生成一个图形的轮廓点
+@param appearance: 1: 菱形, 2: 椭圆(两端为半圆的长条), 3: 波浪
+@param cx: 中心的列坐标
+@param cy: 中心的行坐标
+@param w: 图形的宽
+@param h: 图形的高
+@return points: 轮廓点, 形状为(n, 2), 元素的形式为(x, y)
+'''
+def shape_points (appearance, cx, cy, w, h):
+    if appearance == 1:
+        points = [[cx, cy - h / 2], [cx + w / 2, cy], [cx, cy + h / 2], [cx - w / 2, cy]]
+    elif appearance == 2:
+        r = h / 2
+        t = np.linspace(-np.pi / 2, np.pi / 2, 40)
+        right = np.stack([cx + w / 2 - r + r * np.cos(t), cy + r * np.sin(t)], axis = 1)
+        left = np.stack([cx - w / 2 + r - r * np.cos(t), cy - r * np.sin(t)], axis = 1)
+        points = np.concatenate([right, left])
+    else:
+        # 中心线为正弦曲线, 两端逐渐变细的弯曲长条
+        x = np.linspace(-w / 2, w / 2, 60)
+        center = 0.22 * h * np.sin(2 * np.pi * x / w)
+        half = 0.38 * h * np.sqrt(np.clip(1 - (2 * x / w) ** 2, 0, None)) ** 0.5
+        top = np.stack([cx + x, cy + center - half], axis = 1)
+        bottom = np.stack([cx + x, cy + center + half], axis = 1)[::-1]
+        points = np.concatenate([top, bottom])
+    return np.round(np.array(points)).astype(np.int32)
+
+'''
+@brief 渲染一张纸牌
+@param card_feature: [个数, 纹路, 颜色, 形状]
+@return card: rgb图像, 大小为CARD_SIZE
+'''
+def render_card (card_feature):
+    number, texture, color, appearance = [int(value) for value in card_feature]
+    card_w, card_h = CARD_SIZE
+    card = np.full((card_h, card_w, 3), 255, dtype = np.uint8)
+    rgb = CARD_COLORS[color]
+
+    shape_w, shape_h, gap = 150, 62, 88
+    for i in range(number):
+        cy = card_h / 2 + (i - (number - 1) / 2) * gap
+        points = shape_points(appearance, card_w / 2, cy, shape_w, shape_h)
+        if texture == 2:
+            cv.fillPoly(card, [points], rgb)
+        elif texture == 3:
+            # 竖直条纹
+            mask = np.zeros((card_h, card_w), dtype = np.uint8)
+            cv.fillPoly(mask, [points], 1)
+            mask[:, np.arange(card_w) % 7 >= 2] = 0
+            card[mask > 0] = rgb
+        cv.polylines(card, [points], True, rgb, thickness = 5, lineType = cv.LINE_AA)
+    return card
+
+'''
+@brief 渲染纸牌布局, 纸牌排成3行
+@param features: 纸牌特征, 形状为(n, 4), n为3的倍数, 按行优先的顺序排列
+@param long_side: 输出图像的长边(像素)
+@param rotation: 整幅图像的旋转角度(度)
+@param blur: 高斯模糊的标准差(输出分辨率下的像素)
+@param noise: 高斯噪声的标准差(灰度级)
+@param distance: 拍摄距离(相对值), 大于1时在布局四周加宽桌面, 纸牌在输出图像中按比例变小
+@param rng: numpy随机数生成器
+@return image: rgb图像
+@return truth: 真值, 包括"features"(形状为(3, n / 3, 4))和"centers"(纸牌中心在输出图像中的[行, 列])
+'''
+def render_layout (features, long_side = 1600, rotation = 0.0, blur = 0.0, noise = 0.0, distance = 1.0, rng = None):
+    if rng is None:
+        rng = np.random.default_rng()
+    features = np.asarray(features, dtype = int).reshape(-1, 4)
+    rows = 3
+    columns = features.shape[0] // rows
+    card_w, card_h = CARD_SIZE
+    margin = 40
+
+    # 按行排列纸牌
+    height = rows * (card_h + margin) + margin
+    width = columns * (card_w + margin) + margin
+    image = np.empty((height, width, 3), dtype = np.uint8)
+    image[...] = TABLE_COLOR
+    centers = np.zeros((rows, columns, 2))
+    for k in range(features.shape[0]):
+        r, c = divmod(k, columns)
+        top = margin + r * (card_h + margin)
+        left = margin + c * (card_w + margin)
+        image[top : top + card_h, left : left + card_w] = render_card(features[k])
+        centers[r, c] = (top + card_h / 2, left + card_w / 2)
+
+    # 拍摄距离较远时在四周加宽桌面
+    pad_row = int(round(height * (distance - 1) / 2))
+    pad_column = int(round(width * (distance - 1) / 2))
+    if pad_row > 0 or pad_column > 0:
+        image = cv.copyMakeBorder(image, pad_row, pad_row, pad_column, pad_column, cv.BORDER_CONSTANT, value = TABLE_COLOR)
+        centers += (pad_row, pad_column)
+        height, width = image.shape[:2]
+
+    # 整体旋转, 再缩放到目标分辨率
+    scale = long_side / max(height, width)
+    out_size = (int(round(width * scale)), int(round(height * scale)))
+    matrix = cv.getRotationMatrix2D((width / 2, height / 2), rotation, scale)
+    matrix[:, 2] += (np.array(out_size) - np.array([width, height])) / 2
+    image = cv.warpAffine(image, matrix, out_size, flags = cv.INTER_AREA, borderValue = TABLE_COLOR)
+    points = np.concatenate([centers[..., ::-1], np.ones(centers.shape[:-1] + (1,))], axis = -1) @ matrix.T
+    centers = points[..., ::-1]
+
+    # 模糊和噪声
+    if blur > 0:
+        image = cv.GaussianBlur(image, (0, 0), blur)
+    if noise > 0:
+        image = np.clip(image + rng.normal(0, noise, image.shape), 0, 255).astype(np.uint8)
+
+    truth = {"features": features.reshape(rows, columns, 4), "centers": centers}
+    return image, truth
+
+'''
+@brief 从81张纸牌中随机抽取并渲染一个布局
+@param rng: numpy随机数生成器
+@param cards_num: 纸牌数量, 3的倍数(12, 15, 18, 21)
+@param kwargs: 传给render_layout的参数
+@return image: rgb图像
+@return truth: 真值
+'''
+def random_layout (rng, cards_num = 12, **kwargs):
+    index = rng.choice(DECK.shape[0], cards_num, replace = False)
+    return render_layout(DECK[index], rng = rng, **kwargs)
+
+'''
+@brief 渲染多张桌面并排的图像, 每张桌面是一个独立的布局, 桌面之间留出空白
+@param rng: numpy随机数生成器
+@param tables_num: 桌面数量
+@param cards_num: 每张桌面的纸牌数量
+@param gap: 桌面之间空白的宽(像素), 为None时取桌面的高的一半(约为纸牌的宽的两倍)
+@param kwargs: 传给render_layout的参数, long_side为每张桌面的长边
+@return image: rgb图像
+@return truths: 每张桌面的真值, 从左到右排列, 其中的centers为在整幅图像中的坐标
+'''
+def random_tables (rng, tables_num = 3, cards_num = 12, gap = None, **kwargs):
+    tables = [random_layout(rng, cards_num, **kwargs) for _ in range(tables_num)]
+    height = max(table_image.shape[0] for table_image, _ in tables)
+    if gap is None:
+        gap = height // 2
+    width = sum(table_image.shape[1] for table_image, _ in tables) + gap * (tables_num - 1)
+    image = np.empty((height, width, 3), dtype = np.uint8)
+    image[...] = TABLE_COLOR
+
+    # 从左到右依次放置, 上下居中
+    truths = []
+    left = 0
+    for table_image, truth in tables:
+        top = (height - table_image.shape[0]) // 2
+        image[top : top + table_image.shape[0], left : left + table_image.shape[1]] = table_image
+        truth["centers"] = truth["centers"] + (top, left)
+        truths.append(truth)
+        left += table_image.shape[1] + gap
+    return image, truths
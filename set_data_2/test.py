@@ -1,7 +1,5 @@
 from PIL import Image
 import numpy
-import pylab
-from scipy.ndimage import label
 
 def crop_it(seg, card):
     rows = numpy.sum(card, axis=1)
@@ -12,6 +10,9 @@ def crop_it(seg, card):
     return seg[rinds[0][0]:rinds[0][-1],cinds[0][0]:cinds[0][-1]]
 
 def card_segmentation(img):
+    import pylab
+    from scipy.ndimage import label
+
 ##    for i in range(img.shape[-1]):
 ##        pylab.figure()
 ##        pylab.hist(img[:,:,i].ravel(),bins=range(256),log=True)